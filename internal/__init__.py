@@ -10,10 +10,44 @@ class Basic(Coloring):
     FNBUFFER_SELECT = ColorPair(color.BLACK, color.BLUE)
     FNBUFFER_SELECTION = ColorPair(color.WHITE, color.BLACK)
     UNCOVERED = ColorPair(color.BLUE, -1)
+    SEARCH_MATCH = ColorPair(color.BLACK, color.CYAN)
+    SYNTAX_KEYWORD = ColorPair(color.MAGENTA, -1)
+    SYNTAX_STRING = ColorPair(color.GREEN, -1)
+    SYNTAX_COMMENT = ColorPair(color.BLUE, -1)
+    SYNTAX_NUMBER = ColorPair(color.CYAN, -1)
+    BRACKET_MATCH = ColorPair(color.BLACK, color.MAGENTA)
 
 STATE = {
     'use_naive_mice': True,
     "use_mice": False,
+    "use_piece_table": False,
+    "tabstop": 4,
+    "soft_wrap": False,
+    # How long (ms) an ambiguous key sequence waits for its next key
+    "key_timeout": 1000,
+    "bracketed_paste": True,
+    # Longest time (ms) spent applying queued keys before the next repaint,
+    # 0 repaints after every key
+    "frame_budget": 33,
+    # Memory (bytes) the undo history may hold before old changes are dropped,
+    # its buffer snapshots get as much again
+    "undo_budget": 1024 ** 2 * 16,
+    # Changes between buffer snapshots kept for :earlier and :later
+    "undo_checkpoint": 100,
+    # Keep undo history across sessions in a .<name>.renvia-undo file saved on write
+    "undo_file": False,
+    # Journal unsaved changes to a .<name>.renvia-journal file, flushed every journal_sync ms
+    "journal": True,
+    "journal_sync": 1000,
+    # Index trigrams of memory-mapped files so searches skip lines that cannot match
+    "trigram_index": True,
+    # Colour files by their extension, lexing for at most highlight_budget ms a frame
+    "syntax_highlight": True,
+    "highlight_budget": 8,
+    # Highlight the bracket under the cursor and the one it pairs with
+    "match_brackets": True,
+    # Memory (bytes) open files may hold before saved ones not shown recently are unloaded
+    "buffer_budget": 1024 ** 2 * 64,
 }
 
 def use_mice():
@@ -28,3 +62,11 @@ def disable_mice():
     STATE['use_mice'] = False
     curses.mousemask(-1)
     print("\033[?1002;1005l\n", flush=True)
+
+def use_bracketed_paste():
+    """Ask the terminal to wrap pasted text in ESC[200~ ... ESC[201~"""
+    print("\033[?2004h", end="", flush=True)
+
+def disable_bracketed_paste():
+    """Stop bracketing pasted text"""
+    print("\033[?2004l", end="", flush=True)
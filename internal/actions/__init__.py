@@ -1,6 +1,7 @@
 """Actions"""
 # pylint: disable=unused-argument
 
+from sys import getsizeof
 from typing import TYPE_CHECKING, Any
 from lymia import ReturnInfo, ReturnType
 
@@ -11,6 +12,8 @@ if TYPE_CHECKING:
 class Action:
     """Action"""
 
+    __slots__ = ()
+
     def execute(self, editor: "EditorState") -> ReturnType | ReturnInfo:
         """Execute this action"""
         return NotImplemented
@@ -19,5 +22,15 @@ class Action:
         """Undo this action"""
         return NotImplemented
 
+    def merge(self, other: "Action") -> bool:
+        """Absorb `other`, pushed right after this action, return whether it did"""
+        return False
+
+    def cost(self) -> int:
+        """Approximate memory held by this action, in bytes"""
+        return getsizeof(self) + sum(
+            getsizeof(getattr(self, name)) for name in self.__slots__
+        )
+
     def __repr__(self) -> str:
         return f"<{type(self).__name__}>"
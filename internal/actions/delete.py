@@ -1,11 +1,16 @@
 """Delete"""
 
+from sys import getsizeof
+
 from internal.editor import EditorState
 from lymia import ReturnInfo, ReturnType
 from . import Action
 
 class DeleteAction(Action):
     """used for EditMode"""
+
+    __slots__ = ("_row", "_col", "_text", "_delcount")
+
     def __init__(self, row: int, col: int, text: str, delcount: int = -1) -> None:
         self._row = row
         self._col = col
@@ -29,8 +34,7 @@ class DeleteAction(Action):
             else:
                 editor.buffer[row] = new
             bufferlines.pop(0)
-            for index, _ in enumerate(bufferlines, 1):
-                editor.buffer.delete(row - index)
+            editor.buffer.delete_lines(row - len(bufferlines), len(bufferlines))
             return ReturnType.OK
 
         old = editor.buffer[row]
@@ -52,8 +56,7 @@ class DeleteAction(Action):
             # i0 = bufferlines[-1]
             # editor.buffer.insert(n0row, i0[::-1])
             # bufferlines = bufferlines[:-1]
-            for _, line in enumerate(bufferlines, 0):
-                editor.buffer.insert(n0row, line[::-1])
+            editor.buffer.insert_lines(n0row, [line[::-1] for line in reversed(bufferlines)])
             return ReturnType.CONTINUE
 
         # ???
@@ -76,3 +79,66 @@ class DeleteAction(Action):
         new = delta[::-1] + old
         editor.buffer[row] = new
         return ReturnType.OK
+
+
+class RemoveAction(Action):
+    """Text removed at (row, col), the inverse of EditAction, used for NormalMode"""
+
+    __slots__ = ("_row", "_col", "_text")
+
+    def __init__(self, row: int, col: int, text: str) -> None:
+        self._row = row
+        self._col = col
+        self._text = text
+
+    def execute(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        editor.buffer.delete_block(self._row, self._col, self._text)
+        editor.cursor.move_to(self._row, self._col)
+        return ReturnType.OK
+
+    def undo(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        editor.buffer.insert_block(self._row, self._col, self._text)
+        editor.cursor.move_to(self._row, self._col)
+        return ReturnType.OK
+
+    def merge(self, other: Action) -> bool:
+        if type(other) is not type(self) or other._row != self._row or "\n" in other._text:
+            return False
+        if other._col == self._col:  # deleting forward
+            self._text += other._text
+            return True
+        if other._col + len(other._text) == self._col:  # deleting backward
+            self._text = other._text + self._text
+            self._col = other._col
+            return True
+        return False
+
+
+class DeleteLinesAction(Action):
+    """Whole lines removed from the buffer, used for NormalMode"""
+
+    __slots__ = ("_row", "_lines")
+
+    def __init__(self, row: int, lines: list[str]) -> None:
+        self._row = row
+        self._lines = lines
+
+    def execute(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        editor.buffer.delete_lines(self._row, len(self._lines))
+        editor.cursor.move_to(min(self._row, max(editor.buffer.size - 1, 0)), 0)
+        return ReturnType.OK
+
+    def undo(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        editor.buffer.insert_lines(self._row, self._lines)
+        editor.cursor.move_to(self._row, 0)
+        return ReturnType.OK
+
+    def merge(self, other: Action) -> bool:
+        # Deleting the line that moved up into the same row
+        if type(other) is not type(self) or other._row != self._row:
+            return False
+        self._lines.extend(other._lines)
+        return True
+
+    def cost(self) -> int:
+        return super().cost() + sum(map(getsizeof, self._lines))
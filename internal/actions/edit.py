@@ -6,51 +6,34 @@ from . import Action
 
 class EditAction(Action):
     """used for EditMode"""
+
+    __slots__ = ("_row", "_col", "_text")
+
     def __init__(self, row: int, col: int, text: str) -> None:
         self._row = row
         self._col = col
         self._text = text
 
     def execute(self, editor: EditorState) -> ReturnType | ReturnInfo:
-        row = self._row
-        col = self._col
-        buffer_lines = self._text.splitlines()
-        old = editor.buffer[row]
-        if col == (len(old) - 1):
-            prev = old[:col]
-            current = buffer_lines[0]
-            fcrow = prev + current
-        else:
-            prev_left = old[:col]
-            prev_right = old[col:]
-            current = buffer_lines[0]
-            fcrow = prev_left + current
-            editor.buffer[row] = fcrow
-            if len(buffer_lines) == 1:
-                editor.buffer[row] = fcrow + prev_right
-            last = buffer_lines[-1] + prev_right
-            lcur = len(buffer_lines[-1]) - 1
-            editor.cursor.move_to(row + len(buffer_lines) - 1, lcur)
-            buffer_lines[-1] = last
-        for index, line in enumerate(buffer_lines[1:], 1):
-            editor.buffer.insert(row + index, line)
+        row, col = editor.buffer.insert_block(self._row, self._col, self._text)
+        editor.cursor.move_to(row, col)
         return ReturnType.OK
 
     def undo(self, editor: EditorState) -> ReturnType | ReturnInfo:
-        row = self._row
-        col = self._col
-        prev_last = ""
-        buffer_lines = self._text.splitlines()
-        old = editor.buffer[row]
-        prev = old[:col]
-        last = buffer_lines[-1]
-        prl = editor.buffer[row + buffer_lines.index(last)]
-        if last != prl:
-            prev_last = prl.replace(last, "")
-        for index, line in enumerate(buffer_lines[1:], 1):
-            if line != buffer_lines[index] and line != last: # type: ignore
-                raise ValueError(f"Line {index} has mismarch data from actual buffer")
-            editor.buffer.delete(row + 1)
-        editor.buffer[row] = prev + prev_last
-        editor.cursor.move_to(row, col)
+        editor.buffer.delete_block(self._row, self._col, self._text)
+        editor.cursor.move_to(self._row, self._col)
         return ReturnType.OK
+
+    def end(self):
+        """(row, col) right after the inserted text"""
+        lines = self._text.split("\n")
+        if len(lines) == 1:
+            return self._row, self._col + len(self._text)
+        return self._row + len(lines) - 1, len(lines[-1])
+
+    def merge(self, other: Action) -> bool:
+        # Typing that continues where this insert ended
+        if type(other) is not type(self) or (other._row, other._col) != self.end():
+            return False
+        self._text += other._text
+        return True
@@ -0,0 +1,30 @@
+"""Replace"""
+
+from sys import getsizeof
+
+from internal.editor import EditorState
+from lymia import ReturnInfo, ReturnType
+from . import Action
+
+class ReplaceLinesAction(Action):
+    """Lines rewritten in place, `rows` ascending, used for :s"""
+
+    __slots__ = ("_rows", "_before", "_after")
+
+    def __init__(self, rows: list[int], before: list[str], after: list[str]) -> None:
+        self._rows = rows
+        self._before = before
+        self._after = after
+
+    def execute(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        editor.buffer.replace_lines(self._rows, self._after)
+        editor.cursor.move_to(self._rows[-1], 0)
+        return ReturnType.OK
+
+    def undo(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        editor.buffer.replace_lines(self._rows, self._before)
+        editor.cursor.move_to(self._rows[0], 0)
+        return ReturnType.OK
+
+    def cost(self) -> int:
+        return super().cost() + sum(map(getsizeof, self._before)) + sum(map(getsizeof, self._after))
@@ -0,0 +1,375 @@
+"""Bracket pairs, finds the bracket paired with another
+
+Each line is scanned with a stack per bracket type. Pairs within a line
+are found again by rescanning it, only the counts of its unmatched
+closers and openers are kept. Lines sit in a treap like the wrap index,
+every node carrying the unmatched counts of its subtree, so the line
+holding the partner of an unmatched bracket is found in O(log n).
+
+The tree is built by a worker thread, lookups that cannot wait find no
+partner across lines until it is done."""
+
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from random import random
+from threading import Thread
+from typing import TYPE_CHECKING, Iterable, Sequence
+
+from internal.trigram import read_lines
+
+if TYPE_CHECKING:
+    from internal.buffer import Buffer
+
+# Opener and closer of every bracket type, in that order
+BRACKETS = "()[]{}"
+NONE = (0, 0, 0)
+
+_bracket = re.compile(r"[()\[\]{}]")
+Counts = tuple[int, int, int]
+
+
+def scan(line: str) -> tuple[dict[int, int], list[list[int]], list[list[int]]]:
+    """Columns of the pairs within line both ways, then the columns of its
+    unmatched closers and openers per bracket type"""
+    pairs: dict[int, int] = {}
+    closes: list[list[int]] = [[], [], []]
+    opens: list[list[int]] = [[], [], []]
+    for match in _bracket.finditer(line):
+        col = match.start()
+        kind, closing = divmod(BRACKETS.index(line[col]), 2)
+        if not closing:
+            opens[kind].append(col)
+        elif opens[kind]:
+            other = opens[kind].pop()
+            pairs[other] = col
+            pairs[col] = other
+        else:
+            closes[kind].append(col)
+    return pairs, closes, opens
+
+
+@lru_cache(maxsize=4096)
+def _counts(line: str) -> tuple[Counts, Counts]:
+    """Unmatched (closes, opens) of line, cached as lines such as "}" recur"""
+    if not _bracket.search(line):
+        return NONE, NONE
+    _, closes, opens = scan(line)
+    return tuple(map(len, closes)), tuple(map(len, opens))  # type: ignore
+
+
+def _join(closes: Counts, opens: Counts, after_closes: Counts, after_opens: Counts):
+    """Unmatched (closes, opens) of two spans of lines, one after the other"""
+    if after_closes == NONE and after_opens == NONE:
+        return closes, opens
+    if closes == NONE and opens == NONE:
+        return after_closes, after_opens
+    close0, close1, close2 = closes
+    open0, open1, open2 = opens
+    after_close0, after_close1, after_close2 = after_closes
+    after_open0, after_open1, after_open2 = after_opens
+    # Openers before are closed by closers after, type by type
+    match0 = min(open0, after_close0)
+    match1 = min(open1, after_close1)
+    match2 = min(open2, after_close2)
+    return (
+        (close0 + after_close0 - match0, close1 + after_close1 - match1, close2 + after_close2 - match2),
+        (open0 + after_open0 - match0, open1 + after_open1 - match1, open2 + after_open2 - match2),
+    )
+
+
+class Lines:
+    """A line with brackets, or a run of lines without any"""
+
+    __slots__ = (
+        "count", "closes", "opens", "prio", "lines_total", "total_closes", "total_opens",
+        "left", "right",
+    )
+
+    def __init__(self, count: int, closes: Counts = NONE, opens: Counts = NONE) -> None:
+        self.count = count
+        self.closes = closes
+        self.opens = opens
+        self.prio = random()
+        self.lines_total = count
+        self.total_closes = closes
+        self.total_opens = opens
+        self.left: "Lines | None" = None
+        self.right: "Lines | None" = None
+
+
+def _update(node: Lines):
+    closes, opens = node.closes, node.opens
+    node.lines_total = node.count
+    if node.left:
+        closes, opens = _join(node.left.total_closes, node.left.total_opens, closes, opens)
+        node.lines_total += node.left.lines_total
+    if node.right:
+        closes, opens = _join(closes, opens, node.right.total_closes, node.right.total_opens)
+        node.lines_total += node.right.lines_total
+    node.total_closes = closes
+    node.total_opens = opens
+
+
+def _merge(left: Lines | None, right: Lines | None) -> Lines | None:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.prio > right.prio:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _split(node: Lines | None, lines: int) -> tuple[Lines | None, Lines | None]:
+    """Split tree into (first `lines` lines, the rest)"""
+    if node is None:
+        return None, None
+    ltotal = node.left.lines_total if node.left else 0
+    if lines <= ltotal:
+        left, node.left = _split(node.left, lines)
+        _update(node)
+        return left, node
+    if lines >= ltotal + node.count:
+        node.right, right = _split(node.right, lines - ltotal - node.count)
+        _update(node)
+        return node, right
+    # Only runs without brackets span several lines, so they can be cut anywhere
+    offset = lines - ltotal
+    tail = Lines(node.count - offset)
+    tail.prio = node.prio
+    tail.right = node.right
+    _update(tail)
+    node.count = offset
+    node.right = None
+    _update(node)
+    return node, tail
+
+
+def _build(lines: Iterable[str]) -> Lines | None:
+    """Treap of lines, built in one pass"""
+    stack: list[Lines] = []
+
+    def push(node: Lines):
+        last = None
+        while stack and stack[-1].prio < node.prio:
+            last = stack.pop()
+            _update(last)
+        node.left = last
+        if stack:
+            stack[-1].right = node
+        stack.append(node)
+
+    plain = 0
+    for line in lines:
+        closes, opens = _counts(line)
+        if closes == NONE and opens == NONE:
+            plain += 1
+            continue
+        if plain:
+            push(Lines(plain))
+            plain = 0
+        push(Lines(1, closes, opens))
+    if plain:
+        push(Lines(plain))
+    for node in reversed(stack):
+        _update(node)
+    return stack[0] if stack else None
+
+
+def _forward(node: Lines | None, kind: int, need: int) -> tuple[int, int] | None:
+    """(line, n) where the n-th unmatched closer of kind closes the need-th
+    opener left open before the tree, lines counted from its start"""
+    row = 0
+    while node:
+        left = node.left
+        if left is not None:
+            if left.total_closes[kind] >= need:
+                node = left
+                continue
+            need += left.total_opens[kind] - left.total_closes[kind]
+            row += left.lines_total
+        if node.closes[kind] >= need:
+            return row, need
+        need += node.opens[kind] - node.closes[kind]
+        row += node.count
+        node = node.right
+    return None
+
+
+def _backward(node: Lines | None, kind: int, need: int) -> tuple[int, int] | None:
+    """(line, n) where the n-th unmatched opener of kind from the right opens
+    the need-th closer left open after the tree, lines counted from its start"""
+    row = 0
+    while node:
+        own = row + (node.left.lines_total if node.left else 0)
+        right = node.right
+        if right is not None:
+            if right.total_opens[kind] >= need:
+                row = own + node.count
+                node = right
+                continue
+            need += right.total_closes[kind] - right.total_opens[kind]
+        if node.opens[kind] >= need:
+            return own, need
+        need += node.closes[kind] - node.opens[kind]
+        node = node.left
+    return None
+
+
+class BracketIndex:
+    """Unmatched bracket counts of every line, see the module docstring.
+    Built on the first lookup, edited lines are rescanned on the next one."""
+
+    def __init__(self) -> None:
+        self._root: Lines | None = None
+        self._built = False
+        # Lines changed since they were scanned, ascending
+        self._stale: list[int] = []
+        # Edits made while the worker builds, applied once it is done
+        self._log: list[tuple[str, int, object]] = []
+        self._worker: Thread | None = None
+        self._result: tuple[Lines | None] | None = None
+
+    def reset(self):
+        """Drop the index, the whole buffer changed"""
+        self._root = None
+        self._built = False
+        self._stale = []
+        self._log.clear()
+        self._worker = None
+        self._result = None
+
+    @property
+    def building(self):
+        """Whether the worker is still building the index"""
+        return self._worker is not None and self._result is None
+
+    def build(self, lines: Sequence[str]):
+        """Index lines in a worker thread, they must not change meanwhile"""
+        self.reset()
+
+        def work():
+            try:
+                root = _build(read_lines(lines, 0, len(lines)))
+            except (ValueError, IndexError):  # the file was remapped under us
+                if self._worker is worker:
+                    self._worker = None
+                return
+            if self._worker is worker:
+                self._result = (root,)
+
+        worker = self._worker = Thread(target=work, name="renvia-brackets", daemon=True)
+        worker.start()
+
+    @property
+    def ready(self):
+        """Whether the index is built, finishing a build that is done"""
+        if not self._built and self._result is not None:
+            (self._root,) = self._result
+            self._result = None
+            self._worker = None
+            self._built = True
+            log, self._log = self._log, []
+            for kind, row, value in log:
+                if kind == "change":
+                    self.change(row)
+                else:
+                    getattr(self, kind)(row, value)
+        return self._built
+
+    def _pending(self, kind: str, row: int, value: object):
+        if self._built:
+            return False
+        if self._worker is not None:
+            self._log.append((kind, row, value))
+        return True
+
+    def change(self, row: int):
+        """Line row was rewritten"""
+        if self._pending("change", row, None):
+            return
+        index = bisect_left(self._stale, row)
+        if index == len(self._stale) or self._stale[index] != row:
+            self._stale.insert(index, row)
+
+    def insert(self, row: int, lines: list[str]):
+        """Lines were inserted before row"""
+        if self._pending("insert", row, lines):
+            return
+        self._shift(row, len(lines))
+        left, right = _split(self._root, row)
+        self._root = _merge(_merge(left, _build(lines)), right)
+
+    def delete(self, row: int, count: int):
+        """Lines [row, row + count) were deleted"""
+        if self._pending("delete", row, count):
+            return
+        del self._stale[bisect_left(self._stale, row):bisect_left(self._stale, row + count)]
+        self._shift(row, -count)
+        left, rest = _split(self._root, row)
+        _, right = _split(rest, count)
+        self._root = _merge(left, right)
+
+    def _shift(self, row: int, count: int):
+        stale = self._stale
+        for index in range(bisect_left(stale, row), len(stale)):
+            stale[index] += count
+
+    def _refresh(self, buffer: "Buffer", wait: bool):
+        """Bring the index up to date, False if it is not built and wait is
+        not set, a build is started then"""
+        if not self.ready:
+            worker = self._worker
+            if not wait:
+                if worker is None:
+                    self.build(buffer.frozen())
+                return False
+            if worker is not None:
+                worker.join()
+            if not self.ready:  # no build or it failed, do it here
+                self.reset()
+                self._root = _build(read_lines(buffer.frozen(), 0, buffer.size))
+                self._built = True
+        for row in self._stale:
+            left, rest = _split(self._root, row)
+            node, right = _split(rest, 1)
+            if node is not None:
+                node.closes, node.opens = _counts(buffer[row])
+                _update(node)
+            self._root = _merge(_merge(left, node), right)
+        self._stale.clear()
+        return True
+
+    def match(self, buffer: "Buffer", row: int, col: int, wait: bool = False) -> tuple[int, int] | None:
+        """Position of the bracket paired with the one at (row, col), None
+        if it is unpaired or there is no bracket there. Unless wait is set,
+        a partner on another line is not found while the index builds."""
+        line = buffer[row]
+        if not 0 <= col < len(line) or line[col] not in BRACKETS:
+            return None
+        pairs, closes, opens = scan(line)
+        if col in pairs:
+            return row, pairs[col]
+        kind, closing = divmod(BRACKETS.index(line[col]), 2)
+        if not self._refresh(buffer, wait):
+            return None
+        # Brackets left open between this one and its partner come first
+        left, rest = _split(self._root, row)
+        mid, right = _split(rest, 1)
+        if closing:
+            found = _backward(left, kind, closes[kind].index(col) + 1)
+        else:
+            found = _forward(right, kind, len(opens[kind]) - opens[kind].index(col))
+        self._root = _merge(_merge(left, mid), right)
+        if found is None:
+            return None
+        other, need = found
+        if closing:
+            return other, scan(buffer[other])[2][kind][-need]
+        other += row + 1
+        return other, scan(buffer[other])[1][kind][need - 1]
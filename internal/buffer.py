@@ -1,26 +1,297 @@
 """Buffer"""
 
+import os
+from array import array
+from collections import OrderedDict
+from itertools import islice
 from os import stat
+from sys import getsizeof, maxsize
+from tempfile import mkstemp
+from typing import Iterable, Sequence
 
 from lymia import ReturnInfo, ReturnType
+from internal.brackets import BracketIndex
+from internal.piecetable import PieceTable
+from internal.gapbuffer import GapBuffer
+from internal.mapped import MappedLines, index_newlines
+from internal.syntax import Highlighter, Lexer
+from internal.trigram import TrigramIndex
+from internal.width import TABSTOP, col_at, is_simple, prefix_widths, wrap_starts
+from internal.wrap import WrapIndex
 
+# Files at or above this size are memory-mapped and decoded lazily
 BUFFER_MAX_SIZE = (1024 ** 2) * 1
+# Bytes written per chunk when saving
+WRITE_CHUNK = 1024 * 64
+# Largest tail, in bytes on disk and characters in the buffer, rewritten
+# in place on save, larger ones go through a temporary file
+TAIL_WRITE_MAX = 1024 * 256
+# First dirty line of a buffer that matches the disk
+CLEAN = maxsize
+# Lines whose display widths are kept, see Buffer.cells()
+CELLS_CACHE = 1024
+# Memory a line takes besides its text, see Buffer.footprint
+LINE_BYTES = getsizeof("") + 8
+
+def _line_offsets(data: bytes, count: int):
+    """Line start offsets of data, None when they cannot map to `count` lines"""
+    if b"\r" in data:
+        return None
+    offsets = array("Q", [0] if data else [])
+    index_newlines(data, offsets, 0, len(data))
+    if len(offsets) != count:
+        return None
+    return offsets
 
 class Buffer:
     """Buffer zone"""
 
-    def __init__(self, filename: str = "", buffer: list[str] | None = None) -> None:
+    def __init__(
+        self,
+        filename: str = "",
+        buffer: list[str] | None = None,
+        piece_table: bool = False,
+        trigrams: bool = False,
+    ) -> None:
         self._filename: str = filename
-        self._buffer: list[str] = buffer or []
+        self._piece_table = piece_table
+        # Trigram index of memory-mapped files, see candidates()
+        self._trigrams: TrigramIndex | None = TrigramIndex() if trigrams else None
+        self._buffer: list[str] | PieceTable | MappedLines = self._storage(buffer or [])
         self._dirty: bool = False
+        # Lowest modified line and line start offsets of the file on disk,
+        # used to only rewrite the changed tail on save.
+        self._first_dirty: int = CLEAN
+        self._offsets: array | None = None
+        self._disk: tuple[int, int] | None = None
+        # Lines changed in place and the first line shifted by an insert or
+        # delete since the renderer last asked, see take_damage().
+        self._damage: set[int] = set()
+        self._damage_from: int = CLEAN
+        # Stable per-line ids and in-place edit versions, see line_key()
+        self._ids: PieceTable | None = None
+        self._versions: dict[int, int] = {}
+        self._next_id = 0
+        self._clock = 0
+        # Bumped on every change, see changes
+        self._changes = 0
+        self._wrap: WrapIndex | None = None
+        self._syntax: Highlighter | None = None
+        self._brackets = BracketIndex()
+        self._reset_ids(len(self._buffer))
+        self._cells: "OrderedDict[int, tuple[int, int, list[int] | None]]" = OrderedDict()
+        self.tabstop = TABSTOP
+        self._active_row: int = -1
+        self._active_line: GapBuffer | None = None
+        self._mapped: MappedLines | None = None
         self.read()
 
+    def _storage(self, lines: list[str]):
+        if self._piece_table:
+            return PieceTable(lines)
+        return lines
+
+    def _reset_ids(self, count: int):
+        if self._wrap is not None:
+            self._wrap = WrapIndex(count, self._wrap.width)
+        # Ids are never reused, so caches keyed on them cannot go stale
+        base = self._next_id
+        self._ids = PieceTable(range(base, base + count))
+        self._versions.clear()
+        self._next_id = base + count
+
+    def _new_ids(self, pos: int, count: int):
+        if self._ids is not None:
+            self._ids.insert_lines(pos, range(self._next_id, self._next_id + count))
+        self._next_id += count
+
+    def line_key(self, index: int) -> tuple[int, int]:
+        """(line id, version) of a line
+
+        The id survives lines being inserted or deleted around it and the
+        version changes whenever the line text does, so the pair can key
+        caches without hashing the text."""
+        if self._ids is None:  # still loading, nothing can be edited yet
+            if index < 0:
+                index += len(self._buffer)
+            return self._next_id + index, 0
+        line_id = self._ids[index]
+        return line_id, self._versions.get(line_id, 0)
+
+    def cells(self, index: int) -> list[int] | None:
+        """Cumulative display widths of a line, None when every character
+        takes one cell. Cached per line id and dropped when its version changes."""
+        if self._is_active(index) and self._active_line.simple:  # type: ignore
+            return None
+        line_id, version = self.line_key(index)
+        cached = self._cells.get(line_id)
+        if cached and cached[0] == version and cached[1] == self.tabstop:
+            self._cells.move_to_end(line_id)
+            return cached[2]
+        line = self[index]
+        widths = None if is_simple(line) else prefix_widths(line, self.tabstop)
+        self._cells[line_id] = (version, self.tabstop, widths)
+        if len(self._cells) > CELLS_CACHE:
+            self._cells.popitem(last=False)
+        return widths
+
+    def display_width(self, index: int) -> int:
+        """Display cells taken by a whole line"""
+        widths = self.cells(index)
+        return self.sizeof_line(index) if widths is None else widths[-1]
+
+    def wrap_index(self, width: int) -> WrapIndex:
+        """Soft-wrap index for `width` cells, maintained across edits from now on"""
+        if self._wrap is None or self._wrap.width != width:
+            self._wrap = WrapIndex(len(self._buffer), width)
+        elif self._wrap.lines < len(self._buffer):  # still loading
+            self._wrap.insert(self._wrap.lines, len(self._buffer) - self._wrap.lines)
+        return self._wrap
+
+    def disable_wrap(self):
+        """Stop maintaining the soft-wrap index"""
+        self._wrap = None
+
+    def highlight(self, lexer: Lexer | None) -> Highlighter | None:
+        """Syntax highlighter of lexer, maintained across edits from now on"""
+        self._syntax = Highlighter(lexer) if lexer is not None else None
+        return self._syntax
+
+    @property
+    def syntax(self):
+        """Syntax highlighter, None when the buffer is not highlighted"""
+        return self._syntax
+
+    def wrap_starts(self, index: int) -> list[int]:
+        """Cells where each soft-wrapped row of a line starts"""
+        width = self._wrap.width if self._wrap else 0
+        widths = self.cells(index)
+        if width <= 0:
+            return [0]
+        if widths is None:
+            # Leave room for the cursor past the last character
+            return list(range(0, self.sizeof_line(index) + 1, width))
+        return wrap_starts(widths, width)
+
+    def measure(self, index: int):
+        """Update the soft-wrap rows of a line, return its row starts"""
+        starts = self.wrap_starts(index)
+        if self._wrap is not None:
+            self._wrap.set_rows(index, len(starts))
+        return starts
+
+    def cell_of(self, index: int, col: int) -> int:
+        """Display cell where column `col` of a line starts"""
+        widths = self.cells(index)
+        if widths is None:
+            return col
+        return widths[max(min(col, len(widths) - 1), 0)]
+
+    def col_at(self, index: int, cell: int) -> int:
+        """Column of a line shown at display cell `cell`"""
+        widths = self.cells(index)
+        if widths is None:
+            return cell
+        return col_at(widths, cell)
+
+    def _is_active(self, index: int):
+        if self._active_line is None:
+            return False
+        return index in (self._active_row, self._active_row - len(self._buffer))
+
     def __getitem__(self, index: int):
+        if self._is_active(index):
+            return str(self._active_line)
         return self._buffer[index]
 
+    def line_slice(self, index: int, start: int, end: int) -> str:
+        """Characters [start, end) of a line, the line being edited is not joined"""
+        if self._is_active(index):
+            return self._active_line.slice(start, end)  # type: ignore
+        return self._buffer[index][start:end]
+
     def __setitem__(self, index: int, line: str):
-        self._dirty = True
+        self.flush()
+        self._mark(index)
         self._buffer[index] = line
+        if self._trigrams is not None:
+            self._trigrams.replace(index % len(self._buffer), line)
+
+    def _mark(self, pos: int, structural: bool = False):
+        """Mark the buffer dirty from line `pos` onward"""
+        self._dirty = True
+        self._changes += 1
+        if pos < 0:
+            pos = max(pos + len(self._buffer), 0)
+        self._first_dirty = min(self._first_dirty, pos)
+        if structural:
+            self._damage_from = min(self._damage_from, pos)
+            return
+        self._damage.add(pos)
+        if self._syntax is not None:
+            self._syntax.change(pos)
+        self._brackets.change(pos)
+        if self._ids is not None and pos < len(self._ids):
+            self._clock += 1
+            self._versions[self._ids[pos]] = self._clock
+
+    def take_damage(self):
+        """Return and reset (changed lines, first shifted line or CLEAN)"""
+        damage, damage_from = self._damage, self._damage_from
+        self._damage = set()
+        self._damage_from = CLEAN
+        return damage, damage_from
+
+    @property
+    def changes(self):
+        """Counter that moves on every change, equal values mean equal contents"""
+        return self._changes
+
+    @property
+    def active_row(self):
+        """Row held in the gap buffer, -1 if none"""
+        return self._active_row
+
+    def _settle(self):
+        """Wait for a progressive load, then switch to editable storage"""
+        if self._mapped is None or isinstance(self._buffer, PieceTable):
+            return
+        self._mapped.wait()
+        self._buffer = PieceTable(self._mapped)
+        self._reset_ids(len(self._buffer))
+        self._offsets = None if self._mapped.crlf else self._mapped.offsets
+
+    def flush(self):
+        """Materialise the actively edited line back into the buffer"""
+        self._settle()
+        if self._active_line is None:
+            return
+        line = str(self._active_line)
+        self._buffer[self._active_row] = line
+        if self._trigrams is not None:
+            self._trigrams.replace(self._active_row, line)
+        self._active_line = None
+        self._active_row = -1
+
+    def _edit_line(self, row: int):
+        self._settle()
+        if row < 0:
+            row += len(self._buffer)
+        if self._active_line is None or self._active_row != row:
+            self.flush()
+            self._active_line = GapBuffer(self._buffer[row])
+            self._active_row = row
+        return self._active_line
+
+    def insert_text(self, row: int, col: int, text: str):
+        """Insert text to a line at a column"""
+        self._edit_line(row).insert(col, text)
+        self._mark(row)
+
+    def delete_text(self, row: int, col: int, count: int = 1):
+        """Delete text from a line at a column, return deleted text"""
+        self._mark(row)
+        return self._edit_line(row).delete(col, count)
 
     @property
     def filename(self):
@@ -35,8 +306,51 @@ class Buffer:
     @property
     def buffer(self):
         """Buffer"""
+        self.flush()
         return tuple(self._buffer)
 
+    @property
+    def lazy(self):
+        """Whether the buffer is backed by a memory-mapped file"""
+        return self._mapped is not None
+
+    @property
+    def loading(self):
+        """Whether lines are still being indexed in the background"""
+        return self._mapped is not None and not self._mapped.ready
+
+    @property
+    def load_progress(self):
+        """Background indexing progress, from 0.0 to 1.0"""
+        return self._mapped.progress if self._mapped else 1.0
+
+    def wait_loaded(self, index: int = -1):
+        """Block until line `index` is indexed, or the whole file if -1"""
+        if self._mapped:
+            self._mapped.wait(index)
+
+    def cancel_load(self):
+        """Stop a progressive load"""
+        if self._mapped:
+            self._mapped.cancel()
+
+    def close(self):
+        """Release the file mapping and indexes, the buffer is not used after this"""
+        if self._trigrams is not None:
+            self._trigrams.stop()
+        self._brackets.reset()
+        if self._mapped:
+            self._mapped.close()
+            self._mapped = None
+
+    @property
+    def footprint(self):
+        """Rough bytes held by the lines, from the size on disk. A file still
+        memory-mapped only counts its line offsets."""
+        if isinstance(self._buffer, MappedLines):
+            return len(self._buffer) * 8
+        return (self._disk[0] if self._disk else 0) + len(self._buffer) * LINE_BYTES
+
     @property
     def dirty(self):
         """Dirty flag"""
@@ -44,7 +358,18 @@ class Buffer:
 
     def insert(self, pos: int, line: str):
         """Insert a text to a line"""
-        self._dirty = True
+        self.flush()
+        self._mark(pos, True)
+        self._new_ids(pos, 1)
+        if self._wrap is not None:
+            self._wrap.insert(pos, 1)
+        size = len(self._buffer)
+        row = min(pos, size) if pos >= 0 else max(pos + size, 0)
+        if self._trigrams is not None:
+            self._trigrams.insert(row, [line])
+        if self._syntax is not None:
+            self._syntax.insert(row, 1)
+        self._brackets.insert(row, [line])
         self._buffer.insert(pos, line)
 
     def replace(self, pos: int, line: str):
@@ -53,42 +378,349 @@ class Buffer:
 
     def delete(self, pos: int):
         """Delete a line text"""
-        self._dirty = True
+        self.flush()
+        self._mark(pos, True)
+        if self._ids is not None:
+            self._versions.pop(self._ids.pop(pos), None)
+        if self._wrap is not None:
+            self._wrap.delete(pos if pos >= 0 else pos + self._wrap.lines, 1)
+        if self._trigrams is not None:
+            self._trigrams.delete(pos % len(self._buffer), 1)
+        if self._syntax is not None:
+            self._syntax.delete(pos % len(self._buffer), 1)
+        self._brackets.delete(pos % len(self._buffer), 1)
         self._buffer.pop(pos)
 
+    def replace_lines(self, rows: Sequence[int], lines: Sequence[str]):
+        """Replace many lines at once, `rows` ascending"""
+        self.flush()
+        for row, line in zip(rows, lines):
+            self._mark(row)
+            self._buffer[row] = line
+            if self._trigrams is not None:
+                self._trigrams.replace(row, line)
+
+    def candidates(self, literals: list[str]) -> list[tuple[int, int]] | None:
+        """Row ranges [start, end) that may hold text containing every one of
+        literals, None when all rows may"""
+        if self._trigrams is None or self.loading:
+            return None
+        if self._active_line is not None:
+            self.flush()
+        return self._trigrams.candidates(literals)
+
+    def match_bracket(self, row: int, col: int, wait: bool = False) -> tuple[int, int] | None:
+        """Position of the bracket paired with the one at (row, col), None if
+        there is none. A file still loading has no pairs, pairs across lines
+        are only found once the index is built unless wait is set."""
+        if self.loading or row >= len(self._buffer):
+            return None
+        return self._brackets.match(self, row, col, wait)
+
+    @property
+    def indexing_brackets(self):
+        """Whether the bracket index is being built in the background"""
+        return self._brackets.building
+
+    def lines(self, start: int, end: int) -> list[str]:
+        """Lines in [start, end), read in one pass"""
+        self.flush()
+        if isinstance(self._buffer, PieceTable):
+            return list(islice(self._buffer.iter_from(start), end - start))
+        return list(self._buffer[start:end])
+
+    def insert_lines(self, pos: int, lines: list[str]):
+        """Insert multiple lines at once"""
+        if not lines:
+            return
+        self.flush()
+        self._mark(pos, True)
+        self._new_ids(pos, len(lines))
+        if self._wrap is not None:
+            self._wrap.insert(pos, len(lines))
+        size = len(self._buffer)
+        row = min(pos, size) if pos >= 0 else max(pos + size, 0)
+        if self._trigrams is not None:
+            self._trigrams.insert(row, lines)
+        if self._syntax is not None:
+            self._syntax.insert(row, len(lines))
+        self._brackets.insert(row, lines)
+        if isinstance(self._buffer, PieceTable):
+            self._buffer.insert_lines(pos, lines)
+        else:
+            self._buffer[pos:pos] = lines
+
+    def delete_lines(self, pos: int, count: int):
+        """Delete multiple lines at once"""
+        if count <= 0:
+            return
+        self.flush()
+        self._mark(pos, True)
+        if self._ids is not None and -len(self._ids) <= pos < len(self._ids):
+            if self._versions:
+                start = pos if pos >= 0 else pos + len(self._ids)
+                for line_id in islice(self._ids.iter_from(start), count):
+                    self._versions.pop(line_id, None)
+            self._ids.delete_lines(pos, count)
+        if self._wrap is not None:
+            self._wrap.delete(pos if pos >= 0 else pos + self._wrap.lines, count)
+        row = pos if pos >= 0 else pos + len(self._buffer)
+        if self._trigrams is not None:
+            self._trigrams.delete(row, count)
+        if self._syntax is not None:
+            self._syntax.delete(row, count)
+        self._brackets.delete(row, count)
+        if isinstance(self._buffer, PieceTable):
+            self._buffer.delete_lines(pos, count)
+        else:
+            del self._buffer[row:row + count]
+
+    def frozen(self) -> Sequence[str]:
+        """Lines as they are now, unaffected by later edits so another thread
+        can read them. A file still being indexed is returned as it is."""
+        if self._active_line is not None:
+            self.flush()
+        if isinstance(self._buffer, PieceTable):
+            return self._buffer.copy()
+        if isinstance(self._buffer, MappedLines):
+            return self._buffer
+        return tuple(self._buffer)
+
+    def snapshot(self):
+        """Cheap copy of the buffer contents for restore(), lines are shared"""
+        self.flush()
+        if isinstance(self._buffer, PieceTable):
+            return self._buffer.snapshot()
+        return tuple(self._buffer)
+
+    def restore(self, snapshot):
+        """Return to the contents taken by snapshot()"""
+        self.flush()
+        if isinstance(self._buffer, PieceTable):
+            self._buffer.restore(snapshot)
+        else:
+            self._buffer[:] = snapshot
+        self._mark(0, True)
+        self._reset_ids(len(self._buffer))
+        if self._trigrams is not None and self._trigrams.active:
+            self._trigrams.build(self.frozen())
+        if self._syntax is not None:
+            self._syntax.reset()
+        self._brackets.reset()
+
+    def insert_block(self, row: int, col: int, text: str) -> tuple[int, int]:
+        """Insert text that may span several lines at (row, col), return where it ends"""
+        lines = text.split("\n")
+        line = self[row]
+        left, right = line[:col], line[col:]
+        if len(lines) == 1:
+            self[row] = left + text + right
+            return row, col + len(text)
+        self[row] = left + lines[0]
+        self.insert_lines(row + 1, lines[1:-1] + [lines[-1] + right])
+        return row + len(lines) - 1, len(lines[-1])
+
+    def delete_block(self, row: int, col: int, text: str):
+        """Remove text inserted at (row, col) by insert_block"""
+        lines = text.split("\n")
+        end = len(lines[-1]) + (col if len(lines) == 1 else 0)
+        self[row] = self[row][:col] + self[row + len(lines) - 1][end:]
+        self.delete_lines(row + 1, len(lines) - 1)
+
     def read(self, encoding='utf-8'):
         """Read file"""
+        self._active_line = None
+        self._active_row = -1
+        self._first_dirty = CLEAN
+        self._offsets = None
+        self._disk = None
+        self._damage_from = 0
+        self._changes += 1
+        if self._wrap is not None:
+            self._wrap = WrapIndex(0, self._wrap.width)
+        if self._syntax is not None:
+            self._syntax.reset()
+        self._brackets.reset()
+        if self._mapped:
+            self._mapped.close()
+            self._mapped = None
         try:
             st = stat(self._filename)
             if st.st_size >= BUFFER_MAX_SIZE:
-                return ReturnInfo(ReturnType.ERR, "File is bigger than 1MB", "")
-            with open(self._filename, encoding=encoding) as file:
-                self._buffer = file.read().splitlines()
+                # Lines become readable as the indexer finds them, the first
+                # mutation waits for it and swaps in a piece table.
+                self._mapped = MappedLines(self._filename, encoding, background=True)
+                self._buffer = self._mapped
+                self._ids = None
+                self._disk = (st.st_size, st.st_mtime_ns)
+                if self._trigrams is not None:
+                    self._trigrams.build(self._mapped)
+                return ReturnType.OK
+            with open(self._filename, 'rb') as file:
+                data = file.read()
+            lines = data.decode(encoding).splitlines()
+            if self._trigrams is not None:
+                # Small enough to search line by line
+                self._trigrams.stop()
+            self._buffer = self._storage(lines)
+            self._reset_ids(len(lines))
+            self._offsets = _line_offsets(data, len(lines))
+            self._disk = (st.st_size, st.st_mtime_ns)
         except Exception as exc: # pylint: disable=broad-exception-caught
             return ReturnInfo(ReturnType.ERR, str(exc), type(exc).__name__)
         return ReturnType.OK
 
-    def write(self, encoding='utf-8'):
-        """Write to disk"""
+    def write(self, encoding='utf-8', in_place: bool = True):
+        """Write to disk, `in_place` allows rewriting only the changed tail,
+        which a crash can leave half written"""
         if not self._dirty:
             return ReturnType.CONTINUE
 
         if not self._filename:
             return ReturnInfo(ReturnType.ERR, "Filename is empty", "")
 
+        self.flush()
         try:
-            with open(self._filename, 'w', encoding=encoding) as file:
-                file.write("\n".join(self._buffer))
+            # Never start past the last line on disk or in the buffer, so the
+            # tail always begins at a known offset and ends without a newline.
+            start = 0
+            if self._offsets:
+                start = min(self._first_dirty, len(self._offsets) - 1, len(self._buffer) - 1)
+            if in_place and start > 0 and self._disk_unchanged() and self._small_tail(start):
+                self._tail_write(start, encoding)
+            else:
+                self._atomic_write(encoding)
         except Exception as exc: # pylint: disable=broad-exception-caught
+            self._offsets = None
             return ReturnInfo(ReturnType.ERR, str(exc), type(exc).__name__)
         self._dirty = False
+        self._first_dirty = CLEAN
+        st = stat(self._filename)
+        self._disk = (st.st_size, st.st_mtime_ns)
         return ReturnType.OK
 
+    def _disk_unchanged(self):
+        """Whether the file on disk is still the one offsets describe"""
+        try:
+            st = stat(self._filename)
+        except OSError:
+            return False
+        return self._disk == (st.st_size, st.st_mtime_ns)
+
+    def _iter_from(self, pos: int) -> Iterable[str]:
+        if isinstance(self._buffer, PieceTable):
+            return self._buffer.iter_from(pos)
+        return self._buffer[pos:] if pos else self._buffer
+
+    @staticmethod
+    def _stream(file, lines: Iterable[str], encoding: str, offsets: array, pos: int = 0):
+        """Write lines to file in WRITE_CHUNK sized pieces, recording line offsets"""
+        chunk = bytearray()
+        first = True
+        for line in lines:
+            if not first:
+                chunk += b"\n"
+                pos += 1
+            first = False
+            data = line.encode(encoding, "surrogateescape")
+            offsets.append(pos)
+            pos += len(data)
+            chunk += data
+            if len(chunk) >= WRITE_CHUNK:
+                file.write(chunk)
+                chunk.clear()
+        if chunk:
+            file.write(chunk)
+
+    def _small_tail(self, start: int):
+        """Whether the tail from line `start` is within TAIL_WRITE_MAX, both
+        on disk and in the buffer"""
+        if self._disk[0] - self._offsets[start] > TAIL_WRITE_MAX:  # type: ignore
+            return False
+        size = 0
+        for line in self._iter_from(start):
+            size += len(line) + 1
+            if size > TAIL_WRITE_MAX:
+                return False
+        return True
+
+    def _tail_write(self, start: int, encoding: str):
+        """Rewrite the file in place from line `start`, then truncate it.
+
+        Not atomic: a crash part way leaves the file with the old head and
+        a partly written tail. Only used for tails within TAIL_WRITE_MAX, so
+        that window stays short and the tail fits in memory."""
+        offsets: array = self._offsets  # type: ignore
+        pos = offsets[start]
+        lines = self._iter_from(start)
+        shared = self._mapped is not None and offsets is self._mapped.offsets
+        if shared:
+            # Storage reads from the bytes about to be overwritten, move the
+            # tail into memory first. The old tail is kept for the snapshots
+            # undo history took of the table.
+            table: PieceTable = self._buffer  # type: ignore
+            lines = list(lines)
+            table.move_original(start, self._mapped[start:])  # type: ignore
+            table.delete_lines(start, len(table) - start)
+            table.insert_lines(start, lines)
+            self._mapped.limit(start)  # type: ignore
+        new_offsets = offsets[:start]
+        with open(self._filename, 'r+b') as file:
+            file.seek(pos)
+            self._stream(file, lines, encoding, new_offsets, pos)
+            file.truncate()
+            file.flush()
+            os.fsync(file.fileno())
+        self._offsets = new_offsets
+        if shared:
+            self._mapped.remap(new_offsets)  # type: ignore
+
+    def _atomic_write(self, encoding: str):
+        """Stream to a temporary file next to the target, then swap it in.
+
+        A symlink is followed, the file it points to is replaced. A mapped
+        buffer keeps reading the old inode, which stays valid after the
+        replace. A new file has nothing to keep, it is written directly."""
+        target = os.path.realpath(self._filename)
+        directory = os.path.dirname(target)
+        try:
+            mode = stat(target).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is None:
+            # Created with the umask applied, as any other new file
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            tmpname = target
+        else:
+            fd, tmpname = mkstemp(prefix=f".{os.path.basename(target)}.", suffix=".tmp", dir=directory)
+        offsets = array("Q")
+        try:
+            with open(fd, 'wb') as file:
+                self._stream(file, self._iter_from(0), encoding, offsets)
+                file.flush()
+                os.fsync(file.fileno())
+            if mode is not None:
+                os.chmod(tmpname, mode)
+                os.replace(tmpname, target)
+        except BaseException:
+            try:
+                os.unlink(tmpname)
+            except FileNotFoundError:
+                pass
+            raise
+        dirfd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+        self._offsets = offsets
+
     def split_line(self, pos: int):
         """Split lines from a position"""
         return [pos]
 
     def __iter__(self):
+        self.flush()
         return iter(self._buffer)
 
     def __len__(self):
@@ -101,4 +733,6 @@ class Buffer:
 
     def sizeof_line(self, index: int):
         """Size of a buffer line"""
+        if self._is_active(index):
+            return len(self._active_line)  # type: ignore
         return len(self._buffer[index])
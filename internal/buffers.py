@@ -0,0 +1,140 @@
+"""Buffer list, the files open in a session and which one is shown
+
+A file is only read when it is first shown. Once the loaded files hold
+more than the memory budget, the least recently shown ones that are
+saved are dropped back to their path and cursor, to be read again when
+shown next."""
+
+import os
+from dataclasses import dataclass
+
+from internal.buffer import Buffer
+from internal.cursor import Cursor
+from internal.history import HistoryTree
+from internal.journal import Journal
+
+
+@dataclass
+class OpenFile:
+    """A file in the buffer list, only `path`, `number` and the cursor
+    position are kept while it is not loaded"""
+    path: str
+    number: int
+    row: int = 0
+    col: int = 0
+    buffer: Buffer | None = None
+    history: HistoryTree | None = None
+    cursor: Cursor | None = None
+    journal: Journal | None = None
+    # When it was last shown, see BufferList.select()
+    shown: int = 0
+
+    @property
+    def loaded(self):
+        """Whether the file is read into a buffer"""
+        return self.buffer is not None
+
+    @property
+    def footprint(self):
+        """Rough bytes held by the buffer and its undo history"""
+        if self.buffer is None:
+            return 0
+        return self.buffer.footprint + (self.history.size if self.history else 0)
+
+    def unload(self):
+        """Drop all but the path and cursor position"""
+        if self.buffer is None:
+            return
+        if self.cursor is not None:
+            self.row, self.col = self.cursor.row, self.cursor.col
+        if self.journal is not None:
+            self.journal.close(remove=not self.buffer.dirty)
+        self.buffer.close()
+        self.buffer = self.history = self.cursor = self.journal = None
+
+
+class BufferList:
+    """Open files in the order they were opened"""
+
+    def __init__(self) -> None:
+        self._files: list[OpenFile] = []
+        self._current = 0
+        self._next_number = 1
+        self._clock = 0
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def __len__(self):
+        return len(self._files)
+
+    @property
+    def current(self) -> OpenFile:
+        """File shown"""
+        return self._files[self._current]
+
+    def open(self, path: str) -> OpenFile:
+        """Entry of path, added unloaded if it is not open yet"""
+        key = os.path.abspath(path)
+        for entry in self._files:
+            if os.path.abspath(entry.path) == key:
+                return entry
+        entry = OpenFile(path, self._next_number)
+        self._next_number += 1
+        self._files.append(entry)
+        return entry
+
+    def find(self, number: int) -> OpenFile:
+        """Entry numbered number, raises KeyError if there is none"""
+        for entry in self._files:
+            if entry.number == number:
+                return entry
+        raise KeyError(f"Buffer {number} does not exist")
+
+    def select(self, entry: OpenFile):
+        """Make entry the file shown"""
+        self._current = self._files.index(entry)
+        self._clock += 1
+        entry.shown = self._clock
+
+    def step(self, offset: int) -> OpenFile:
+        """File offset places after the current one, wrapping around"""
+        return self._files[(self._current + offset) % len(self._files)]
+
+    def previous(self) -> OpenFile | None:
+        """File shown before the current one, None if no other was shown"""
+        shown = [entry for entry in self._files if entry.shown and entry is not self.current]
+        return max(shown, key=lambda entry: entry.shown, default=None)
+
+    def evict(self, budget: int) -> list[OpenFile]:
+        """Unload the least recently shown saved files until the loaded
+        ones fit in budget bytes, return those unloaded"""
+        loaded = [entry for entry in self._files if entry.loaded]
+        total = sum(entry.footprint for entry in loaded)
+        evicted: list[OpenFile] = []
+        for entry in sorted(loaded, key=lambda entry: entry.shown):
+            if total <= budget:
+                break
+            if entry is self.current or entry.buffer.dirty or entry.buffer.loading:  # type: ignore
+                continue
+            total -= entry.footprint
+            entry.unload()
+            evicted.append(entry)
+        return evicted
+
+    def listing(self) -> list[str]:
+        """A line per file as :ls shows it, % marks the current one, + unsaved
+        changes and a the files that are loaded"""
+        lines = []
+        for entry in self._files:
+            flags = "%" if entry is self.current else " "
+            flags += "a" if entry.loaded else " "
+            flags += "+" if entry.loaded and entry.buffer.dirty else " "  # type: ignore
+            row = entry.cursor.row if entry.cursor else entry.row
+            lines.append(f"{entry.number:3} {flags} \"{entry.path}\" line {row + 1}")
+        return lines
+
+    def close(self):
+        """Unload every file, journals of unsaved changes are kept"""
+        for entry in self._files:
+            entry.unload()
@@ -4,14 +4,25 @@
 import curses
 from shlex import split
 from typing import Callable
-from re import compile as re_compile
+from re import DOTALL, compile as re_compile, error as re_error
 
+from internal import STATE
+from internal.actions.replace import ReplaceLinesAction
+from internal.buffers import BufferList
 from internal.editor import EditorState
+from internal.modes import registry
+from internal.modes.helpmode import HelpMode
+from internal.substitute import compile_substitute, split_substitute, substitute
 from lymia import ReturnInfo, status
 from lymia.data import ReturnType
 from lymia.forms import Text
 
 motion_break = re_compile("[A-Za-z]")
+# [range]name rest, for commands that parse their own arguments
+raw_command = re_compile(r"\s*(%|'<,'>|[\d.$]+(?:,[\d.$]+)?)?([A-Za-z]+)(.*)", DOTALL)
+line_address = re_compile(r"\d+|[.$]")
+undo_span = re_compile(r"(\d+)([smhd]?)")
+SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
 
 class Command:
     """Commands"""
@@ -25,12 +36,17 @@ class Command:
         self._helps: dict[str, str] = {}
         self._alias: dict[str, list[str]] = {}
         self._motions: dict[str, Callable[[curses.window, list[str]], ReturnType | ReturnInfo]] = {}
+        self._raw: dict[str, Callable[[curses.window, list[str]], ReturnType | ReturnInfo]] = {}
         self._editor: EditorState
+        self._buffers: BufferList
 
     def add_command(
-        self, *value: str, help: str = "", use_motion: bool = False
+        self, *value: str, help: str = "", use_motion: bool = False, raw: bool = False
     ):  # pylint: disable=redefined-builtin
-        """Add command"""
+        """Add command
+
+        A `raw` command is called with [range, rest] where rest is the
+        unsplit text after its name, e.g. %s/a b/c/ -> ["%", "/a b/c/"]"""
 
         def inner(fn: Callable[[curses.window, list[str]], ReturnType]):
             alias = value[0]
@@ -39,12 +55,16 @@ class Command:
             self._cmd[alias] = fn
             if use_motion:
                 self._motions[alias] = fn
+            if raw:
+                self._raw[alias] = fn
 
             for v in value[1:]:
                 self._alias[alias].append(v)
                 self._cmd[v] = fn
                 if use_motion:
                     self._motions[v] = fn
+                if raw:
+                    self._raw[v] = fn
             return fn
 
         return inner
@@ -72,11 +92,20 @@ class Command:
         """Give this class editor state"""
         self._editor = editor
 
+    def use_buffers(self, buffers: BufferList):
+        """Give this class the open files"""
+        self._buffers = buffers
+
     @property
     def editor(self):
         """Editor"""
         return self._editor
 
+    @property
+    def buffers(self):
+        """Open files, selecting another shows it"""
+        return self._buffers
+
     @property
     def buffer(self):
         """buffer form"""
@@ -84,6 +113,9 @@ class Command:
 
     def call(self) -> ReturnType | ReturnInfo:
         """Call appropriate function"""
+        raw = raw_command.match(self._buffer.value)
+        if raw and raw[2] in self._raw:
+            return self._raw[raw[2]](self._screen, [raw[1] or "", raw[3]])
         try:
             args = split(self._buffer.value)
         except ValueError as exc:
@@ -154,3 +186,147 @@ def test(_: curses.window, args: list[str]):
     """Test function"""
     status.set(", ".join(args))
     return ReturnType.OK
+
+@command.add_command("wrap")
+def toggle_wrap(*_):
+    """Toggle soft-wrapping of long lines"""
+    STATE["soft_wrap"] = not STATE["soft_wrap"]
+    status.set(f"soft wrap {'on' if STATE['soft_wrap'] else 'off'}")
+    return ReturnType.OK
+
+@command.add_command("nohlsearch", "noh")
+def nohlsearch(*_):
+    """Stop highlighting search matches until the next search"""
+    command.editor.search.hide()
+    return ReturnType.OK
+
+def line_range(editor: EditorState, spec: str) -> tuple[int, int]:
+    """Rows [start, end) of a range: empty for the cursor line, % for all,
+    '<,'> for the last visual selection, or N / N,M with . and $"""
+    size = editor.buffer.size
+    if not spec:
+        return editor.cursor.row, editor.cursor.row + 1
+    if spec == "%":
+        return 0, size
+    if spec == "'<,'>":
+        if editor.selection.marks is None:
+            raise ValueError("No visual selection")
+        top, bottom = editor.selection.marks
+        return top, bottom + 1
+    numbers = []
+    for address in spec.split(","):
+        if not line_address.fullmatch(address):
+            raise ValueError(f"Invalid range: {spec}")
+        if address == ".":
+            numbers.append(editor.cursor.row + 1)
+        elif address == "$":
+            numbers.append(size)
+        else:
+            numbers.append(int(address))
+    first, last = min(numbers), max(numbers)
+    if first < 1 or last > size:
+        raise ValueError(f"Range {spec} is outside 1,{size}")
+    return first - 1, last
+
+@command.add_command("substitute", "s", raw=True)
+def substitute_(_, args: list[str]):
+    """Replace matches of a regex, [range]s/pattern/replacement/[g][i]"""
+    editor = command.editor
+    try:
+        start, end = line_range(editor, args[0])
+        pattern, replacement, flags = split_substitute(args[1])
+        pattern = pattern or editor.search.pattern
+        if not pattern:
+            raise ValueError("No previous search pattern")
+        regex = compile_substitute(pattern, flags)
+        rows, after, total = substitute(
+            regex, replacement, 0 if "g" in flags else 1, start, editor.buffer.lines(start, end)
+        )
+    except (ValueError, re_error) as exc:
+        status.set(str(exc))
+        return ReturnInfo(ReturnType.ERR, str(exc), args)
+    if any("\n" in line for line in after):
+        status.set("The replacement cannot break lines")
+        return ReturnInfo(ReturnType.ERR, "The replacement cannot break lines", args)
+    editor.search.set(pattern, editor.search.forward)
+    if not total:
+        status.set(f"Pattern not found: {pattern}")
+        return ReturnType.OK
+    if rows:
+        # One buffer mutation and one history entry for the whole range
+        action = ReplaceLinesAction(rows, [editor.buffer[row] for row in rows], after)
+        action.execute(editor)
+        editor.history.push(action)
+    plural = "s" if total != 1 else ""
+    status.set(f"{total} substitution{plural} on {len(rows)} line{'s' if len(rows) != 1 else ''}")
+    return ReturnType.OK
+
+def _time_travel(args: list[str], sign: int):
+    editor = command.editor
+    history = editor.history
+    match = undo_span.fullmatch(args[0] if args else "1")
+    if not match:
+        return ReturnInfo(ReturnType.ERR, "Expected a count or a time such as 10m", args)
+    amount = int(match[1]) * sign
+    if match[2]:
+        target = history.at_time(history.current.time + amount * SECONDS[match[2]])
+    else:
+        target = history.at_seq(history.current.seq + amount)
+    ret = history.goto(target, editor)
+    buffer = editor.buffer
+    editor.cursor.row = max(min(editor.cursor.row, buffer.size - 1), 0)
+    if buffer.size:
+        last = max(buffer.sizeof_line(editor.cursor.row) - 1, 0)
+        editor.cursor.col = min(editor.cursor.col, last)
+    status.set(f"At change {target.seq}")
+    return ret
+
+@command.add_command("earlier", "ea")
+def earlier(_, args: list[str]):
+    """Go back N changes, or in time with Ns, Nm, Nh or Nd"""
+    return _time_travel(args, -1)
+
+@command.add_command("later", "lat")
+def later(_, args: list[str]):
+    """Go forward N changes, or in time with Ns, Nm, Nh or Nd"""
+    return _time_travel(args, 1)
+
+@command.add_command("edit", "e")
+def edit(_, args: list[str]):
+    """Open a file in place of the current one"""
+    if not args:
+        status.set("No file name")
+        return ReturnInfo(ReturnType.ERR, "No file name", args)
+    command.buffers.select(command.buffers.open(args[0]))
+    return ReturnType.OK
+
+def _count(args: list[str]):
+    return int(args[0]) if args and args[0].isdigit() else 1
+
+@command.add_command("bnext", "bn")
+def bnext(_, args: list[str]):
+    """Show the next open file"""
+    command.buffers.select(command.buffers.step(_count(args)))
+    return ReturnType.OK
+
+@command.add_command("bprevious", "bp")
+def bprevious(_, args: list[str]):
+    """Show the previous open file"""
+    command.buffers.select(command.buffers.step(-_count(args)))
+    return ReturnType.OK
+
+@command.add_command("buffer", "b")
+def buffer_(_, args: list[str]):
+    """Show the open file numbered N, as :ls lists them"""
+    try:
+        command.buffers.select(command.buffers.find(int(args[0])))
+    except (IndexError, ValueError, KeyError) as exc:
+        status.set("Expected a buffer number from :ls")
+        return ReturnInfo(ReturnType.ERR, "Expected a buffer number from :ls", exc)
+    return ReturnType.OK
+
+@command.add_command("ls", "buffers")
+def list_buffers(*_):
+    """List the open files"""
+    help_mode: HelpMode = registry.get("help")  # type: ignore
+    return help_mode.show("\n".join(command.buffers.listing()))
@@ -9,6 +9,7 @@ from lymia.data import _StatusInfo as StatusInfo
 from .buffer import Buffer
 from .cursor import Cursor
 from .history import HistoryTree
+from .search import Search
 
 if TYPE_CHECKING:
     from internal.modes import Modes
@@ -27,6 +28,8 @@ class Selection:
 
     def __post_init__(self):
         self._active = False
+        # First and last row of the selection last dropped, for the '<,'> range
+        self.marks: tuple[int, int] | None = None
 
     def __bool__(self):
         return self._active
@@ -49,11 +52,8 @@ class Selection:
             return self.end_row > self.start_row
         return self.end_col > self.start_col
 
-    def slice(self, buffer: "Buffer") -> list[str]:
-        """Slice some of the buffer like a butter!"""
-        if not self._active:
-            return []
-
+    def bounds(self, buffer: "Buffer") -> tuple[int, int, int, int]:
+        """Clamped (top_row, top_col, bot_row, bot_col) of the selection"""
         # Ensure rows are within buffer bounds
         buf_len = len(buffer)
         sr = max(0, min(self.start_row, buf_len - 1))
@@ -63,13 +63,9 @@ class Selection:
 
         # Same-line selection
         if sr == er:
-            line = buffer[sr]
             line_len = buffer.sizeof_line(sr)
-            left = min(sc, ec, line_len)
-            right = min(max(sc, ec), line_len)
-            return [line[left:right]]
+            return sr, min(sc, ec, line_len), sr, min(max(sc, ec), line_len)
 
-        # Multi-line selection: produce lines from top->bottom
         top_row = min(sr, er)
         bot_row = max(sr, er)
 
@@ -84,7 +80,36 @@ class Selection:
         # Clamp cols to line lengths
         top_col = min(top_col, buffer.sizeof_line(top_row))
         bot_col = min(bot_col, buffer.sizeof_line(bot_row))
+        return top_row, top_col, bot_row, bot_col
+
+    def spans(self, buffer: "Buffer", start: int, end: int) -> dict[int, tuple[int, int]]:
+        """Selected (left, right) columns for every row in [start, end)"""
+        if not self._active or len(buffer) == 0:
+            return {}
+        top_row, top_col, bot_row, bot_col = self.bounds(buffer)
+        if top_row == bot_row:
+            if start <= top_row < end:
+                return {top_row: (top_col, bot_col)}
+            return {}
+        out: dict[int, tuple[int, int]] = {}
+        for row in range(max(start, top_row), min(end, bot_row + 1)):
+            left = top_col if row == top_row else 0
+            right = bot_col if row == bot_row else buffer.sizeof_line(row)
+            out[row] = (left, right)
+        return out
+
+    def slice(self, buffer: "Buffer") -> list[str]:
+        """Slice some of the buffer like a butter!"""
+        if not self._active:
+            return []
 
+        top_row, top_col, bot_row, bot_col = self.bounds(buffer)
+
+        # Same-line selection
+        if top_row == bot_row:
+            return [buffer[top_row][top_col:bot_col]]
+
+        # Multi-line selection: produce lines from top->bottom
         out: list[str] = []
 
         # Top line: from top_col to end
@@ -114,6 +139,8 @@ class Selection:
 
     def reset(self):
         """Reset state"""
+        if self._active:
+            self.marks = (min(self.start_row, self.end_row), max(self.start_row, self.end_row))
         self._active = False
         self.start(0, 0)
         self.end(0, 0)
@@ -132,6 +159,10 @@ class EditorView:
     end: int
     term_width: int
     term_height: int
+    shift: int = 0
+    # First visual row and wrap width while soft-wrapping, wrap is 0 otherwise
+    vtop: int = 0
+    wrap: int = 0
 
 @dataclass
 class DebugState:
@@ -158,3 +189,4 @@ class EditorState(NamedTuple):
     debug: DebugState
     mode: list["Modes"]
     selection: Selection
+    search: Search
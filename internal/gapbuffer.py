@@ -0,0 +1,106 @@
+"""Gap buffer, used for the line currently being edited"""
+
+from .width import is_simple
+
+GAP_SIZE = 64
+
+
+class GapBuffer:
+    """Gap buffer
+
+    Characters live in a list with a movable hole (the gap) at the edit
+    point, so typing or deleting next to the previous edit is O(1) no
+    matter how long the line is. The line as a string is only joined when
+    something asks for it after an edit, `slice` reads a window without it."""
+
+    __slots__ = ("_data", "_gap_start", "_gap_end", "_text", "_complex")
+
+    def __init__(self, text: str = "") -> None:
+        self._data: list[str] = list(text) + [""] * GAP_SIZE
+        self._gap_start = len(text)
+        self._gap_end = len(self._data)
+        self._text: str | None = text
+        # Characters not taking exactly one cell (tabs, non-ascii)
+        self._complex = 0 if is_simple(text) else sum(not is_simple(char) for char in text)
+
+    def __len__(self):
+        return len(self._data) - (self._gap_end - self._gap_start)
+
+    def __str__(self) -> str:
+        if self._text is None:
+            data = self._data
+            self._text = "".join(data[:self._gap_start]) + "".join(data[self._gap_end:])
+        return self._text
+
+    @property
+    def simple(self):
+        """Whether every character takes exactly one cell"""
+        return self._complex == 0
+
+    def slice(self, start: int, end: int) -> str:
+        """Characters [start, end) without joining the whole line"""
+        size = len(self)
+        start = max(0, min(start, size))
+        end = max(start, min(end, size))
+        if self._text is not None:
+            return self._text[start:end]
+        data, gap = self._data, self._gap_end - self._gap_start
+        if end <= self._gap_start:
+            return "".join(data[start:end])
+        if start >= self._gap_start:
+            return "".join(data[start + gap:end + gap])
+        return "".join(data[start:self._gap_start]) + "".join(data[self._gap_end:end + gap])
+
+    def __repr__(self) -> str:
+        return f"<GapBuffer {str(self)!r}>"
+
+    def _move(self, pos: int):
+        """Move the gap to `pos`"""
+        pos = max(0, min(pos, len(self)))
+        data = self._data
+        if pos < self._gap_start:
+            count = self._gap_start - pos
+            data[self._gap_end - count:self._gap_end] = data[pos:self._gap_start]
+            self._gap_start -= count
+            self._gap_end -= count
+        elif pos > self._gap_start:
+            count = pos - self._gap_start
+            data[self._gap_start:self._gap_start + count] = data[self._gap_end:self._gap_end + count]
+            self._gap_start += count
+            self._gap_end += count
+
+    def _grow(self, needed: int):
+        gap = self._gap_end - self._gap_start
+        if gap >= needed:
+            return
+        extra = max(needed - gap, len(self), GAP_SIZE)
+        self._data[self._gap_end:self._gap_end] = [""] * extra
+        self._gap_end += extra
+
+    def insert(self, pos: int, text: str):
+        """Insert text at `pos`"""
+        if not text:
+            return
+        self._move(pos)
+        self._grow(len(text))
+        start = self._gap_start
+        end = start + len(text)
+        self._data[start:end] = text
+        self._gap_start = end
+        self._text = None
+        if not is_simple(text):
+            self._complex += sum(not is_simple(char) for char in text)
+
+    def delete(self, pos: int, count: int = 1) -> str:
+        """Delete `count` characters starting at `pos`, return removed text"""
+        pos = max(0, pos)
+        count = min(count, len(self) - pos)
+        if count <= 0:
+            return ""
+        self._move(pos)
+        removed = "".join(self._data[self._gap_end:self._gap_end + count])
+        self._gap_end += count
+        self._text = None
+        if self._complex and not is_simple(removed):
+            self._complex -= sum(not is_simple(char) for char in removed)
+        return removed
@@ -1,17 +1,25 @@
 """History structure, used for undo/redo tree"""
 
-from typing import TYPE_CHECKING
+from bisect import bisect_right
+from sys import getsizeof
+from time import time
+from typing import TYPE_CHECKING, Callable
 
 from lymia import ReturnInfo, ReturnType
+from internal import STATE
 from internal.actions import Action
 
 if TYPE_CHECKING:
+    from internal.buffer import Buffer
     from internal.editor import EditorState
+    from internal.journal import Journal
 
 
 class HistoryNode:
     """History Node"""
 
+    __slots__ = ("action", "parent", "children", "seq", "time", "snapshot")
+
     def __init__(
         self, act: Action | None, parent: "HistoryNode | None" = None, seq: int = 0
     ) -> None:
@@ -19,35 +27,302 @@ class HistoryNode:
         self.parent: "HistoryNode | None" = parent
         self.children: "list[HistoryNode]" = []
         self.seq = seq
+        self.time = time()
+        # Buffer.snapshot() of the state after this change, see HistoryTree.checkpoint
+        self.snapshot = None
 
     def command(self):
         """Action command"""
         return NotImplemented
 
+    def cost(self) -> int:
+        """Approximate memory held by this node and its action, in bytes,
+        its snapshot is accounted for apart, see HistoryTree.checkpoint"""
+        size = getsizeof(self) + getsizeof(self.children)
+        return size + (self.action.cost() if self.action else 0)
+
+
+def _snapshot_cost(snapshot) -> int:
+    """Memory held by a snapshot itself, the lines are shared with the buffer"""
+    if snapshot is None:
+        return 0
+    if snapshot and isinstance(snapshot[0], tuple):  # piece table
+        return getsizeof(snapshot) + getsizeof(snapshot[0]) * len(snapshot)
+    return getsizeof(snapshot)
+
+
+def _seq(node: HistoryNode):
+    return node.seq
+
+
+def _time(node: HistoryNode):
+    return node.time
+
+
+def _path(node: HistoryNode | None) -> list[HistoryNode]:
+    """node and its ancestors up to the root"""
+    path: list[HistoryNode] = []
+    while node is not None:
+        path.append(node)
+        node = node.parent
+    return path
+
+
+def _run(fn: Callable[["EditorState"], ReturnType | ReturnInfo], editor: "EditorState"):
+    ret = fn(editor)
+    if isinstance(ret, ReturnInfo):
+        if ret.type == ReturnType.ERR:
+            editor.debug.status.set(f"{ret.reason}: {ret.additional_info!r}")
+    return ret
+
 
 class HistoryTree:
-    """History Tree"""
+    """History Tree
+
+    An action pushed right after a compatible one is merged into it until
+    seal() ends the running command or insert session, and once the tree holds more than STATE["undo_budget"] bytes the oldest
+    changes, together with any branch hanging off them, are forgotten.
+
+    Every change is numbered and timestamped, and every
+    STATE["undo_checkpoint"] changes the buffer is snapshotted so goto()
+    can reach any change without replaying the whole history. Snapshots
+    have a budget of their own, the oldest are dropped to stay within it
+    and no change is ever forgotten for them."""
 
     def __init__(self) -> None:
         self.root: HistoryNode = HistoryNode(None)
         self.current: HistoryNode = self.root
+        self._size = self.root.cost()
+        self._seq = 0
+        self._nodes: dict[int, HistoryNode] = {0: self.root}
+        # Nodes by ascending seq, and so time, for at_seq() and at_time().
+        # Forgotten nodes are skipped there and swept out by _prune().
+        self._order: list[HistoryNode] = [self.root]
+        self._checkpoint_seq = 0
+        # Whether the next push starts a new change instead of merging
+        self._sealed = True
+        # Nodes holding a snapshot, oldest first, and the memory they take
+        self._snapshots: list[HistoryNode] = []
+        self._snapshot_size = 0
+        # Crash-recovery journal every change is reported to
+        self.journal: "Journal | None" = None
+        # Reads older history on demand, see defer()
+        self._loader: Callable[[], tuple[HistoryNode, dict[int, HistoryNode]]] | None = None
+
+    @property
+    def size(self):
+        """Approximate memory held by the history, in bytes"""
+        return self._size
+
+    @property
+    def last_seq(self):
+        """Number of the latest change"""
+        return self._seq
 
-    def push(self, act: Action):
-        """Push an action to history tree"""
-        node = HistoryNode(act, self.current)
-        self.current.children.append(node)
+    def defer(
+        self,
+        current: int,
+        last: int,
+        loader: Callable[[], tuple[HistoryNode, dict[int, HistoryNode]]],
+    ):
+        """Continue a history kept elsewhere, the root is its change `current`
+
+        `loader` returns (root, nodes by seq) of that history and is only
+        called once something reaches past the root."""
+        self.rebase(current, last)
+        self._loader = loader
+
+    def rebase(self, current: int, last: int):
+        """Number the root `current` and new changes after `last`"""
+        del self._nodes[self.root.seq]
+        self.root.seq = current
+        self._nodes[current] = self.root
+        self._order = sorted(self._nodes.values(), key=_seq)
+        self._seq = max(self._seq, last)
+        self._checkpoint_seq = current
+
+    def load(self):
+        """Graft the deferred history under the root, return whether it did"""
+        if self._loader is None:
+            return False
+        loader, self._loader = self._loader, None
+        root, nodes = loader()
+        saved = nodes.get(self.root.seq)
+        if saved is None:
+            return False
+        # Changes made since opening are the newest branch of the saved state
+        saved.children.extend(self.root.children)
+        for child in self.root.children:
+            child.parent = saved
+        if self.current is self.root:
+            self.current = saved
+        del self._nodes[self.root.seq]
+        self._size -= self.root.cost()
+        self._drop_snapshot(self.root)
+        for node in nodes.values():
+            self._size += node.cost()
+        nodes.update(self._nodes)
+        self._nodes = nodes
+        self._order = sorted(nodes.values(), key=_seq)
+        self.root = root
+        if self._size > STATE["undo_budget"]:
+            self._prune()
+        return True
+
+    def push(self, act: Action, merge: bool = True):
+        """Push an action to history tree, `merge` allows merging it into the last one"""
+        current = self.current
+        # A snapshot pins the state after current, so it cannot grow anymore
+        sealed, self._sealed = self._sealed, False
+        if (
+            merge
+            and not sealed
+            and current.action is not None
+            and not current.children
+            and current.snapshot is None
+        ):
+            before = current.action.cost()
+            if current.action.merge(act):
+                if self.journal:
+                    self.journal.push(act, True)
+                self._size += current.action.cost() - before
+                return
+        if self.journal:
+            self.journal.push(act, False)
+        self._seq += 1
+        node = HistoryNode(act, current, self._seq)
+        self._nodes[node.seq] = node
+        self._order.append(node)
+        listed = getsizeof(current.children)
+        current.children.append(node)
         self.current = node
+        self._size += node.cost() + getsizeof(current.children) - listed
+        if self._size > STATE["undo_budget"]:
+            self._prune()
+
+    def seal(self):
+        """End the running change, the next action pushed is not merged into it"""
+        self._sealed = True
+
+    def _prune(self):
+        """Drop the oldest changes until the history fits its budget"""
+        path: list[HistoryNode] = []
+        node = self.current
+        while node is not self.root:
+            path.append(node)
+            node = node.parent  # type: ignore
+        # Keep at least the latest change
+        while self._size > STATE["undo_budget"] and len(path) > 1:
+            keep = path.pop()
+            for child in self.root.children:
+                if child is not keep:
+                    self._size -= self._forget(child)
+            del self._nodes[self.root.seq]
+            self._size -= self.root.cost() + (keep.action.cost() if keep.action else 0)
+            self._drop_snapshot(self.root)
+            # The oldest change is applied for good, its node becomes the root
+            keep.parent = None
+            keep.action = None
+            self.root = keep
+        if len(self._order) > 2 * len(self._nodes):
+            self._order = [node for node in self._order if self._nodes.get(node.seq) is node]
+
+    def _forget(self, node: HistoryNode) -> int:
+        """Unindex node and its descendants, return the memory they held"""
+        total = 0
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            total += node.cost()
+            self._nodes.pop(node.seq, None)
+            self._drop_snapshot(node)
+            stack.extend(node.children)
+        return total
+
+    def _drop_snapshot(self, node: HistoryNode):
+        if node.snapshot is not None:
+            self._snapshot_size -= _snapshot_cost(node.snapshot)
+            self._snapshots.remove(node)
+            node.snapshot = None
+
+    def checkpoint(self, buffer: "Buffer"):
+        """Snapshot the buffer at the current change if enough changes were
+        made since the last snapshot, the buffer must match the current change"""
+        node = self.current
+        if node.snapshot is not None:
+            return
+        if abs(node.seq - self._checkpoint_seq) < STATE["undo_checkpoint"]:
+            return
+        node.snapshot = buffer.snapshot()
+        self._checkpoint_seq = node.seq
+        self._snapshots.append(node)
+        self._snapshot_size += _snapshot_cost(node.snapshot)
+        # Keep the newest snapshot even if it alone is over budget
+        while self._snapshot_size > STATE["undo_budget"] and len(self._snapshots) > 1:
+            self._drop_snapshot(self._snapshots[0])
+
+    def at_seq(self, seq: int) -> HistoryNode:
+        """Latest change numbered `seq` or lower, the root if there is none"""
+        self.load()
+        return self._latest(bisect_right(self._order, seq, key=_seq))
+
+    def at_time(self, when: float) -> HistoryNode:
+        """Latest change made at `when` or earlier, the root if there is none"""
+        self.load()
+        return self._latest(bisect_right(self._order, when, key=_time))
+
+    def _latest(self, index: int) -> HistoryNode:
+        """Last node still in the tree before index in _order, the root if
+        it is older"""
+        order, nodes = self._order, self._nodes
+        while index > 0:
+            index -= 1
+            node = order[index]
+            if nodes.get(node.seq) is node:
+                return node if node.seq > self.root.seq else self.root
+        return self.root
+
+    def goto(self, target: HistoryNode, editor: "EditorState"):
+        """Move to any change, on any branch
+
+        Undoes back to the common ancestor and replays down to target, or
+        restores the nearest snapshot on the way to target when that means
+        replaying fewer changes."""
+        ups = _path(self.current)
+        downs = _path(target)
+        depth = {node: index for index, node in enumerate(ups)}
+        fork = next(index for index, node in enumerate(downs) if node in depth)
+        undo = ups[:depth[downs[fork]]]
+        redo = downs[:fork]
+        if self.journal:
+            for node in undo:
+                self.journal.undo(node)
+            for node in reversed(redo):
+                self.journal.redo(node)
+        for index, node in enumerate(downs[:len(undo) + len(redo)]):
+            if node.snapshot is not None:
+                editor.buffer.restore(node.snapshot)
+                undo, redo = [], downs[:index]
+                break
+        ret: ReturnType | ReturnInfo = ReturnType.OK
+        for node in undo:
+            if node.action:
+                ret = _run(node.action.undo, editor)
+        for node in reversed(redo):
+            if node.action:
+                ret = _run(node.action.execute, editor)
+        self.current = target
+        return ret
 
     def undo(self, editor: "EditorState"):
         """Undo an action"""
-        if self.current is self.root:
+        if self.current is self.root and not self.load():
             editor.status.set("Already at oldest change")
             return ReturnType.CONTINUE
         if self.current.action:
-            ret = self.current.action.undo(editor)
-            if isinstance(ret, ReturnInfo):
-                if ret.type == ReturnType.ERR:
-                    editor.debug.status.set(f"{ret.reason}: {ret.additional_info!r}")
+            if self.journal:
+                self.journal.undo(self.current)
+            ret = _run(self.current.action.undo, editor)
             self.current = self.current.parent  # type: ignore
             return ret
         return ReturnType.CONTINUE
@@ -59,10 +334,9 @@ class HistoryTree:
             return ReturnType.CONTINUE
         node = self.current.children[-1]
         if node.action:
-            ret = node.action.execute(editor)
-            if isinstance(ret, ReturnInfo):
-                if ret.type == ReturnType.ERR:
-                    editor.debug.status.set(f"{ret.reason}: {ret.additional_info!r}")
+            if self.journal:
+                self.journal.redo(node)
+            ret = _run(node.action.execute, editor)
             self.current = node
             return ret
         return ReturnType.CONTINUE
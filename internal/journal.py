@@ -0,0 +1,220 @@
+"""Crash-recovery journal, a write-ahead log of history changes
+
+Every change to the history is appended to a .<name>.renvia-journal file next to
+the edited file. Records are queued in memory and a worker thread writes
+and fsyncs them together every STATE["journal_sync"] ms, so keystrokes
+never wait on the disk. Replaying the journal over the file as it was
+last saved gives back the unsaved edits."""
+
+import os
+from struct import Struct
+from threading import Condition, Lock, Thread
+from zlib import crc32
+
+from internal import STATE
+from internal.actions import Action
+from internal.editor import EditorState
+from internal.history import HistoryNode, HistoryTree
+from internal.undofile import INT, decode_action, dump_action, encode_action
+
+MAGIC = b"RVJ\x01"
+# magic, size and mtime of the file the journal applies to (-1 if missing),
+# then the current and last change of its history at that point
+HEADER = Struct("<4sqqII")
+# kind, payload length, then the payload and its crc32
+RECORD = Struct("<cI")
+CRC = Struct("<I")
+
+PUSH = b"p"
+MERGE = b"m"
+UNDO = b"u"
+REDO = b"r"
+
+
+def journal_path(filename: str):
+    """Journal file of filename"""
+    head, tail = os.path.split(os.path.abspath(filename))
+    return os.path.join(head, f".{tail}.renvia-journal")
+
+
+def _base(filename: str):
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return -1, -1
+    return info.st_size, info.st_mtime_ns
+
+
+def has_journal(filename: str):
+    """Whether filename has unsaved changes journaled against its current contents"""
+    try:
+        with open(journal_path(filename), "rb") as file:
+            header = file.read(HEADER.size)
+            record = file.read(RECORD.size)
+    except OSError:
+        return False
+    if len(header) != HEADER.size or not record:
+        return False
+    magic, size, mtime, _, _ = HEADER.unpack(header)
+    return magic == MAGIC and (size, mtime) == _base(filename)
+
+
+def _records(data: bytes):
+    """(kind, payload) of every intact record"""
+    pos = HEADER.size
+    while pos + RECORD.size <= len(data):
+        kind, length = RECORD.unpack_from(data, pos)
+        start = pos + RECORD.size
+        end = start + length
+        if end + CRC.size > len(data):
+            return  # torn write at the time of the crash
+        payload = data[start:end]
+        if CRC.unpack_from(data, end)[0] != crc32(kind + payload):
+            return
+        yield kind, payload
+        pos = end + CRC.size
+
+
+class Journal:
+    """Journal of a file, see the module docstring"""
+
+    def __init__(self, filename: str) -> None:
+        self._filename = filename
+        self._path = journal_path(filename)
+        self._pending: list[bytes] = []
+        self._cond = Condition()
+        # Held while the journal file is written to
+        self._io = Lock()
+        self._closed = False
+        self._file = None
+        self._thread: Thread | None = None
+        self._history: HistoryTree | None = None
+
+    def replay(self, editor: EditorState):
+        """Apply the journaled changes to the editor, return how many were applied"""
+        history = editor.history
+        with open(self._path, "rb") as file:
+            data = file.read()
+        _, _, _, current, last = HEADER.unpack_from(data)
+        history.rebase(current, last)
+        count = 0
+        for kind, payload in _records(data):
+            if kind in (PUSH, MERGE):
+                action = decode_action(payload)
+                action.execute(editor)
+                history.push(action, kind == MERGE)
+            elif kind == UNDO:
+                self._replay_undo(editor, payload)
+            elif kind == REDO:
+                self._replay_redo(editor, payload)
+            count += 1
+        return count
+
+    @staticmethod
+    def _replay_undo(editor: EditorState, payload: bytes):
+        history = editor.history
+        (seq,) = INT.unpack_from(payload)
+        if history.current.seq == seq:
+            history.undo(editor)
+        else:
+            # Made before a save without an undo file, the tree no longer has it
+            decode_action(payload[INT.size:]).undo(editor)
+
+    @staticmethod
+    def _replay_redo(editor: EditorState, payload: bytes):
+        history = editor.history
+        (seq,) = INT.unpack_from(payload)
+        for child in history.current.children:
+            if child.seq == seq:
+                child.action.execute(editor)  # type: ignore
+                history.current = child
+                return
+        decode_action(payload[INT.size:]).execute(editor)
+
+    def start(self, history: HistoryTree, keep: bool = False):
+        """Open the journal for the edits after history's current change,
+        `keep` appends to the records already there"""
+        self._history = history
+        try:
+            with open(self._path, "rb") as file:
+                magic = file.read(len(MAGIC))
+        except FileNotFoundError:
+            magic = MAGIC
+        if magic and magic != MAGIC:
+            raise FileExistsError(f"{self._path} exists and is not a journal")
+        if keep and os.path.exists(self._path):
+            self._file = open(self._path, "ab")  # pylint: disable=consider-using-with
+        else:
+            self._file = open(self._path, "wb")  # pylint: disable=consider-using-with
+            self._write_header()
+        self._thread = Thread(target=self._run, name="renvia-journal", daemon=True)
+        self._thread.start()
+
+    def _write_header(self):
+        history = self._history
+        header = HEADER.pack(MAGIC, *_base(self._filename), history.current.seq, history.last_seq)  # type: ignore
+        self._file.write(header)  # type: ignore
+        self._file.flush()  # type: ignore
+        os.fsync(self._file.fileno())  # type: ignore
+
+    def _record(self, kind: bytes, payload: bytes = b""):
+        data = RECORD.pack(kind, len(payload)) + payload + CRC.pack(crc32(kind + payload))
+        with self._cond:
+            self._pending.append(data)
+
+    def push(self, action: Action, merged: bool):
+        """Journal an action pushed to the history, `merged` into the last one"""
+        self._record(MERGE if merged else PUSH, encode_action(action))
+
+    def undo(self, node: HistoryNode):
+        """Journal undoing node"""
+        self._record(UNDO, INT.pack(node.seq) + dump_action(node.action))  # type: ignore
+
+    def redo(self, node: HistoryNode):
+        """Journal redoing node"""
+        self._record(REDO, INT.pack(node.seq) + dump_action(node.action))  # type: ignore
+
+    def _flush(self):
+        with self._io:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if batch and self._file is not None:
+                self._file.write(b"".join(batch))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(STATE["journal_sync"] / 1000)
+                closed = self._closed
+            self._flush()
+            if closed:
+                return
+
+    def reset(self):
+        """The file was saved, start over from its new contents"""
+        with self._io:
+            with self._cond:
+                self._pending.clear()
+            if self._file is not None:
+                self._file.seek(0)
+                self._file.truncate()
+                self._write_header()
+
+    def close(self, remove: bool = True):
+        """Write what is queued and stop, `remove` deletes the journal"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if remove and self._thread is not None:
+            try:
+                os.unlink(self._path)
+            except OSError:
+                pass
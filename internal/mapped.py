@@ -0,0 +1,178 @@
+"""Memory-mapped, lazily decoded file lines"""
+
+import mmap
+from array import array
+from threading import Condition, Thread
+from typing import overload
+
+INDEX_CHUNK = 1024 ** 2 * 4
+
+
+def index_newlines(data, offsets: array, start: int, end: int):
+    """Append the start offset of every line that begins within (start, end]
+
+    A newline at the very end of `data` does not start a new line."""
+    last = len(data) - 1
+    pos = data.find(b"\n", start, end)
+    while pos != -1:
+        if pos < last:
+            offsets.append(pos + 1)
+        pos = data.find(b"\n", pos + 1, end)
+
+
+class MappedLines:
+    """Read-only sequence of lines backed by a memory-mapped file
+
+    Only the byte offset of every line is kept in memory, a line is
+    decoded when it is accessed. With `background`, offsets are scanned
+    by a worker thread and the sequence grows as lines become known."""
+
+    def __init__(self, filename: str, encoding: str = "utf-8", background: bool = False) -> None:
+        self._filename = filename
+        self._encoding = encoding
+        self._file = open(filename, "rb")  # pylint: disable=consider-using-with
+        self._size = self._file.seek(0, 2)
+        self._map: mmap.mmap | None = None
+        self._offsets = array("Q")
+        self._length: int | None = None
+        self._crlf = False
+        self._scanned = 0
+        self._done = False
+        self._cancelled = False
+        self._cond = Condition()
+        self._thread: Thread | None = None
+        if self._size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._offsets.append(0)
+        if background and self._map is not None:
+            self._thread = Thread(target=self.index, name="renvia-index", daemon=True)
+            self._thread.start()
+        else:
+            self.index()
+
+    @property
+    def filename(self):
+        """Mapped filename"""
+        return self._filename
+
+    @property
+    def nbytes(self):
+        """Mapped file size"""
+        return self._size
+
+    @property
+    def offsets(self):
+        """Byte offset of every line start"""
+        return self._offsets
+
+    @property
+    def crlf(self):
+        """Whether a carriage return was seen while indexing"""
+        return self._crlf
+
+    @property
+    def ready(self):
+        """Whether every line offset is known"""
+        return self._done
+
+    @property
+    def progress(self):
+        """Indexing progress, from 0.0 to 1.0"""
+        if self._done or not self._size:
+            return 1.0
+        return self._scanned / self._size
+
+    def _index_range(self, start: int, end: int):
+        """Record line starts for newlines found within [start, end)"""
+        index_newlines(self._map, self._offsets, start, end)
+        if not self._crlf and self._map.find(b"\r", start, end) != -1:  # type: ignore
+            self._crlf = True
+
+    def index(self):
+        """Build the line offset index"""
+        if self._map is not None:
+            for start in range(0, self._size, INDEX_CHUNK):
+                if self._cancelled:
+                    return
+                end = min(start + INDEX_CHUNK, self._size)
+                self._index_range(start, end)
+                with self._cond:
+                    self._scanned = end
+                    self._cond.notify_all()
+        with self._cond:
+            self._done = True
+            self._cond.notify_all()
+
+    def wait(self, index: int = -1):
+        """Block until line `index` is known, or the whole file if -1"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._done or self._cancelled or (0 <= index < len(self))
+            )
+
+    def cancel(self):
+        """Stop the background indexer"""
+        self._cancelled = True
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+
+    def _line(self, index: int) -> str:
+        mapping = self._map
+        if mapping is None:
+            # Closed or being remapped, readers on other threads catch this
+            raise ValueError("mapped file is closed")
+        offsets = self._offsets
+        start = offsets[index]
+        end = offsets[index + 1] - 1 if index + 1 < len(offsets) else self._size
+        if end > start and mapping[end - 1] == 0x0A:
+            end -= 1
+        if end > start and mapping[end - 1] == 0x0D:
+            end -= 1
+        return mapping[start:end].decode(self._encoding, "surrogateescape")
+
+    def __len__(self):
+        if self._length is not None:
+            return self._length
+        # The last known line is incomplete until indexing reaches its end
+        if self._done:
+            return len(self._offsets)
+        return max(len(self._offsets) - 1, 0)
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+    @overload
+    def __getitem__(self, index: slice) -> list[str]: ...
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            return [self._line(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("mapped line index out of range")
+        return self._line(index)
+
+    def limit(self, lines: int):
+        """Only expose the first `lines` lines"""
+        self._length = min(lines, len(self))
+
+    def remap(self, offsets: array):
+        """Map the file again after it was rewritten in place"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._size = self._file.seek(0, 2)
+        if self._size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = offsets
+        self._length = None
+        self._scanned = self._size
+
+    def close(self):
+        """Release the mapping"""
+        self.cancel()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
@@ -1,12 +1,13 @@
 """Modes"""
 
-# pylint: disable=unused-argument,import-outside-toplevel
+# pylint: disable=unused-argument
 
 import curses
+from time import monotonic
 from typing import Any, Callable
 
 from internal import STATE
-from internal.actions.delete import DeleteAction
+from internal.actions.delete import DeleteLinesAction, RemoveAction
 from internal.editor import EditorState
 from lymia import ReturnInfo, const
 from lymia.colors import ColorPair
@@ -108,9 +109,17 @@ def move_relmice(editor: EditorState):
     if bstate in (MICE_SCROLL_UP, MICE_SCROLL_DOWN):  # Scroll up = B4
         return ReturnType.CONTINUE
 
-    vrow = editor.window.start + row
+    if editor.window.wrap:
+        vrow, sub = editor.buffer.wrap_index(editor.window.wrap).find(editor.window.vtop + row)
+        if vrow < editor.buffer.size:
+            starts = editor.buffer.wrap_starts(vrow)
+            col += starts[min(sub, len(starts) - 1)]
+    else:
+        vrow = editor.window.start + row
+        col += editor.window.shift
     if vrow >= editor.buffer.size or editor.window.end <= 0:
         return ReturnType.CONTINUE
+    col = editor.buffer.col_at(vrow, col)
     sizeof = editor.buffer.sizeof_line(vrow)
     if col >= sizeof:
         col = sizeof - 1
@@ -142,62 +151,48 @@ def key_modifier(key: str, editor: EditorState):
 
     if editor.buffer.size == 0:
         editor.buffer.insert(0, "")
-    bufferline = editor.buffer[current_line]
-    sizeof = len(bufferline)
-    if current_col >= sizeof:
-        editor.buffer.replace(current_line, bufferline + key)
-        editor.cursor.col += 1
-        return ReturnType.OK
-    # insertion based on current column
+    # insertion based on current column, the line is held in a gap buffer
     # abcdefghijk
     #    ^ (current column: insert r)
     # abcdrefghijk
-    left = bufferline[:current_col]
-    right = bufferline[current_col:]
+    sizeof = editor.buffer.sizeof_line(current_line)
+    editor.buffer.insert_text(current_line, min(current_col, sizeof), key)
     editor.cursor.col += 1
-    editor.buffer.replace(current_line, left + key + right)
     return ReturnType.OK
 
 
 def remove_current_char(editor: EditorState):
     """Remove current char from current buffer"""
-    import internal.modes.normal
-
     if editor.buffer.size == 0:
         return ReturnType.ERR
     current_line = editor.cursor.row
     current_col = editor.cursor.col
-    bufferline = editor.buffer[current_line]
-    if bufferline == "":
+    sizeof = editor.buffer.sizeof_line(current_line)
+    if sizeof == 0:
         editor.buffer.delete(current_line)
         if editor.cursor.row == 0:
             return ReturnType.CONTINUE
         editor.cursor.row -= 1
         editor.cursor.col = editor.buffer.sizeof_line(editor.cursor.row)
         return ReturnType.OK
-    if current_col >= len(bufferline):
-        editor.buffer.replace(current_line, bufferline[:-1])
+    if current_col >= sizeof:
+        editor.buffer.delete_text(current_line, sizeof - 1)
         editor.cursor.col -= 1
         return ReturnType.OK
-    if current_col == 0 and not isinstance(
-        editor.mode[0], internal.modes.normal.NormalMode
-    ):
+    if current_col == 0 and editor.mode[0] is not registry.get("normal"):
         if current_line == 0:
             return ReturnType.CONTINUE
+        bufferline = editor.buffer[current_line]
         prev_line = editor.buffer[current_line - 1]
         editor.buffer[current_line - 1] = prev_line + bufferline
         editor.buffer.delete(current_line)
         editor.cursor.row -= 1
         return ReturnType.OK
 
-    if isinstance(editor.mode[0], internal.modes.normal.NormalMode):
-        left = bufferline[:current_col]
-        right = bufferline[current_col + 1 :]
+    if editor.mode[0] is registry.get("normal"):
+        editor.buffer.delete_text(current_line, current_col)
     else:
-        left = bufferline[: current_col - 1]
-        right = bufferline[current_col:]
-
-    editor.buffer.replace(current_line, left + right)
+        editor.buffer.delete_text(current_line, current_col - 1)
     if editor.cursor.col == 0:
         return ReturnType.CONTINUE
     editor.cursor.col -= 1
@@ -205,8 +200,6 @@ def remove_current_char(editor: EditorState):
 
 def rmc(editor: EditorState):
     """Remove current character"""
-    import internal.modes.normal
-
     if editor.buffer.size == 0:
         return ReturnType.ERR
     current_line = editor.cursor.row
@@ -214,7 +207,7 @@ def rmc(editor: EditorState):
     bufferline = editor.buffer[current_line]
 
     if bufferline == "":
-        editor.history.push(DeleteAction(editor.cursor.row, 0, '\n', 1))
+        editor.history.push(DeleteLinesAction(current_line, [""]))
         editor.buffer.delete(current_line)
         if editor.cursor.row == 0:
             return ReturnType.CONTINUE
@@ -222,38 +215,58 @@ def rmc(editor: EditorState):
         editor.cursor.col = editor.buffer.sizeof_line(editor.cursor.row)
         return ReturnType.OK
     if current_col >= len(bufferline):
-        editor.history.push(DeleteAction(current_line, len(bufferline)-1, bufferline[-1]))
+        editor.history.push(RemoveAction(current_line, len(bufferline) - 1, bufferline[-1]))
         editor.buffer.replace(current_line, bufferline[:-1])
         editor.cursor.col -= 1
         return ReturnType.OK
-    if current_col == 0 and not isinstance(
-        editor.mode[0], internal.modes.normal.NormalMode
-    ):
+    if current_col == 0 and editor.mode[0] is not registry.get("normal"):
         if current_line == 0:
             return ReturnType.CONTINUE
         prev_line = editor.buffer[current_line - 1]
         editor.buffer[current_line - 1] = prev_line + bufferline
-        editor.history.push(DeleteAction(current_line, 0, "\n"))
+        editor.history.push(RemoveAction(current_line - 1, len(prev_line), "\n"))
         editor.buffer.delete(current_line)
         editor.cursor.row -= 1
         return ReturnType.OK
 
-    if isinstance(editor.mode[0], internal.modes.normal.NormalMode):
-        left = bufferline[:current_col]
-        right = bufferline[current_col + 1 :]
-    else:
-        left = bufferline[: current_col - 1]
-        right = bufferline[current_col:]
+    if editor.mode[0] is not registry.get("normal"):
+        current_col -= 1
+    left = bufferline[:current_col]
+    right = bufferline[current_col + 1 :]
 
     editor.buffer.replace(current_line, left + right)
-    editor.history.push(
-        DeleteAction(editor.cursor.row, editor.cursor.col, bufferline[current_col])
-    )
+    editor.history.push(RemoveAction(current_line, current_col, bufferline[current_col]))
     if editor.cursor.col == 0:
         return ReturnType.CONTINUE
     editor.cursor.col -= 1
     return ReturnType.OK
 
+KEY_DIGITS = range(ord("1"), ord("9") + 1)
+
+
+class KeyNode:
+    """Key sequence trie node, `action` is bound to the keys leading here"""
+
+    __slots__ = ("action", "children")
+
+    def __init__(self) -> None:
+        self.action: Callable[[EditorState], ReturnType | ReturnInfo] | None = None
+        self.children: dict[int, "KeyNode"] = {}
+
+
+def compile_keymap(keymap: dict[int | str, Callable[[Any], ReturnType | ReturnInfo]]):
+    """Compile a keymap into a key trie, multi-character strings are key sequences"""
+    root = KeyNode()
+    for key, action in keymap.items():
+        node = root
+        for code in map(ord, key) if isinstance(key, str) else (key,):
+            if code not in node.children:
+                node.children[code] = KeyNode()
+            node = node.children[code]
+        node.action = action
+    return root.children
+
+
 CURSOR_KEYMAP = {
     curses.KEY_LEFT: go_left,
     curses.KEY_RIGHT: go_right,
@@ -265,21 +278,43 @@ CURSOR_KEYMAP = {
 
 
 class Modes:
-    """Modes"""
+    """Modes
+
+    `keymap` is compiled into a key trie once per class. Multi-character
+    string keys are sequences (`"gg"`), and with `counts` a numeric prefix
+    repeats the bound action."""
 
     theme: ColorPair
     term_vis: int = 1
     curs_style: int
+    counts: bool = False
     keymap: dict[int | str, Callable[[Any], ReturnType | ReturnInfo]] = {}
+    _trie: dict[int, KeyNode] = {}
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._trie = compile_keymap(cls.keymap)
 
     def __init__(self) -> None:
-        self._keymap: dict[int, Callable[[EditorState], ReturnType | ReturnInfo]] = {}
         self._record_delete: bool = False
         self._delete_hist = []
-        for key, value in self.keymap.items():  # type: ignore
-            if isinstance(key, str):
-                key: int = ord(key)
-            self._keymap[key] = value
+        self._pending: KeyNode | None = None
+        self._pending_at = 0.0
+        self._count = 0
+
+    @property
+    def pending(self):
+        """Whether a key sequence is waiting for more keys"""
+        return self._pending is not None
+
+    def reset_keys(self):
+        """Drop a pending key sequence and count"""
+        self._pending = None
+        self._count = 0
+
+    def reset(self):
+        """Reset per-visit state, called before the mode is entered again"""
+        self.reset_keys()
 
     def record_backspace(
         self,
@@ -299,14 +334,62 @@ class Modes:
         if self._record_delete is False:
             pre_callback(key, editor)
 
+    def _dispatch(
+        self, action: Callable[[EditorState], ReturnType | ReturnInfo], editor: EditorState
+    ):
+        count = max(self._count, 1)
+        self.reset_keys()
+        ret: ReturnType | ReturnInfo = ReturnType.CONTINUE
+        for _ in range(count):
+            ret = action(editor)
+            if ret == ReturnType.REVERT_OVERRIDE:
+                return self.on_exit(editor)
+            if ret not in (ReturnType.OK, ReturnType.CONTINUE):
+                break
+        return ret
+
     def handle_key(self, key: int, editor: EditorState) -> ReturnType | ReturnInfo:
         """Handle key"""
-        for kfn, fn in self._keymap.items():
-            if key == kfn:
-                xfn = fn(editor)
-                if xfn == ReturnType.REVERT_OVERRIDE:
-                    return self.on_exit(editor)
-                return xfn
+        pending = self._pending
+        if pending is None and self.counts and (
+            key in KEY_DIGITS or (key == ord("0") and self._count)
+        ):
+            self._count = self._count * 10 + key - ord("0")
+            return ReturnType.CONTINUE
+        node = (pending.children if pending else self._trie).get(key)
+        if node is None:
+            if pending is None:
+                self._count = 0
+                return ReturnType.CONTINUE
+            if key == const.KEY_ESC or pending.action is None:
+                self.reset_keys()
+                return ReturnType.CONTINUE
+            # The prefix is bound on its own, run it and start over with key
+            ret = self._dispatch(pending.action, editor)
+            if ret not in (ReturnType.OK, ReturnType.CONTINUE, ReturnType.ERR):
+                return ret
+            return self.handle_key(key, editor)
+        if node.children:
+            self._pending = node
+            self._pending_at = monotonic()
+            return ReturnType.CONTINUE
+        if node.action is None:
+            self.reset_keys()
+            return ReturnType.CONTINUE
+        return self._dispatch(node.action, editor)
+
+    def expire(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        """Resolve a pending key sequence once STATE["key_timeout"] has passed"""
+        pending = self._pending
+        if pending is None or (monotonic() - self._pending_at) * 1000 < STATE["key_timeout"]:
+            return ReturnType.CONTINUE
+        if pending.action is None:
+            self.reset_keys()
+            return ReturnType.CONTINUE
+        return self._dispatch(pending.action, editor)
+
+    def on_paste(self, text: str, editor: EditorState) -> ReturnType | ReturnInfo:
+        """On bracketed paste event, `text` is the whole pasted payload"""
         return ReturnType.CONTINUE
 
     def on_enter(self, editor: EditorState) -> ReturnType:
@@ -316,3 +399,30 @@ class Modes:
     def on_exit(self, editor: EditorState) -> ReturnType:
         """On exit event"""
         return NotImplemented
+
+
+class ModeRegistry:
+    """Mode instances, each mode is constructed once and reused on every switch"""
+
+    def __init__(self) -> None:
+        self._modes: dict[str, Modes] = {}
+
+    def register(self, name: str):
+        """Register a mode class under name"""
+
+        def inner(cls: type[Modes]):
+            self._modes[name] = cls()
+            return cls
+
+        return inner
+
+    def get(self, name: str) -> Modes:
+        """Mode instance registered as name"""
+        return self._modes[name]
+
+    def switch(self, name: str) -> ReturnInfo:
+        """Context switch to the mode registered as name"""
+        return ReturnInfo(ReturnType.OVERRIDE, "context switching", self._modes[name])
+
+
+registry = ModeRegistry()
@@ -8,10 +8,9 @@ from lymia import const
 from internal.editor import EditorState
 from internal import Basic
 from internal.utils import set_cursor
-import internal.modes.normal
 from internal.actions.edit import EditAction
 from internal.actions.delete import DeleteAction
-from . import Modes, CURSOR_KEYMAP, TRIGGER_EVENT, key_modifier, remove_current_char
+from . import Modes, CURSOR_KEYMAP, TRIGGER_EVENT, key_modifier, registry, remove_current_char
 
 mapped = tuple(map(ord, printable))
 BACKSPACE = (curses.KEY_BACKSPACE, const.KEY_BACKSPACE)
@@ -26,6 +25,7 @@ def current_line(editor: EditorState):
     """Current line"""
     return editor.buffer[editor.cursor.row]
 
+@registry.register("edit")
 class EditMode(Modes):
     """Insert Modes"""
 
@@ -33,9 +33,7 @@ class EditMode(Modes):
     theme = Basic.FNBUFFER_EDIT
     keymap = {
         **CURSOR_KEYMAP,
-        const.KEY_ESC: lambda _: ReturnInfo(
-            ReturnType.OVERRIDE, "context switch", internal.modes.normal.NormalMode()
-        ),
+        const.KEY_ESC: lambda _: registry.switch("normal"),
         curses.KEY_BACKSPACE: remove_current_char,
         const.KEY_BACKSPACE: remove_current_char
     }
@@ -46,6 +44,12 @@ class EditMode(Modes):
         self._meta = {"col": 0, "row": 0, "buffer": self._buffer}
         self._mode = "edit"
 
+    def reset(self):
+        super().reset()
+        self._buffer.clear()
+        self._meta = {"col": 0, "row": 0, "buffer": self._buffer}
+        self._mode = "edit"
+
     def on_key(self, key: str, editor: EditorState):
         """On key event listener"""
         ret = key_modifier(key, editor)
@@ -54,6 +58,20 @@ class EditMode(Modes):
             self._buffer.append(key)
         return ret
 
+    def on_paste(self, text: str, editor: EditorState):
+        """Insert a paste in one go and record it as a single EditAction"""
+        self._push(editor, DeleteAction if self._mode == 'delete' else EditAction)
+        if editor.buffer.size == 0:
+            editor.buffer.insert(0, "")
+        row = editor.cursor.row
+        col = min(editor.cursor.col, editor.buffer.sizeof_line(row))
+        end = editor.buffer.insert_block(row, col, text)
+        editor.history.push(EditAction(row, col, text))
+        editor.cursor.move_to(*end)
+        self._meta = {"row": end[0], "col": end[1], "buffer": self._buffer}
+        self._mode = ""
+        return ReturnType.OK
+
     def on_enter(self, editor: EditorState):
         curses.curs_set(self.term_vis)
         set_cursor(self.curs_style)
@@ -90,6 +108,7 @@ class EditMode(Modes):
             editor.cursor.col -= 1
         if self._buffer and self._mode:
             self._push(editor, EditAction if self._mode == 'edit' else DeleteAction)
+        editor.buffer.flush()
         return ReturnType.REVERT_OVERRIDE
 
     def handle_key(self, key: int, editor: EditorState) -> ReturnType | ReturnInfo:
@@ -103,7 +122,10 @@ class EditMode(Modes):
                 "buffer": self._buffer
             }
             self._mode = ""
-            return super().handle_key(key, editor)
+            ret = super().handle_key(key, editor)
+            if editor.cursor.row != editor.buffer.active_row:
+                editor.buffer.flush()
+            return ret
 
         if key in BACKSPACE and self._mode == '':
             self._mode = 'delete'
@@ -2,26 +2,35 @@
 
 import curses
 from internal import Basic
-from lymia import ReturnInfo, ReturnType
-import internal.modes.normal
+from lymia import ReturnType
 from internal.editor import EditorState
-from internal.modes import Modes
+from internal.modes import Modes, registry
 
 
+@registry.register("help")
 class HelpMode(Modes):
     """Help mode"""
     curs_style = 0
     term_vis = 0
     theme = Basic.FNBUFFER_NORMAL
     keymap = {
-        'q': lambda _: ReturnInfo(
-            ReturnType.OVERRIDE, "context switch", internal.modes.normal.NormalMode()
-        ),
+        'q': lambda _: registry.switch("normal"),
     }
 
+    def __init__(self) -> None:
+        super().__init__()
+        # Shown instead of the key help when set, see show()
+        self.text = ""
+
+    def show(self, text: str):
+        """Switch to help mode showing text"""
+        self.text = text
+        return registry.switch("help")
+
     def on_enter(self, editor: EditorState) -> ReturnType:
         curses.curs_set(self.term_vis)
         return ReturnType.OVERRIDE
 
     def on_exit(self, editor: EditorState) -> ReturnType:
+        self.text = ""
         return ReturnType.REVERT_OVERRIDE
@@ -1,28 +1,34 @@
 """Normal Mode"""
 import curses
+import re
 from lymia import ReturnInfo, ReturnType, status
 from lymia.data import _StatusInfo
+from lymia.forms import Text
 from lymia import const
-import internal.modes.edit
-import internal.modes.helpmode
-import internal.modes.visual
+# Imported so the modes switched to from here are registered
+import internal.modes.edit  # pylint: disable=unused-import
+import internal.modes.helpmode  # pylint: disable=unused-import
+import internal.modes.visual  # pylint: disable=unused-import
 from internal.editor import EditorState
 from internal import STATE, Basic, use_mice, disable_mice as mice_disable
 from internal.utils import set_cursor
 from internal.command import command
-from . import Modes, CURSOR_KEYMAP, TRIGGER_EVENT, rmc
+from internal.actions.delete import DeleteLinesAction
+from internal.brackets import BRACKETS
+from internal.undofile import save_history
+from . import Modes, CURSOR_KEYMAP, TRIGGER_EVENT, registry, rmc
 
 def to_insert(_):
     """To insert mode"""
-    return ReturnInfo(ReturnType.OVERRIDE, "context switching", internal.modes.edit.EditMode())
+    return registry.switch("edit")
 
 def to_help(_):
     """To help mode"""
-    return ReturnInfo(ReturnType.OVERRIDE, "context switching", internal.modes.helpmode.HelpMode())
+    return registry.switch("help")
 
 def to_visual(_):
     """To visual mode"""
-    return ReturnInfo(ReturnType.OVERRIDE, "context switching", internal.modes.visual.VisualMode())
+    return registry.switch("visual")
 
 def go_right(editor: EditorState):
     """Go next char"""
@@ -47,6 +53,8 @@ def cjump_to(editor: EditorState, col: int):
 
 def rjump_to(editor: EditorState, row: int):
     """Jump to (row)"""
+    if editor.buffer.loading and (row >= editor.buffer.size or row == -1):
+        editor.buffer.wait_loaded(row)
     if editor.buffer.size == 0:
         return ReturnType.CONTINUE
     if row >= editor.buffer.size or row == -1:
@@ -56,6 +64,33 @@ def rjump_to(editor: EditorState, row: int):
     editor.cursor.row = row
     return ReturnType.OK
 
+def match_pair(editor: EditorState):
+    """Jump to the bracket paired with the first one from the cursor on"""
+    if editor.buffer.size == 0:
+        return ReturnType.CONTINUE
+    row = editor.cursor.row
+    line = editor.buffer[row]
+    col = next((col for col in range(editor.cursor.col, len(line)) if line[col] in BRACKETS), -1)
+    found = editor.buffer.match_bracket(row, col, wait=True) if col != -1 else None
+    if found is None:
+        return ReturnType.CONTINUE
+    editor.cursor.move_to(*found)
+    return ReturnType.OK
+
+def delete_line(editor: EditorState):
+    """Delete current line"""
+    if editor.buffer.size == 0:
+        return ReturnType.CONTINUE
+    row = editor.cursor.row
+    editor.history.push(DeleteLinesAction(row, [editor.buffer[row]]))
+    editor.buffer.delete(row)
+    if editor.buffer.size == 0:
+        editor.cursor.move_to(0, 0)
+        return ReturnType.OK
+    row = min(row, editor.buffer.size - 1)
+    editor.cursor.move_to(row, min(editor.cursor.col, max(editor.buffer.sizeof_line(row) - 1, 0)))
+    return ReturnType.OK
+
 def undo(editor: EditorState):
     """Undo"""
     return editor.history.undo(editor)
@@ -66,10 +101,40 @@ def redo(editor: EditorState):
 
 def write_to_disk(editor: EditorState):
     """Write to disk"""
-    editor.buffer.write()
+    # A half written file no longer matches the journal's base, so its
+    # changes could not be recovered
+    ret = editor.buffer.write(in_place=editor.history.journal is None)
+    if isinstance(ret, ReturnInfo):
+        editor.status.set(f"Not saved: {ret.reason}")
+        return ReturnType.ERR
     editor.status.set("Saved")
+    if ret == ReturnType.OK and editor.history.journal:
+        editor.history.journal.reset()
+    if ret == ReturnType.OK and STATE["undo_file"]:
+        try:
+            save_history(editor.history, editor.buffer.filename)
+        except OSError as exc:
+            editor.status.set(f"Saved, undo history not kept: {exc}")
+    return ReturnType.OK
+
+def _search_again(editor: EditorState, same: bool):
+    search = editor.search
+    if not search.pattern:
+        editor.status.set("No previous search pattern")
+        return ReturnType.ERR
+    # Matches hidden by :noh show up again
+    search.set(search.pattern, search.forward)
+    search.start(editor, editor.cursor.row, editor.cursor.col, search.forward == same)
     return ReturnType.OK
 
+def search_next(editor: EditorState):
+    """Next match of the last search, in its direction"""
+    return _search_again(editor, True)
+
+def search_prev(editor: EditorState):
+    """Previous match of the last search"""
+    return _search_again(editor, False)
+
 def mouse_toggle(_: EditorState):
     """Enable mice"""
     if STATE['use_mice']:
@@ -95,10 +160,12 @@ def tdebug(editor: EditorState):
     return ReturnType.OK
 
 
+@registry.register("normal")
 class NormalMode(Modes):
     """Modes"""
     curs_style = 1
     theme = Basic.FNBUFFER_NORMAL
+    counts = True
     keymap = {
         **CURSOR_KEYMAP,
         curses.KEY_RIGHT: go_right,
@@ -114,8 +181,12 @@ class NormalMode(Modes):
         "U": redo,
         'w': write_to_disk,
         'h': to_help,
-        'g': lambda editor: rjump_to(editor, 0),
+        'gg': lambda editor: rjump_to(editor, 0),
+        'dd': delete_line,
         'G': lambda editor: rjump_to(editor, -1),
+        '%': match_pair,
+        'n': search_next,
+        'N': search_prev,
         'l': mouse_toggle,
         ';': toggle_mice_naivety,
         '`': tdebug,
@@ -128,14 +199,31 @@ class NormalMode(Modes):
         self._during_undo: bool = False
         self._dbg: _StatusInfo | None = None
         self._cmdoverride = False
+        # "/" or "?" while typing a search, its origin and the search before it
+        self._searching = ""
+        self._search_prompt = Text("")
+        self._search_from = (0, 0)
+        self._search_last = ("", True)
+
+    @property
+    def prompting(self):
+        """Whether the command line or the search prompt is open"""
+        return self._cmdoverride or bool(self._searching)
+
+    def reset(self):
+        super().reset()
+        self._during_undo = False
 
-    def switch_to_command(self, editor: EditorState):
-        """Command"""
+    def switch_to_command(self, editor: EditorState, text: str = ""):
+        """Command, `text` is typed in ahead"""
         if self._cmdoverride:
             return ReturnType.ERR
+        # A count or keys typed before ':' do not carry over to after the prompt
+        self.reset_keys()
+        command.buffer.value = text
         command.buffer.enter_edit()
         self._cmdoverride = True
-        status.set(":")
+        status.set(f":{text}")
         command.buffer.set_field_pos(editor.window.term_height - 1)
         return ReturnType.OVERRIDE
 
@@ -157,12 +245,68 @@ class NormalMode(Modes):
         return ret
 
 
+    def switch_to_search(self, editor: EditorState, prefix: str):
+        """Search prompt, `prefix` is "/" to search forward or "?" backward"""
+        self.reset_keys()
+        self._searching = prefix
+        self._search_from = (editor.cursor.row, editor.cursor.col)
+        self._search_last = (editor.search.pattern, editor.search.forward)
+        self._search_prompt.enter_edit()
+        status.set(prefix)
+        self._search_prompt.set_field_pos(editor.window.term_height - 1)
+        return ReturnType.OVERRIDE
+
+    def _search(self, editor: EditorState, pattern: str, report: bool):
+        """Search for pattern from where the prompt was opened"""
+        forward = self._searching == "/"
+        editor.cursor.move_to(*self._search_from)
+        try:
+            editor.search.set(pattern, forward)
+        except re.error as exc:
+            if report:
+                editor.status.set(f"Invalid pattern: {exc}")
+                return ReturnType.ERR
+            return ReturnType.OK
+        if pattern:
+            editor.search.start(editor, *self._search_from, forward, report)
+        return ReturnType.OK
+
+    def handle_search(self, key: int, editor: EditorState):
+        """Handle search prompt, the cursor follows the pattern as it is typed"""
+        prompt = self._search_prompt
+        if key == const.KEY_ESC:
+            prompt.exit_edit()
+            prompt.value = ""
+            status.set("")
+            editor.cursor.move_to(*self._search_from)
+            editor.search.set(*self._search_last)
+            self._searching = ""
+            return ReturnType.OK
+        ret = prompt.handle_edit(key)
+        status.set(f"{self._searching}{prompt.displayed_value}")
+        if ret == ReturnType.REVERT_OVERRIDE:
+            prompt.exit_edit()
+            status.set("")
+            # An empty pattern repeats the last search
+            ret = self._search(editor, prompt.value or self._search_last[0], True)
+            prompt.value = ""
+            self._searching = ""
+            return ret
+        if prompt.value != editor.search.pattern:
+            self._search(editor, prompt.value, False)
+        return ReturnType.OK
+
     def handle_key(self, key: int, editor: EditorState) -> ReturnType | ReturnInfo:
-        if key == ord(':') and self._cmdoverride is False:
+        if key == ord(':') and self._cmdoverride is False and not self._searching:
             self.switch_to_command(editor)
             return ReturnType.OK
         if self._cmdoverride:
             return self.handle_cmd(key)
+        if self._searching:
+            return self.handle_search(key, editor)
+        if key in (ord('/'), ord('?')) and not self.pending:
+            self.switch_to_search(editor, chr(key))
+            return ReturnType.OK
         if key in TRIGGER_EVENT and self._during_undo:
             self._during_undo = False
 
@@ -173,3 +317,16 @@ class NormalMode(Modes):
         self._dbg = editor.debug.status
         set_cursor(self.curs_style)
         return ReturnType.OVERRIDE
+
+    def on_exit(self, editor: EditorState):
+        # A prompt left open would swallow the keys of the next visit. Not
+        # done in reset(), visual mode opens the command line ahead of it.
+        if self._cmdoverride:
+            command.buffer.exit_edit()
+            command.buffer.value = ""
+            self._cmdoverride = False
+        if self._searching:
+            self._search_prompt.exit_edit()
+            self._search_prompt.value = ""
+            self._searching = ""
+        return ReturnType.REVERT_OVERRIDE
@@ -9,12 +9,16 @@ from lymia.data import _StatusInfo
 from internal.utils import set_cursor
 from internal import Basic
 from internal.editor import EditorState
-import internal.modes.normal
-from . import Modes, go_down, go_left, go_right, go_up, move_relmice
+from . import Modes, go_down, go_left, go_right, go_up, move_relmice, registry
 
 def to_normal(_: EditorState):
     """To normal mode"""
-    return ReturnInfo(ReturnType.OVERRIDE, "context switching", internal.modes.normal.NormalMode())
+    return registry.switch("normal")
+
+def to_command(editor: EditorState):
+    """Command line over the selected lines"""
+    registry.get("normal").switch_to_command(editor, "'<,'>")  # type: ignore
+    return registry.switch("normal")
 
 def repatch(callback: Callable[[EditorState], ReturnType | ReturnInfo]):
     """Repatch"""
@@ -29,11 +33,13 @@ def repatch(callback: Callable[[EditorState], ReturnType | ReturnInfo]):
     return inner
 
 
+@registry.register("visual")
 class VisualMode(Modes):
     """Visual mode"""
 
     theme = Basic.FNBUFFER_SELECT
     curs_style = 1
+    counts = True
 
     keymap = {
         curses.KEY_UP: repatch(go_up),
@@ -42,7 +48,8 @@ class VisualMode(Modes):
         curses.KEY_RIGHT: repatch(go_right),
         curses.KEY_MOUSE: repatch(move_relmice),
         const.KEY_ESC: to_normal,
-        'q': to_normal
+        'q': to_normal,
+        ':': to_command,
     }
 
     def __init__(self) -> None:
@@ -0,0 +1,252 @@
+"""Piece table, line-oriented storage backend for Buffer"""
+
+from random import random
+from typing import Iterator, Sequence
+
+ORIGINAL = 0
+ADDED = 1
+ITER_CHUNK = 4096
+
+
+class Piece:
+    """A run of lines taken from one of the piece table sources.
+
+    Pieces are kept in a treap ordered by position, every node carries the
+    total line count of its subtree so lookups and splits are O(log n)."""
+
+    __slots__ = ("source", "start", "count", "prio", "total", "left", "right")
+
+    def __init__(self, source: int, start: int, count: int, prio: float | None = None) -> None:
+        self.source = source
+        self.start = start
+        self.count = count
+        self.prio = random() if prio is None else prio
+        self.total = count
+        self.left: "Piece | None" = None
+        self.right: "Piece | None" = None
+
+    def __repr__(self) -> str:
+        return f"<Piece {self.source}:{self.start}+{self.count}>"
+
+
+def _total(node: Piece | None):
+    return node.total if node else 0
+
+
+def _update(node: Piece):
+    node.total = node.count + _total(node.left) + _total(node.right)
+
+
+def _merge(left: Piece | None, right: Piece | None) -> Piece | None:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.prio > right.prio:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _split(node: Piece | None, lines: int) -> tuple[Piece | None, Piece | None]:
+    """Split tree into (first `lines` lines, the rest)"""
+    if node is None:
+        return None, None
+    ltotal = _total(node.left)
+    if lines <= ltotal:
+        left, node.left = _split(node.left, lines)
+        _update(node)
+        return left, node
+    if lines >= ltotal + node.count:
+        node.right, right = _split(node.right, lines - ltotal - node.count)
+        _update(node)
+        return node, right
+    # The split point falls inside this piece, cut it in two.
+    offset = lines - ltotal
+    tail = Piece(node.source, node.start + offset, node.count - offset, node.prio)
+    tail.right = node.right
+    _update(tail)
+    node.count = offset
+    node.right = None
+    _update(node)
+    return node, tail
+
+
+class PieceTable:
+    """Piece table
+
+    `original` is the read-only sequence of lines the buffer was loaded from,
+    every inserted line is appended to the add buffer and never mutated.
+    The document is the in-order concatenation of the pieces."""
+
+    def __init__(self, original: Sequence[str] = ()) -> None:
+        self._original = original
+        self._added: list[str] = []
+        self._sources = (self._original, self._added)
+        self._root: Piece | None = Piece(ORIGINAL, 0, len(original)) if len(original) else None
+        # (first line, add buffer offset) of original lines copied out by
+        # move_original(), oldest first
+        self._moved: list[tuple[int, int]] = []
+
+    def _index(self, index: int):
+        size = _total(self._root)
+        if index < 0:
+            index += size
+        if index < 0 or index >= size:
+            raise IndexError("piece table index out of range")
+        return index
+
+    def __len__(self):
+        return _total(self._root)
+
+    def __getitem__(self, index: int) -> str:
+        index = self._index(index)
+        node = self._root
+        while node:
+            ltotal = _total(node.left)
+            if index < ltotal:
+                node = node.left
+                continue
+            index -= ltotal
+            if index < node.count:
+                return self._sources[node.source][node.start + index]
+            index -= node.count
+            node = node.right
+        raise IndexError("piece table index out of range")  # pragma: no cover
+
+    def __setitem__(self, index: int, line: str):
+        index = self._index(index)
+        self.delete_lines(index, 1)
+        self.insert_lines(index, [line])
+
+    def __iter__(self) -> Iterator[str]:
+        return self.iter_from(0)
+
+    def iter_from(self, pos: int) -> Iterator[str]:
+        """Iterate lines starting at `pos`"""
+        stack: list[Piece] = []
+        node = self._root
+        skip = max(pos, 0)
+        while node:
+            ltotal = _total(node.left)
+            if skip < ltotal:
+                stack.append(node)
+                node = node.left
+                continue
+            skip -= ltotal
+            if skip < node.count:
+                stack.append(node)
+                break
+            skip -= node.count
+            node = node.right
+        first = True
+        while stack:
+            node = stack.pop()
+            source = self._sources[node.source]
+            start = node.start + (skip if first else 0)
+            end = node.start + node.count
+            first = False
+            # Slice in chunks so lazily decoded sources never materialise a whole piece
+            for chunk in range(start, end, ITER_CHUNK):
+                yield from source[chunk:min(chunk + ITER_CHUNK, end)]
+            node = node.right
+            while node:
+                stack.append(node)
+                node = node.left
+
+    @property
+    def pieces(self) -> list[Piece]:
+        """Pieces in document order"""
+        out: list[Piece] = []
+        stack: list[Piece] = []
+        node = self._root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            out.append(node)
+            node = node.right
+        return out
+
+    def snapshot(self) -> tuple[tuple[int, int, int], ...]:
+        """(source, start, count) of every piece, sources are append-only so
+        this is enough to return to the current document later"""
+        return tuple((piece.source, piece.start, piece.count) for piece in self.pieces)
+
+    def restore(self, snapshot: tuple[tuple[int, int, int], ...]):
+        """Return to a document taken by snapshot()"""
+        root = None
+        for source, start, count in snapshot:
+            for piece in self._relocate(source, start, count):
+                root = _merge(root, Piece(*piece))
+        self._root = root
+
+    def _relocate(self, source: int, start: int, count: int):
+        """Pieces reading what (source, start, count) read when it was taken,
+        original lines moved since then come from the add buffer"""
+        if source != ORIGINAL:
+            return [(source, start, count)]
+        pieces = []
+        for first, offset in self._moved:
+            end = start + count
+            if end <= first:
+                continue
+            if start < first:
+                pieces.append((ADDED, offset, end - first))
+                count = first - start
+            else:
+                return [(ADDED, offset + start - first, count)] + pieces[::-1]
+        return [(ORIGINAL, start, count)] + pieces[::-1]
+
+    def move_original(self, start: int, lines: Sequence[str]):
+        """The original lines from `start` on, which are `lines`, are about to
+        change. Copy them to the add buffer, snapshots taken so far keep
+        restoring what they held. The document must not read them anymore."""
+        self._moved.append((start, len(self._added)))
+        self._added.extend(lines)
+
+    def copy(self) -> "PieceTable":
+        """Table of the current document that later edits to this one leave alone"""
+        table = PieceTable(self._original)
+        table._added = self._added
+        table._sources = self._sources
+        table._moved = self._moved
+        table.restore(self.snapshot())
+        return table
+
+    def insert(self, pos: int, line: str):
+        """Insert a line before `pos` (list compatible)"""
+        self.insert_lines(pos, [line])
+
+    def pop(self, pos: int = -1) -> str:
+        """Remove and return a line (list compatible)"""
+        pos = self._index(pos)
+        line = self[pos]
+        self.delete_lines(pos, 1)
+        return line
+
+    def insert_lines(self, pos: int, lines: Sequence[str]):
+        """Insert lines before `pos` as a single piece"""
+        if not lines:
+            return
+        size = len(self)
+        if pos < 0:
+            pos = max(pos + size, 0)
+        pos = min(pos, size)
+        piece = Piece(ADDED, len(self._added), len(lines))
+        self._added.extend(lines)
+        left, right = _split(self._root, pos)
+        self._root = _merge(_merge(left, piece), right)
+
+    def delete_lines(self, pos: int, count: int):
+        """Delete `count` lines starting at `pos`"""
+        if count <= 0:
+            return
+        pos = self._index(pos)
+        left, rest = _split(self._root, pos)
+        _, right = _split(rest, count)
+        self._root = _merge(left, right)
@@ -0,0 +1,281 @@
+"""Regex search over the buffer
+
+Matches are kept in a sorted index of (row, col), so stepping to the
+next or previous one is a bisection. Small buffers are indexed at once,
+larger ones by a worker thread. Until that index is ready, the cursor
+moves by scanning the buffer in chunks between keys. Both only look at
+the rows the buffer's trigram index leaves as candidates."""
+
+import re
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from sys import maxsize
+from threading import Thread
+from typing import TYPE_CHECKING, Callable, Generator, Iterator, Sequence
+
+from internal.buffer import Buffer
+from internal.mapped import MappedLines
+from internal.trigram import read_lines, required_literals
+
+if TYPE_CHECKING:
+    from internal.editor import EditorState
+
+# Lines scanned before giving input a chance
+SCAN_CHUNK = 2048
+# Buffers with more lines are indexed by a worker thread
+INDEX_INLINE = 20000
+
+Position = tuple[int, int]
+# Row ranges [start, end) that may hold matches, None for every row
+Ranges = list[tuple[int, int]] | None
+
+
+@lru_cache(maxsize=32)
+def compile_pattern(pattern: str) -> re.Pattern:
+    """Compiled pattern, cached so retyping or repeating a search never recompiles"""
+    return re.compile(pattern)
+
+
+def _first(regex: re.Pattern, line: str, low: int, high: int):
+    """Column of the first match starting in [low, high), -1 if none"""
+    match = regex.search(line, low)
+    if match and low <= match.start() < high:
+        return match.start()
+    return -1
+
+
+def _last(regex: re.Pattern, line: str, low: int, high: int):
+    """Column of the last match starting in [low, high), -1 if none"""
+    found = -1
+    for match in regex.finditer(line, low):
+        if match.start() >= high:
+            break
+        if match.start() >= low:
+            found = match.start()
+    return found
+
+
+def _rows(start: int, end: int, ranges: Ranges, forward: bool = True) -> Iterator[int]:
+    """Rows in [start, end) that are within ranges, in order or reversed"""
+    spans = [(start, end)]
+    if ranges is not None:
+        spans = [(max(low, start), min(high, end)) for low, high in ranges if low < end and high > start]
+    if forward:
+        for low, high in spans:
+            yield from range(low, high)
+    else:
+        for low, high in reversed(spans):
+            yield from range(high - 1, low - 1, -1)
+
+
+def build_index(
+    lines: Sequence[str],
+    regex: re.Pattern,
+    stop: Callable[[], bool] = lambda: False,
+    ranges: Ranges = None,
+) -> list[Position] | None:
+    """Sorted (row, col) of every match within ranges, None when `stop`
+    asked to give up"""
+    if isinstance(lines, MappedLines):
+        lines.wait()
+    matches: list[Position] = []
+    for low, high in [(0, len(lines))] if ranges is None else ranges:
+        for row, line in enumerate(read_lines(lines, low, high), low):
+            if row % SCAN_CHUNK == 0 and stop():
+                return None
+            matches.extend((row, match.start()) for match in regex.finditer(line))
+    return matches
+
+
+class Search:
+    """Last search pattern, its match index and the cursor jump in progress"""
+
+    def __init__(self) -> None:
+        self.pattern = ""
+        self.forward = True
+        self._literals: list[str] = []
+        # Bumped whenever the highlighted matches change
+        self.version = 0
+        self._regex: re.Pattern | None = None
+        self._highlight = False
+        # Match index and the buffer change it was built at
+        self._matches: list[Position] | None = None
+        self._changes = -1
+        self._generation = 0
+        self._worker: Thread | None = None
+        self._job: Generator[None, None, Position | None] | None = None
+        self._report = False
+        self._owed: Position | None = None
+
+    def set(self, pattern: str, forward: bool = True):
+        """Search for pattern from now on, raises re.error if it is invalid"""
+        regex = compile_pattern(pattern) if pattern else None
+        self.forward = forward
+        if pattern != self.pattern:
+            self.pattern = pattern
+            self._regex = regex
+            self._literals = required_literals(pattern)
+            self._drop_index()
+        if self._highlight != (regex is not None):
+            self._highlight = regex is not None
+            self.version += 1
+
+    def hide(self):
+        """Stop highlighting matches until the next search"""
+        if self._highlight:
+            self._highlight = False
+            self.version += 1
+
+    def forget(self):
+        """Drop the match index, another buffer is searched from now on"""
+        self._drop_index()
+
+    def _drop_index(self):
+        self._generation += 1
+        self._matches = None
+        self._changes = -1
+        self._worker = None
+        self._job = None
+        self._owed = None
+        self.version += 1
+
+    @property
+    def busy(self):
+        """Whether a cursor jump is still scanning"""
+        return self._job is not None
+
+    @property
+    def counting(self):
+        """Whether the match count is owed to the status line"""
+        return self._owed is not None
+
+    def spans(self, line: str) -> list[Position]:
+        """Highlighted (start, end) columns of matches in line"""
+        if not self._highlight:
+            return []
+        spans = (match.span() for match in self._regex.finditer(line))  # type: ignore
+        return [(start, end) for start, end in spans if end > start]
+
+    def index(self, buffer: Buffer) -> list[Position] | None:
+        """Match index of the buffer as it is now, None until it is ready"""
+        if self._regex is None:
+            return None
+        if self._changes == buffer.changes and self._matches is not None:
+            return self._matches
+        if self._changes != buffer.changes or self._worker is None:
+            self._start_index(buffer)
+        return self._matches if self._changes == buffer.changes else None
+
+    def _start_index(self, buffer: Buffer):
+        self._generation += 1
+        self._changes = buffer.changes
+        self._matches = None
+        self._worker = None
+        regex = self._regex
+        ranges = buffer.candidates(self._literals)
+        if buffer.size <= INDEX_INLINE and not buffer.loading:
+            self._matches = build_index(buffer.frozen(), regex, ranges=ranges)  # type: ignore
+            return
+        generation = self._generation
+        lines = buffer.frozen()
+
+        def work():
+            try:
+                matches = build_index(
+                    lines, regex, lambda: generation != self._generation, ranges  # type: ignore
+                )
+            except (ValueError, IndexError):  # the file was remapped or closed under us
+                if generation == self._generation:
+                    self._worker = None
+                return
+            if generation == self._generation:
+                self._matches = matches
+
+        self._worker = Thread(target=work, name="renvia-search", daemon=True)
+        self._worker.start()
+
+    def start(self, editor: "EditorState", row: int, col: int, forward: bool, report: bool = True):
+        """Move the cursor to the next match after (row, col), or the one before
+        it if not `forward`. Scans that do not finish at once go on in step().
+        With `report`, the outcome and match count go to the status line."""
+        self._job = self._find(editor.buffer, row, col, forward)
+        self._report = report
+        self._owed = None
+        return self.step(editor)
+
+    def step(self, editor: "EditorState"):
+        """Scan one more chunk for the cursor jump, report a count that got ready"""
+        if self._owed is not None and self.index(editor.buffer) is not None:
+            self._status(editor, self._owed)
+        if self._job is None:
+            return False
+        try:
+            next(self._job)
+            return True
+        except StopIteration as stop:
+            self._job = None
+            found: Position | None = stop.value
+        if found is not None:
+            editor.cursor.move_to(*found)
+        if self._report:
+            if found is None:
+                editor.status.set(f"Pattern not found: {self.pattern}")
+            else:
+                self._status(editor, found)
+        return True
+
+    def _status(self, editor: "EditorState", found: Position):
+        prefix = "/" if self.forward else "?"
+        matches = self.index(editor.buffer)
+        if matches is None:
+            self._owed = found
+            editor.status.set(f"{prefix}{self.pattern}")
+            return
+        self._owed = None
+        where = bisect_left(matches, found)
+        current = where + 1 if where < len(matches) and matches[where] == found else 0
+        editor.status.set(f"{prefix}{self.pattern} [{current}/{len(matches)}]")
+
+    def _find(self, buffer: Buffer, row: int, col: int, forward: bool):
+        """Generator over the scan for a match, yields between chunks and
+        returns where the match is"""
+        matches = self.index(buffer)
+        if self._regex is None or not buffer.size:
+            return None
+        if matches is not None:
+            if not matches:
+                return None
+            if forward:
+                return matches[bisect_right(matches, (row, col)) % len(matches)]
+            return matches[bisect_left(matches, (row, col)) - 1]
+        regex = self._regex
+        search = _first if forward else _last
+        for count, (index, low, high) in enumerate(
+            self._order(buffer, row, col, forward), 1
+        ):
+            if count % SCAN_CHUNK == 0:
+                yield
+            found = search(regex, buffer[index], low, high)
+            if found != -1:
+                return index, found
+        return None
+
+    def _order(self, buffer: Buffer, row: int, col: int, forward: bool):
+        """(row, low, high) in the order rows are scanned, matches must start
+        within [low, high). Ends on the starting row, past the wrap around."""
+        size = buffer.size
+        ranges = buffer.candidates(self._literals)
+        if forward:
+            yield row, col + 1, maxsize
+            for index in _rows(row + 1, size, ranges):
+                yield index, 0, maxsize
+            for index in _rows(0, row, ranges):
+                yield index, 0, maxsize
+            yield row, 0, col + 1
+        else:
+            yield row, 0, col
+            for index in _rows(0, row, ranges, False):
+                yield index, 0, maxsize
+            for index in _rows(row + 1, size, ranges, False):
+                yield index, 0, maxsize
+            yield row, col, maxsize
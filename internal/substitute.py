@@ -0,0 +1,109 @@
+"""Substitute, the work behind :[range]s/pattern/replacement/[flags]
+
+The pattern is compiled once and only lines it changes are handed back,
+so the buffer sees a single batched rewrite. Long ranges are split into
+chunks run by a pool of worker processes, threads would only take turns
+on the GIL while matching."""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from internal.search import compile_pattern
+
+# Ranges with at least this many lines are split across worker processes
+PARALLEL_LINES = 200000
+# Lines sent to a worker at a time
+PARALLEL_CHUNK = 50000
+FLAGS = "gi"
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def split_substitute(text: str) -> tuple[str, str, str]:
+    """(pattern, replacement, flags) of "/pattern/replacement/flags", the
+    first character is the delimiter and can be escaped with a backslash"""
+    if not text or text[0].isalnum() or text[0] in " \\\"":
+        raise ValueError("Expected a delimiter such as s/pattern/replacement/")
+    delimiter = text[0]
+    parts = [""]
+    index = 1
+    while index < len(text):
+        char = text[index]
+        if char == "\\" and text[index + 1:index + 2] == delimiter:
+            parts[-1] += delimiter
+            index += 2
+            continue
+        if char == delimiter and len(parts) < 3:
+            parts.append("")
+        else:
+            parts[-1] += char
+        index += 1
+    parts += [""] * (3 - len(parts))
+    pattern, replacement, flags = parts
+    unknown = set(flags) - set(FLAGS)
+    if unknown:
+        raise ValueError(f"Unknown flags: {''.join(sorted(unknown))}")
+    return pattern, replacement, flags
+
+
+def compile_substitute(pattern: str, flags: str) -> re.Pattern:
+    """Compiled pattern with the case flag applied"""
+    return compile_pattern(f"(?i){pattern}" if "i" in flags else pattern)
+
+
+def substitute_lines(
+    regex: re.Pattern, replacement: str, count: int, start: int, lines: list[str]
+) -> tuple[list[int], list[str], int]:
+    """(rows, new lines, substitutions) for lines that change, rows counted from `start`"""
+    rows: list[int] = []
+    out: list[str] = []
+    total = 0
+    for row, line in enumerate(lines, start):
+        new, made = regex.subn(replacement, line, count)
+        total += made
+        if new != line:
+            rows.append(row)
+            out.append(new)
+    return rows, out, total
+
+
+def _executor():
+    global _pool  # pylint: disable=global-statement
+    if _pool is None:
+        # The editor runs threads of its own, so never fork it as it is
+        _pool = ProcessPoolExecutor(os.cpu_count(), mp_context=get_context("forkserver"))
+    return _pool
+
+
+def shutdown():
+    """Stop the worker processes, if any were started"""
+    global _pool  # pylint: disable=global-statement
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def substitute(
+    regex: re.Pattern, replacement: str, count: int, start: int, lines: list[str]
+) -> tuple[list[int], list[str], int]:
+    """substitute_lines(), split across worker processes for long ranges"""
+    if len(lines) < PARALLEL_LINES:
+        return substitute_lines(regex, replacement, count, start, lines)
+    futures = [
+        _executor().submit(
+            substitute_lines, regex, replacement, count, start + offset,
+            lines[offset:offset + PARALLEL_CHUNK],
+        )
+        for offset in range(0, len(lines), PARALLEL_CHUNK)
+    ]
+    rows: list[int] = []
+    out: list[str] = []
+    total = 0
+    for future in futures:
+        part_rows, part_out, made = future.result()
+        rows.extend(part_rows)
+        out.extend(part_out)
+        total += made
+    return rows, out, total
@@ -0,0 +1,261 @@
+"""Syntax highlighting
+
+A lexer turns one line and the state left by the line before it into
+coloured spans and the state at its end. The highlighter keeps the start
+state of every line lexed so far. After an edit it re-lexes from the
+changed line only until a line ends in the state it ended in before,
+the lines past it are coloured as they were. Lexing never goes past the
+visible window and stops at a deadline, so a frame stays in budget
+however long the file is."""
+
+import os
+import re
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from time import monotonic
+from typing import TYPE_CHECKING, Hashable
+
+from internal import Basic
+
+if TYPE_CHECKING:
+    from internal.buffer import Buffer
+
+# Lines lexed between looks at the deadline
+DEADLINE_CHECK = 64
+# Start state of a line inserted since the last lexing, equal to no state
+UNKNOWN = object()
+
+Token = tuple[int, int, str]
+# Colour of every token kind a lexer may produce
+THEME = {
+    "keyword": Basic.SYNTAX_KEYWORD,
+    "string": Basic.SYNTAX_STRING,
+    "comment": Basic.SYNTAX_COMMENT,
+    "number": Basic.SYNTAX_NUMBER,
+}
+
+_lexers: dict[str, type["Lexer"]] = {}
+
+
+def register(*extensions: str):
+    """Class decorator, use the lexer for files with these extensions"""
+
+    def wrapper(cls: type["Lexer"]):
+        for extension in extensions:
+            _lexers[extension] = cls
+        return cls
+
+    return wrapper
+
+
+def lexer_for(filename: str) -> "Lexer | None":
+    """Lexer of filename's language, None when there is none"""
+    cls = _lexers.get(os.path.splitext(filename)[1].lower())
+    return cls() if cls else None
+
+
+class Lexer(ABC):
+    """Tokenizer of one language, states must compare equal when lexing
+    from them gives the same result"""
+
+    initial: Hashable = None
+
+    @abstractmethod
+    def tokenize(self, line: str, state: Hashable) -> tuple[list[Token], Hashable]:
+        """(start, end, kind) tokens of line lexed from state, and the state at its end"""
+
+
+class RegexLexer(Lexer):
+    """Lexer from `rules`, mapping a state to (pattern, kind, next state)
+    triples tried in order. Text no rule matches is plain, a kind of None
+    leaves the match plain and a next state of None stays put."""
+
+    rules: dict[str, list[tuple[str, str | None, str | None]]] = {}
+    initial = "root"
+
+    def __init__(self) -> None:
+        self._compiled = {
+            state: (
+                re.compile("|".join(f"(?P<r{index}>{rule[0]})" for index, rule in enumerate(rules))),
+                {f"r{index}": rule[1:] for index, rule in enumerate(rules)},
+            )
+            for state, rules in self.rules.items()
+        }
+
+    def tokenize(self, line: str, state: Hashable) -> tuple[list[Token], Hashable]:
+        tokens: list[Token] = []
+        pos = 0
+        while pos < len(line):
+            regex, actions = self._compiled[state]  # type: ignore
+            match = regex.search(line, pos)
+            if match is None:
+                break
+            kind, following = actions[match.lastgroup]  # type: ignore
+            start, end = match.span()
+            if kind is not None and end > start:
+                tokens.append((start, end, kind))
+            if following is not None:
+                state = following
+            elif end == start:  # an empty match would never move on
+                end += 1
+            pos = end
+        return tokens, state
+
+
+@register(".py", ".pyw", ".pyi")
+class PythonLexer(RegexLexer):
+    """Python, triple-quoted strings carry over to the following lines"""
+
+    _prefix = r"(?:\b[rRbBuUfF]{1,2})?"
+    rules = {
+        "root": [
+            (r"#.*", "comment", None),
+            (_prefix + r'"""(?:\\.|[^\\])*?"""', "string", None),
+            (_prefix + r"'''(?:\\.|[^\\])*?'''", "string", None),
+            (_prefix + r'"""', "string", "double"),
+            (_prefix + r"'''", "string", "single"),
+            (_prefix + r'"(?:\\.|[^"\\])*"?', "string", None),
+            (_prefix + r"'(?:\\.|[^'\\])*'?", "string", None),
+            (
+                r"\b(?:False|None|True|and|as|assert|async|await|break|class|continue|def|del"
+                r"|elif|else|except|finally|for|from|global|if|import|in|is|lambda|nonlocal"
+                r"|not|or|pass|raise|return|try|while|with|yield)\b",
+                "keyword",
+                None,
+            ),
+            (r"\b\d[\w.]*", "number", None),
+        ],
+        "double": [
+            (r'(?:\\.|[^\\])*?"""', "string", "root"),
+            (r".+", "string", None),
+        ],
+        "single": [
+            (r"(?:\\.|[^\\])*?'''", "string", "root"),
+            (r".+", "string", None),
+        ],
+    }
+
+
+@register(".c", ".h", ".cc", ".cpp", ".hpp", ".java", ".js", ".ts", ".go", ".rs")
+class CLexer(RegexLexer):
+    """C and languages that share its comments, strings and numbers"""
+
+    rules = {
+        "root": [
+            (r"//.*", "comment", None),
+            (r"/\*.*?\*/", "comment", None),
+            (r"/\*", "comment", "comment"),
+            (r'"(?:\\.|[^"\\])*"?', "string", None),
+            (r"'(?:\\.|[^'\\])*'?", "string", None),
+            (
+                r"\b(?:break|case|catch|class|const|continue|default|do|else|enum|extern"
+                r"|false|fn|for|func|function|if|import|let|match|mut|new|null|package"
+                r"|private|pub|public|return|static|struct|switch|this|throw|true|try"
+                r"|typedef|union|use|var|void|while)\b",
+                "keyword",
+                None,
+            ),
+            (r"\b\d[\w.]*", "number", None),
+        ],
+        "comment": [
+            (r".*?\*/", "comment", "root"),
+            (r".+", "comment", None),
+        ],
+    }
+
+
+class Highlighter:
+    """Start states of a buffer's lines, see the module docstring"""
+
+    def __init__(self, lexer: Lexer) -> None:
+        self.lexer = lexer
+        self._states: list[Hashable] = []
+        self._dirty: list[int] = []
+        self.reset()
+
+    def reset(self):
+        """Forget every state, the whole buffer changed"""
+        # Start state of every line lexed so far. The state after a line is
+        # the one it ended in when last lexed, unless the line is dirty.
+        self._states = [self.lexer.initial]
+        # Lines that changed since they were lexed, ascending
+        self._dirty = []
+
+    def known(self, row: int):
+        """Whether the start state of row is up to date"""
+        return row < len(self._states) and (not self._dirty or row <= self._dirty[0])
+
+    def change(self, row: int):
+        """Line row was rewritten"""
+        if row < len(self._states) - 1:
+            index = bisect_left(self._dirty, row)
+            if index == len(self._dirty) or self._dirty[index] != row:
+                self._dirty.insert(index, row)
+
+    def insert(self, row: int, count: int):
+        """count lines were inserted before row"""
+        if row >= len(self._states):
+            return
+        # The new lines start in no known state, so lexing runs through them
+        self._states[row + 1:row + 1] = [UNKNOWN] * count
+        self._shift(row, count)
+        insort(self._dirty, row)
+
+    def delete(self, row: int, count: int):
+        """Lines [row, row + count) were deleted"""
+        if row >= len(self._states):
+            return
+        del self._states[row + 1:row + count + 1]
+        index = bisect_left(self._dirty, row)
+        end = bisect_left(self._dirty, row + count)
+        del self._dirty[index:end]
+        self._shift(row, -count)
+        # The line now at row ended from another state
+        if row < len(self._states) - 1:
+            self.change(row)
+
+    def _shift(self, row: int, count: int):
+        dirty = self._dirty
+        for index in range(bisect_left(dirty, row), len(dirty)):
+            dirty[index] += count
+
+    def advance(self, buffer: "Buffer", end: int, deadline: float) -> int:
+        """Lex until the start state of every row before end is known or the
+        deadline passes, return the first row whose start state changed, end
+        if none did"""
+        states, dirty = self._states, self._dirty
+        last = min(end, len(buffer))
+        row = dirty[0] if dirty else len(states) - 1
+        changed = end
+        seen = 0
+        lexed = 0
+        while row < last - 1:
+            if lexed % DEADLINE_CHECK == 0 and lexed and monotonic() > deadline:
+                break
+            lexed += 1
+            _, state = self.lexer.tokenize(buffer[row], states[row])
+            while seen < len(dirty) and dirty[seen] <= row:
+                seen += 1
+            row += 1
+            if row < len(states):
+                if states[row] == state:
+                    # Ended as before, nothing changes until the next dirty line
+                    row = dirty[seen] if seen < len(dirty) else len(states) - 1
+                    continue
+                states[row] = state
+            else:
+                states.append(state)
+            changed = min(changed, row)
+        del dirty[:seen]
+        # Stopped part way through lines whose states changed
+        if row < len(states) - 1 and (not dirty or dirty[0] != row):
+            dirty.insert(0, row)
+        return changed
+
+    def spans(self, buffer: "Buffer", row: int) -> list[tuple[int, int, int]] | None:
+        """Coloured (start, end, attribute) columns of row, None while its
+        start state is not known"""
+        if not self.known(row):
+            return None
+        tokens, _ = self.lexer.tokenize(buffer[row], self._states[row])
+        return [(start, end, THEME[kind].pair()) for start, end, kind in tokens]
@@ -0,0 +1,271 @@
+"""Trigram index, narrows a search down to the lines that may match
+
+Lines are grouped in buckets of consecutive rows, each with a bloom
+filter of the (lowercased) trigrams in it. A pattern's required literals
+give trigrams that every match contains, and only buckets whose filter
+has all of them are searched. Filters only ever gain bits: edits add the
+trigrams of new lines to their bucket and deletions leave the bits, so a
+filter may claim too much but never too little."""
+
+from bisect import bisect_right
+from itertools import islice
+from threading import Thread
+from typing import Iterable, Sequence
+
+from internal.mapped import MappedLines
+from internal.piecetable import PieceTable
+
+# Lines per bucket when the index is built
+BUCKET_LINES = 1024
+# Filter bits per bucket, a power of two
+FILTER_BITS = 1 << 16
+FILTER_MASK = FILTER_BITS - 1
+# Characters that make the character before them optional
+OPTIONAL = "?*{"
+OCTAL = "01234567"
+
+Trigram = tuple[str, str, str]
+
+
+def trigrams(text: str) -> set[Trigram]:
+    """Trigrams of text, lowercased"""
+    text = text.lower()
+    return set(zip(text, text[1:], text[2:]))
+
+
+def _add(bloom: bytearray, grams: set[Trigram]):
+    for gram in grams:
+        code = hash(gram)
+        for bit in (code & FILTER_MASK, (code >> 16) & FILTER_MASK):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+
+
+def _has(bloom: bytearray, grams: list[Trigram]):
+    for gram in grams:
+        code = hash(gram)
+        for bit in (code & FILTER_MASK, (code >> 16) & FILTER_MASK):
+            if not bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+    return True
+
+
+def _skip(pattern: str, index: int) -> int:
+    """Index of the "]" or "}" closing the class or repeat opened at index"""
+    closer = "]" if pattern[index] == "[" else "}"
+    index += 1
+    if closer == "]":
+        index += pattern[index:index + 1] == "^"
+        index += pattern[index:index + 1] == "]"
+    while index < len(pattern) and pattern[index] != closer:
+        index += 2 if pattern[index] == "\\" else 1
+    return index
+
+
+def _escape_end(pattern: str, index: int) -> int:
+    """Index of the last character of the escape whose letter or first
+    digit is at index"""
+    char = pattern[index]
+    if char in "xuU":
+        return index + {"x": 2, "u": 4, "U": 8}[char]
+    if char == "N" and pattern[index + 1:index + 2] == "{":
+        end = pattern.find("}", index)
+        return end if end != -1 else len(pattern)
+    if char == "0":
+        # \0 and up to two more octal digits
+        end = index + 1
+        while end < min(index + 3, len(pattern)) and pattern[end] in OCTAL:
+            end += 1
+        return end - 1
+    if char.isdigit():
+        # Three octal digits are a character, otherwise a group number
+        if len(pattern) >= index + 3 and all(digit in OCTAL for digit in pattern[index:index + 3]):
+            return index + 2
+        return index + 1 if pattern[index + 1:index + 2].isdigit() else index
+    return index
+
+
+def required_literals(pattern: str) -> list[str]:
+    """Literal runs every match of pattern contains, lowercased.
+
+    Conservative: groups, classes and escapes end a run, and a pattern
+    with an alternation or verbose flag at the top level requires nothing."""
+    if pattern.startswith("(?") and "x" in pattern[2:pattern.find(")")]:
+        return []
+    runs: list[str] = []
+    run: list[str] = []
+    depth = 0
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\":
+            index += 1
+            char = pattern[index:index + 1]
+            if char.isalnum():
+                # A class such as \d, a code point or a back reference
+                index = _escape_end(pattern, index)
+                char = ""
+        elif char in "[{":
+            index = _skip(pattern, index)
+            char = ""
+        elif char in "()":
+            depth += 1 if char == "(" else -1
+            char = ""
+        elif char == "|" and depth == 0:
+            return []
+        elif char in ".^$+*?|":
+            char = ""
+        following = pattern[index + 1:index + 2]
+        if depth or not char or (following and following in OPTIONAL):
+            if len(run) >= 3:
+                runs.append("".join(run))
+            run = []
+        else:
+            run.append(char)
+        index += 1
+    if len(run) >= 3:
+        runs.append("".join(run))
+    return [run.lower() for run in runs]
+
+
+def read_lines(lines: Sequence[str], start: int, end: int) -> Iterable[str]:
+    """Lines [start, end) of a buffer's frozen() lines, in one pass"""
+    if isinstance(lines, PieceTable):
+        return islice(lines.iter_from(start), end - start)
+    return lines[start:end]
+
+
+class TrigramIndex:
+    """Bucketed trigram filters of a buffer, see the module docstring"""
+
+    def __init__(self) -> None:
+        self._filters: list[bytearray] = []
+        self._counts: list[int] = []
+        # First row of every bucket, rebuilt after lines are inserted or deleted
+        self._starts: list[int] | None = None
+        # Edits made while the worker builds, applied once it is done
+        self._log: list[tuple[str, int, object]] = []
+        self._worker: Thread | None = None
+        self._built: tuple[list[bytearray], list[int]] | None = None
+        self._ready = False
+
+    def build(self, lines: Sequence[str]):
+        """Index lines in a worker thread, they must not change meanwhile"""
+        self._filters, self._counts, self._starts = [], [], None
+        self._log.clear()
+        self._built = None
+        self._ready = False
+
+        def work():
+            try:
+                if isinstance(lines, MappedLines):
+                    lines.wait()
+                filters: list[bytearray] = []
+                counts: list[int] = []
+                for start in range(0, len(lines), BUCKET_LINES):
+                    bucket = list(read_lines(lines, start, start + BUCKET_LINES))
+                    bloom = bytearray(FILTER_BITS // 8)
+                    _add(bloom, trigrams("\n".join(bucket)))
+                    filters.append(bloom)
+                    counts.append(len(bucket))
+            except (ValueError, IndexError):  # the file was remapped under us
+                if self._worker is worker:
+                    self._worker = None
+                return
+            if self._worker is worker:
+                self._built = filters, counts
+
+        worker = self._worker = Thread(target=work, name="renvia-trigram", daemon=True)
+        worker.start()
+
+    def stop(self):
+        """Drop the index"""
+        self._worker = None
+        self._built = None
+        self._ready = False
+
+    @property
+    def active(self):
+        """Whether the index is built or being built"""
+        return self._ready or self._worker is not None
+
+    @property
+    def ready(self):
+        """Whether the index can narrow searches, finishing a build that is done"""
+        if not self._ready and self._built is not None:
+            self._filters, self._counts = self._built
+            self._built = None
+            self._ready = True
+            self._worker = None
+            log, self._log = self._log, []
+            for kind, row, value in log:
+                getattr(self, kind)(row, value)
+        return self._ready
+
+    def _bucket(self, row: int):
+        """Bucket holding row, the last one for rows past the end"""
+        if self._starts is None:
+            self._starts = []
+            total = 0
+            for count in self._counts:
+                self._starts.append(total)
+                total += count
+        return max(bisect_right(self._starts, row) - 1, 0)
+
+    def _pending(self, kind: str, row: int, value: object):
+        if self._ready:
+            return False
+        if self._worker is not None:
+            self._log.append((kind, row, value))
+        return True
+
+    def replace(self, row: int, line: str):
+        """Line row was rewritten"""
+        if self._pending("replace", row, line) or not self._filters:
+            return
+        _add(self._filters[self._bucket(row)], trigrams(line))
+
+    def insert(self, row: int, lines: list[str]):
+        """Lines were inserted before row"""
+        if self._pending("insert", row, lines):
+            return
+        if not self._filters:
+            self._filters.append(bytearray(FILTER_BITS // 8))
+            self._counts.append(0)
+        bucket = self._bucket(row)
+        self._counts[bucket] += len(lines)
+        self._starts = None
+        _add(self._filters[bucket], trigrams("\n".join(lines)))
+
+    def delete(self, row: int, count: int):
+        """Lines [row, row + count) were deleted"""
+        if self._pending("delete", row, count) or not self._filters:
+            return
+        bucket = self._bucket(row)
+        offset = row - self._starts[bucket]  # type: ignore
+        while count and bucket < len(self._counts):
+            taken = min(count, self._counts[bucket] - offset)
+            self._counts[bucket] -= taken
+            count -= taken
+            offset = 0
+            if self._counts[bucket] == 0 and len(self._counts) > 1:
+                del self._counts[bucket]
+                del self._filters[bucket]
+            else:
+                bucket += 1
+        self._starts = None
+
+    def candidates(self, literals: list[str]) -> list[tuple[int, int]] | None:
+        """Row ranges [start, end) that may contain all literals, None when
+        the index cannot tell and every line has to be searched"""
+        grams = sorted({gram for literal in literals for gram in trigrams(literal)})
+        if not grams or not self.ready:
+            return None
+        self._bucket(0)
+        ranges: list[tuple[int, int]] = []
+        for start, count, bloom in zip(self._starts, self._counts, self._filters):  # type: ignore
+            if count and _has(bloom, grams):
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], start + count)
+                else:
+                    ranges.append((start, start + count))
+        return ranges
@@ -0,0 +1,243 @@
+"""Persistent undo history, kept in a sidecar file next to the edited file
+
+Layout: a fixed header, the encoded action of every node, then a table
+with one fixed-size record per node in pre-order. Opening a file only
+reads the header, the table is read on the first undo past the loaded
+history and each action when it is undone or redone."""
+
+import os
+from hashlib import blake2b
+from struct import Struct
+from tempfile import mkstemp
+
+from lymia import ReturnInfo, ReturnType
+from internal.actions import Action
+from internal.actions.delete import DeleteAction, DeleteLinesAction, RemoveAction
+from internal.actions.edit import EditAction
+from internal.actions.replace import ReplaceLinesAction
+from internal.editor import EditorState
+from internal.history import HistoryNode, HistoryTree
+
+MAGIC = b"RVU\x01"
+# magic, file size, file mtime, file digest, nodes, current seq, last seq, table offset
+HEADER = Struct("<4sQq32sIIIQ")
+# seq, parent seq, time, action offset, action length
+NODE = Struct("<IIdQI")
+NO_PARENT = 0xFFFFFFFF
+INT = Struct("<q")
+SIZE = Struct("<I")
+DIGEST_CHUNK = 1024 * 1024
+# Action types by their code in the file, only ever append to this
+ACTIONS: tuple[type[Action], ...] = (
+    EditAction, RemoveAction, DeleteAction, DeleteLinesAction, ReplaceLinesAction
+)
+
+
+def sidecar_path(filename: str):
+    """Undo file of filename"""
+    head, tail = os.path.split(os.path.abspath(filename))
+    return os.path.join(head, f".{tail}.renvia-undo")
+
+
+def digest(filename: str):
+    """Content hash of a file"""
+    hasher = blake2b(digest_size=32)
+    with open(filename, "rb") as file:
+        while chunk := file.read(DIGEST_CHUNK):
+            hasher.update(chunk)
+    return hasher.digest()
+
+
+def _encode_text(out: bytearray, text: str):
+    data = text.encode("utf-8", "surrogatepass")
+    out += SIZE.pack(len(data))
+    out += data
+
+
+def encode_action(action: Action) -> bytes:
+    """Serialise an action from its slots"""
+    out = bytearray((ACTIONS.index(type(action)),))
+    for name in type(action).__slots__:
+        value = getattr(action, name)
+        if isinstance(value, int):
+            out += b"i" + INT.pack(value)
+        elif isinstance(value, str):
+            out += b"s"
+            _encode_text(out, value)
+        elif value and isinstance(value[0], int):
+            out += b"n" + SIZE.pack(len(value))
+            out += b"".join(map(INT.pack, value))
+        else:
+            out += b"l" + SIZE.pack(len(value))
+            for line in value:
+                _encode_text(out, line)
+    return bytes(out)
+
+
+def _decode_text(data: bytes, pos: int):
+    (size,) = SIZE.unpack_from(data, pos)
+    pos += SIZE.size
+    return data[pos:pos + size].decode("utf-8", "surrogatepass"), pos + size
+
+
+def decode_action(data: bytes) -> Action:
+    """Inverse of encode_action"""
+    cls = ACTIONS[data[0]]
+    action = cls.__new__(cls)
+    pos = 1
+    for name in cls.__slots__:
+        tag = data[pos:pos + 1]
+        pos += 1
+        if tag == b"i":
+            (value,) = INT.unpack_from(data, pos)
+            pos += INT.size
+        elif tag == b"s":
+            value, pos = _decode_text(data, pos)
+        elif tag == b"n":
+            (count,) = SIZE.unpack_from(data, pos)
+            pos += SIZE.size
+            value = [number for (number,) in INT.iter_unpack(data[pos:pos + count * INT.size])]
+            pos += count * INT.size
+        else:
+            (count,) = SIZE.unpack_from(data, pos)
+            pos += SIZE.size
+            value = []
+            for _ in range(count):
+                line, pos = _decode_text(data, pos)
+                value.append(line)
+        setattr(action, name, value)
+    return action
+
+
+class LazyAction(Action):
+    """An action still in the undo file, decoded when first undone or redone"""
+
+    __slots__ = ("_path", "_offset", "_length", "_action")
+
+    def __init__(self, path: str, offset: int, length: int) -> None:
+        self._path = path
+        self._offset = offset
+        self._length = length
+        self._action: Action | None = None
+
+    def raw(self) -> bytes:
+        """Encoded action"""
+        if self._action is not None:
+            return encode_action(self._action)
+        with open(self._path, "rb") as file:
+            file.seek(self._offset)
+            return file.read(self._length)
+
+    def relocate(self, offset: int):
+        """The action was rewritten at offset of the undo file"""
+        self._offset = offset
+
+    def _load(self) -> Action:
+        if self._action is None:
+            self._action = decode_action(self.raw())
+        return self._action
+
+    def execute(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        return self._load().execute(editor)
+
+    def undo(self, editor: EditorState) -> ReturnType | ReturnInfo:
+        return self._load().undo(editor)
+
+
+def dump_action(action: Action) -> bytes:
+    """Encoded action, without decoding it first if it is still in an undo file"""
+    if isinstance(action, LazyAction):
+        return action.raw()
+    return encode_action(action)
+
+
+def _read_nodes(path: str, offset: int, count: int):
+    """Build the persisted tree, return (root, nodes by seq)"""
+    with open(path, "rb") as file:
+        file.seek(offset)
+        data = file.read(count * NODE.size)
+    nodes: dict[int, HistoryNode] = {}
+    root: HistoryNode | None = None
+    for seq, parent, when, action_offset, length in NODE.iter_unpack(data):
+        action = LazyAction(path, action_offset, length) if length else None
+        node = HistoryNode(action, None, seq)
+        node.time = when
+        if parent == NO_PARENT:
+            root = node
+        else:
+            node.parent = nodes[parent]
+            node.parent.children.append(node)
+        nodes[seq] = node
+    return root, nodes
+
+
+def attach_history(history: HistoryTree, filename: str) -> bool:
+    """Read the header of filename's undo file, the rest is loaded on demand"""
+    path = sidecar_path(filename)
+    try:
+        with open(path, "rb") as file:
+            header = file.read(HEADER.size)
+        info = os.stat(filename)
+    except OSError:
+        return False
+    if len(header) != HEADER.size:
+        return False
+    magic, size, mtime, hashed, count, current, last, table = HEADER.unpack(header)
+    if magic != MAGIC or size != info.st_size:
+        return False
+    # Same size but touched since, only trust it if the contents still match
+    if mtime != info.st_mtime_ns and digest(filename) != hashed:
+        return False
+    history.defer(current, last, lambda: _read_nodes(path, table, count))
+    return True
+
+
+def save_history(history: HistoryTree, filename: str):
+    """Write the whole history to filename's undo file, keyed by its contents"""
+    history.load()
+    path = sidecar_path(filename)
+    info = os.stat(filename)
+    order: list[HistoryNode] = []
+    stack = [history.root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(reversed(node.children))
+    moved: list[tuple[LazyAction, int]] = []
+    fd, tmp = mkstemp(prefix=".renvia-", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(bytes(HEADER.size))
+            table = bytearray()
+            for node in order:
+                offset = length = 0
+                if node.action is not None:
+                    data = dump_action(node.action)
+                    offset = file.tell()
+                    length = len(data)
+                    file.write(data)
+                    if isinstance(node.action, LazyAction):
+                        moved.append((node.action, offset))
+                parent = node.parent.seq if node.parent else NO_PARENT
+                table += NODE.pack(node.seq, parent, node.time, offset, length)
+            table_offset = file.tell()
+            file.write(table)
+            file.seek(0)
+            file.write(
+                HEADER.pack(
+                    MAGIC,
+                    info.st_size,
+                    info.st_mtime_ns,
+                    digest(filename),
+                    len(order),
+                    history.current.seq,
+                    history.last_seq,
+                    table_offset,
+                )
+            )
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    for action, offset in moved:
+        action.relocate(offset)
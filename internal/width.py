@@ -0,0 +1,91 @@
+"""Terminal display width of text"""
+
+from bisect import bisect_right
+from unicodedata import category, combining, east_asian_width
+
+TABSTOP = 4
+
+
+def char_width(char: str) -> int:
+    """Cells taken by a single (non-tab) character"""
+    if combining(char) or category(char) in ("Mn", "Me", "Cf"):
+        return 0
+    if east_asian_width(char) in ("W", "F"):
+        return 2
+    return 1
+
+
+def is_simple(line: str):
+    """Whether every character of line takes exactly one cell"""
+    return line.isascii() and "\t" not in line
+
+
+def prefix_widths(line: str, tabstop: int = TABSTOP) -> list[int]:
+    """Cumulative widths, the nth item is the cell where character n starts"""
+    out = [0]
+    cell = 0
+    for char in line:
+        if char == "\t":
+            cell += tabstop - cell % tabstop
+        else:
+            cell += char_width(char)
+        out.append(cell)
+    return out
+
+
+def col_at(widths: list[int], cell: int) -> int:
+    """Character column covering `cell`"""
+    return max(bisect_right(widths, cell) - 1, 0)
+
+
+def render_cells(line: str, widths: list[int], maxsize: int, shift: int = 0) -> str:
+    """Render cells [shift, shift + maxsize) of line, padded with spaces.
+
+    Tabs are expanded and wide characters cut by either edge become spaces."""
+    end = shift + maxsize
+    if shift >= widths[-1]:
+        return " " * maxsize
+    index = col_at(widths, shift)
+    out: list[str] = []
+    cell = shift
+    if widths[index] < shift:  # wide character or tab straddles the left edge
+        cell = widths[index + 1]
+        out.append(" " * (cell - shift))
+        index += 1
+    for char in line[index:]:
+        width = widths[index + 1] - widths[index]
+        index += 1
+        if cell + width > end:
+            break
+        out.append(" " * width if char == "\t" else char)
+        cell += width
+    out.append(" " * (end - cell))
+    return "".join(out)
+
+
+def cell_index(text: str, cell: int) -> int:
+    """String index of `cell` in text rendered by render_cells"""
+    if text.isascii():
+        return min(cell, len(text))
+    pos = 0
+    for index, char in enumerate(text):
+        if pos >= cell:
+            return index
+        pos += char_width(char)
+    return len(text)
+
+
+def wrap_starts(widths: list[int], width: int) -> list[int]:
+    """Cells where each soft-wrapped row of a line starts.
+
+    Rows break before a character that would not fit, and a full last row
+    gets an empty row after it to hold a cursor past the end."""
+    starts = [0]
+    start = 0
+    for index in range(len(widths) - 1):
+        if widths[index + 1] - start > width and widths[index] > start:
+            start = widths[index]
+            starts.append(start)
+    if widths[-1] - start >= width:
+        starts.append(widths[-1])
+    return starts
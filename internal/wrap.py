@@ -0,0 +1,174 @@
+"""Soft-wrap index, maps buffer lines to visual rows"""
+
+from random import random
+
+
+class Run:
+    """A run of consecutive lines taking `rows` visual rows in total.
+
+    Runs are kept in a treap ordered by position, every node carries the
+    line and row totals of its subtree so lookups either way are O(log n)."""
+
+    __slots__ = ("count", "rows", "prio", "lines_total", "rows_total", "left", "right")
+
+    def __init__(self, count: int, rows: int, prio: float | None = None) -> None:
+        self.count = count
+        self.rows = rows
+        self.prio = random() if prio is None else prio
+        self.lines_total = count
+        self.rows_total = rows
+        self.left: "Run | None" = None
+        self.right: "Run | None" = None
+
+
+def _update(node: Run):
+    node.lines_total = node.count
+    node.rows_total = node.rows
+    if node.left:
+        node.lines_total += node.left.lines_total
+        node.rows_total += node.left.rows_total
+    if node.right:
+        node.lines_total += node.right.lines_total
+        node.rows_total += node.right.rows_total
+
+
+def _merge(left: Run | None, right: Run | None) -> Run | None:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.prio > right.prio:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _split(node: Run | None, lines: int) -> tuple[Run | None, Run | None]:
+    """Split tree into (first `lines` lines, the rest)"""
+    if node is None:
+        return None, None
+    ltotal = node.left.lines_total if node.left else 0
+    if lines <= ltotal:
+        left, node.left = _split(node.left, lines)
+        _update(node)
+        return left, node
+    if lines >= ltotal + node.count:
+        node.right, right = _split(node.right, lines - ltotal - node.count)
+        _update(node)
+        return node, right
+    # Only unmeasured runs (one row per line) span several lines, so they
+    # can be cut anywhere.
+    offset = lines - ltotal
+    tail = Run(node.count - offset, node.count - offset, node.prio)
+    tail.right = node.right
+    _update(tail)
+    node.count = node.rows = offset
+    node.right = None
+    _update(node)
+    return node, tail
+
+
+class WrapIndex:
+    """Visual rows per line for soft-wrapping
+
+    Lines start unmeasured and count as a single row; the renderer measures
+    lines as it reaches them, so opening a huge file costs nothing and only
+    edited or viewed lines ever get their own node."""
+
+    def __init__(self, lines: int = 0, width: int = 0) -> None:
+        self.width = width
+        self._root: Run | None = Run(lines, lines) if lines else None
+
+    @property
+    def lines(self):
+        """Lines tracked"""
+        return self._root.lines_total if self._root else 0
+
+    @property
+    def total(self):
+        """Visual rows of all lines"""
+        return self._root.rows_total if self._root else 0
+
+    def insert(self, pos: int, count: int):
+        """Insert `count` unmeasured lines before `pos`"""
+        if count <= 0:
+            return
+        left, right = _split(self._root, pos)
+        self._root = _merge(_merge(left, Run(count, count)), right)
+
+    def delete(self, pos: int, count: int):
+        """Delete `count` lines starting at `pos`"""
+        if count <= 0:
+            return
+        left, rest = _split(self._root, pos)
+        _, right = _split(rest, count)
+        self._root = _merge(left, right)
+
+    def rows_of(self, line: int) -> int:
+        """Visual rows taken by `line`"""
+        node = self._root
+        while node:
+            ltotal = node.left.lines_total if node.left else 0
+            if line < ltotal:
+                node = node.left
+                continue
+            line -= ltotal
+            if line < node.count:
+                return node.rows // node.count
+            line -= node.count
+            node = node.right
+        return 1
+
+    def set_rows(self, line: int, rows: int):
+        """Record the measured visual rows of `line`"""
+        if line >= self.lines or self.rows_of(line) == rows:
+            return
+        left, rest = _split(self._root, line)
+        node, right = _split(rest, 1)
+        if node is None:
+            return
+        node.rows = rows
+        _update(node)
+        self._root = _merge(_merge(left, node), right)
+
+    def row_of(self, line: int) -> int:
+        """Visual row where `line` starts"""
+        node = self._root
+        rows = 0
+        while node and line > 0:
+            lleft = node.left.lines_total if node.left else 0
+            rleft = node.left.rows_total if node.left else 0
+            if line <= lleft:
+                node = node.left
+                continue
+            rows += rleft
+            line -= lleft
+            if line <= node.count:
+                return rows + (node.rows // node.count) * line
+            rows += node.rows
+            line -= node.count
+            node = node.right
+        return rows
+
+    def find(self, row: int) -> tuple[int, int]:
+        """(line, row within that line) shown at visual `row`"""
+        node = self._root
+        line = 0
+        while node:
+            lleft = node.left.lines_total if node.left else 0
+            rleft = node.left.rows_total if node.left else 0
+            if row < rleft:
+                node = node.left
+                continue
+            row -= rleft
+            line += lleft
+            if row < node.rows:
+                per = node.rows // node.count
+                return line + row // per, row % per
+            row -= node.rows
+            line += node.count
+            node = node.right
+        return max(self.lines - 1, 0), 0
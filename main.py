@@ -1,31 +1,51 @@
 #!/usr/bin/env python3
 """RenVIA"""
-from os import stat
 from sys import argv
 from curses import window
 import curses
-import sys
 from internal.history import HistoryTree
 from internal.buffer import Buffer
 from internal.cursor import Cursor
-from internal.modes import Modes
+from internal.modes import Modes, registry
 from internal.utils import set_cursor
-from internal import STATE, Basic, use_mice
+from internal.width import cell_index, render_cells
+from internal import STATE, Basic, use_mice, use_bracketed_paste, disable_bracketed_paste
 from internal.command import command
+from internal.undofile import attach_history
+from internal.journal import Journal, has_journal
+from internal.search import Search
+from internal.buffers import BufferList, OpenFile
+from internal.syntax import lexer_for
+from internal import substitute
 
 from internal.editor import DebugState, EditorState, EditorView, Selection
-from internal.modes.normal import NormalMode
+# Imported so every mode is registered
+import internal.modes.normal  # pylint: disable=unused-import
 from internal.modes.helpmode import HelpMode
-from lymia import Panel, ReturnInfo, Scene, run, ReturnType
+from lymia import Panel, ReturnInfo, Scene, run, ReturnType, const
 from lymia.data import SceneResult, _StatusInfo as StatusInfo
 from lymia.environment import Theme
 from lymia.utils import prepare_windowed
 from collections import OrderedDict
+from typing import Sequence
+from bisect import bisect_right
+from time import monotonic
 
 
 theme = Theme(2, Basic())
 
-MAX_SIZE = 1024 * 1024 * 1  # 1 MiB
+# Input poll interval (ms) while a file is still being indexed
+LOADING_POLL = 100
+# Total characters kept by the render cache
+RENDER_CACHE_CHARS = 1024 * 512
+# Bracketed paste markers, and how long (ms) to wait on a stalled paste
+PASTE_START = "[200~"
+PASTE_END = b"\x1b[201~"
+PASTE_POLL = 50
+# Poll interval (ms) while a search match count is being worked out
+SEARCH_POLL = 100
+# Poll interval (ms) between the chunks a search scans for the next match
+SCAN_POLL = 10
 
 HELP_TEXT = """\
 Normal Mode:
@@ -34,16 +54,22 @@ Normal Mode:
 [a] -> Edit mode
 [Up/Left/Right/Down] -> Navigation
 [x] -> Remove current character
+[dd] -> Delete current line
 [0] -> Jump to 0th character in this line
 [$] -> Jump to last character in this line
 [u] -> Undo
 [U] -> Redo
 [w] -> Write to disk
 [h] -> Help
-[g] -> Jump to start line
+[gg] -> Jump to start line
 [G] -> Jump to last line
+[%] -> Jump to the matching bracket
+[/] [?] -> Search forward / backward for a regex
+[n] [N] -> Next / previous match
 [l] -> Toggle mouse capturing (current={mice})
 [;] -> Toggle mouse custom signals (may overlap with some keys) (current={naive})
+A count before a key repeats it, e.g. [3dd] or [10Down]
+[:e file] [:bn] [:bp] [:b N] [:ls] -> Open a file, next / previous / Nth open file, list them
 
 Edit Mode:
 [ESC] -> Return to Normal
@@ -57,12 +83,16 @@ Cursor style : ({cursor_style}@{cursor_visibility})
 Term size    : ({width}x{height})
 Buffer lines : {sizes}
 Mode name    : {name}
+Rows drawn   : {drawn}
+Render cache : {hits} hits, {misses} misses, {cached} chars
 """
 
 
-def render_line(data: str, maxsize: int, shift: int = 0):
-    """Render line"""
+def render_line(data: str, maxsize: int, shift: int = 0, widths: list[int] | None = None):
+    """Render line, `widths` are the line's display widths when not one cell per char"""
     shift = max(shift, 0)
+    if widths is not None:
+        return render_cells(data, widths, maxsize, shift)
     ln = len(data)
     # If shift is beyond the end, return an all-space string quickly.
     if shift >= ln:
@@ -82,26 +112,33 @@ class Root(Scene):
     use_default_color = True
     use_mouse = False
 
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, recover: bool = False, others: Sequence[str] = ()) -> None:
         super().__init__()
-        self._buffer = Buffer(filename)  # type: ignore
-        self._cursor = Cursor(0, 0, 0)
+        # Files open in the session, `others` are read when first shown
+        self._buffers = BufferList()
+        entry = self._shown = self._buffers.open(filename)
+        for other in others:
+            self._buffers.open(other)
+        self._buffers.select(entry)
+        self._buffer, self._cursor, history = self._load(entry)
         self._status = StatusInfo()
         self._status.set("")
         self._debug: DebugState = DebugState(
             StatusInfo(), 0, 0, 0, 0, 0, 0, 0, 0, False, None # type: ignore
         )  # type: ignore
-        self._mode = NormalMode()
+        self._mode = registry.get("normal")
         self._editor = EditorState(
             self._cursor,
             self._buffer,
-            HistoryTree(),
+            history,
             self._status,
             EditorView(0, 0, 0, 0),
             self._debug,
             [self._mode],
             Selection(0, 0, 0, 0),
+            Search(),
         )
+        self._start_journal(entry, recover)
         self._reserved_lines = 2
         self._ctype = 2
         self._escd = curses.get_escdelay()
@@ -109,41 +146,154 @@ class Root(Scene):
         self._moverow = 0
         self._movecol = 0
         self._panels: dict[str, Panel | None] = {}
-        # Render cache: maps (line, maxsize, shift) -> rendered string
+        # Current input timeout (ms) of the screen, -1 blocks
+        self._timeout = -1
+        # Last painted viewport, see draw_editor
+        self._frame: tuple | None = None
+        self._rows_drawn = 0
+        self._last_cursor_row = 0
+        self._last_selection = None
+        self._last_search = -1
+        # Cursor's bracket and its partner as last highlighted
+        self._last_pair: list[tuple[int, int]] = []
+        # Some row was drawn before its syntax state was known
+        self._uncolored = False
+        # Render cache: maps (line id, version, maxsize, shift) -> rendered string
         self._render_cache: "OrderedDict[tuple, str]" = OrderedDict()
-        self._render_cache_limit = 2048
-
-    def _render_cached(self, line: str, maxsize: int, shift: int) -> str:
+        self._render_cache_limit = RENDER_CACHE_CHARS
+        self._render_cache_chars = 0
+        self._render_hits = 0
+        self._render_misses = 0
+
+    def _load(self, entry: OpenFile) -> tuple[Buffer, Cursor, HistoryTree]:
+        """Read entry's file into a buffer of its own"""
+        buffer = Buffer(
+            entry.path, piece_table=STATE["use_piece_table"], trigrams=STATE["trigram_index"]  # type: ignore
+        )
+        buffer.tabstop = STATE["tabstop"]
+        if STATE["syntax_highlight"]:
+            buffer.highlight(lexer_for(entry.path))
+        history = HistoryTree()
+        if STATE["undo_file"]:
+            attach_history(history, entry.path)
+        entry.buffer = buffer
+        entry.cursor = Cursor(entry.row, entry.col, 0)
+        entry.history = history
+        return buffer, entry.cursor, history
+
+    def _start_journal(self, entry: OpenFile, recover: bool | None = None):
+        """Journal the shown file's changes. `recover` replays the journal left
+        by an earlier session, None leaves it alone as nobody was asked."""
+        if not STATE["journal"]:
+            return
+        if recover is None and has_journal(entry.path):
+            self._status.set(
+                f"{entry.path} has unsaved changes from an earlier session, open it alone to recover them"
+            )
+            return
+        journal = Journal(entry.path)
+        try:
+            if recover:
+                replayed = journal.replay(self._editor)
+                self._status.set(f"Recovered {replayed} changes")
+                self._clamp_cursor()
+            journal.start(self._editor.history, keep=bool(recover))
+        except OSError as exc:
+            # Such as a read-only directory, edit the file without a journal
+            self._status.set(f"Not journaling {entry.path}: {exc}")
+            return
+        entry.journal = journal
+        self._editor.history.journal = journal
+
+    def _show(self, entry: OpenFile):
+        """Put entry on screen, reading its file if it is not loaded"""
+        fresh = not entry.loaded
+        if fresh:
+            self._buffer, self._cursor, history = self._load(entry)
+        else:
+            self._buffer, self._cursor, history = entry.buffer, entry.cursor, entry.history  # type: ignore
+        self._buffers.select(entry)
+        self._shown = entry
+        self._editor = self._editor._replace(
+            cursor=self._cursor, buffer=self._buffer, history=history
+        )
+        self._editor.selection.marks = None
+        self._editor.search.forget()
+        command.use_editor(self._editor)
+        # Line ids are per buffer, cached renders of another one must not match
+        self._render_cache.clear()
+        self._render_cache_chars = 0
+        self._last_pair = []
+        self.invalidate()
+        self._status.set(f'"{entry.path}" {self._buffer.size} lines')
+        if fresh:
+            self._start_journal(entry)
+        self._clamp_cursor()
+        self._buffers.evict(STATE["buffer_budget"])  # type: ignore
+
+    def _cancel_load(self):
+        """Stop reading the shown file and go back to the one shown before,
+        the file stays in the buffer list unloaded. Cancelling the only file
+        cancels opening the editor."""
+        previous = self._buffers.previous()
+        self._buffer.cancel_load()
+        if previous is None:
+            return ReturnType.EXIT
+        entry = self._shown
+        self._show(previous)
+        entry.unload()
+        return ReturnType.CONTINUE
+
+    def _follow_buffers(self):
+        """Show the file a command selected in the buffer list"""
+        if self._buffers.current is not self._shown:
+            self._show(self._buffers.current)
+
+    def _render_cached(self, row: int, maxsize: int, shift: int) -> str:
         """Return cached rendered line or compute and cache it.
 
-        Cache key uses the line content, maxsize and shift so changes
-        to a line automatically miss the cache when the string differs.
+        Cache key uses the buffer's line id and version, maxsize and shift,
+        so an edited line misses the cache without hashing its text.
+        Entries are evicted once the cached strings exceed the size limit.
         """
-        key = (line, maxsize, shift)
+        key = (*self._buffer.line_key(row), maxsize, shift)
         cache = self._render_cache
         try:
             val = cache.pop(key)
             # Move to end (most-recently used)
             cache[key] = val
+            self._render_hits += 1
             return val
         except KeyError:
-            rendered = render_line(line, maxsize, shift)
+            self._render_misses += 1
+            widths = self._buffer.cells(row)
+            if widths is None:  # one cell per character, only the visible columns are read
+                start = max(shift, 0)
+                rendered = render_line(self._buffer.line_slice(row, start, start + maxsize), maxsize)
+            else:
+                rendered = render_line(self._buffer[row], maxsize, shift, widths)
             cache[key] = rendered
-            if len(cache) > self._render_cache_limit:
-                cache.popitem(last=False)
+            self._render_cache_chars += len(rendered)
+            while self._render_cache_chars > self._render_cache_limit and len(cache) > 1:
+                _, old = cache.popitem(last=False)
+                self._render_cache_chars -= len(old)
             return rendered
 
     def _draw_help(self, ren: window, _):
         ren.erase()
-        _, width = ren.getmaxyx()
+        height, width = ren.getmaxyx()
         ren.box()
-        for index, line in enumerate(HELP_TEXT.splitlines(), 1):
-            ren.addnstr(
-                index,
-                1,
-                line.format(mice=STATE["use_mice"], naive=STATE["use_naive_mice"]),
-                width - 1,
-            )
+        if isinstance(self._mode, HelpMode) and self._mode.text:
+            lines = self._mode.text.splitlines()
+        else:
+            lines = [
+                line.format(mice=STATE["use_mice"], naive=STATE["use_naive_mice"])
+                for line in HELP_TEXT.splitlines()
+            ]
+        if len(lines) > height - 2:
+            lines[height - 3:] = [f"... {len(lines) - height + 3} more"]
+        for index, line in enumerate(lines, 1):
+            ren.addnstr(index, 1, line, width - 1)
 
     def update_panels(self):
         for panel in self._panels.values():
@@ -166,6 +316,10 @@ class Root(Scene):
             "height": self.height,
             "sizes": self._buffer.size,
             "name": type(self._mode).__name__,
+            "drawn": self._rows_drawn,
+            "hits": self._render_hits,
+            "misses": self._render_misses,
+            "cached": self._render_cache_chars,
         }
         msg = DEBUG_TEMPLATE.format(**tmp)
         for index, line in enumerate(msg.splitlines(), 1):
@@ -190,16 +344,27 @@ class Root(Scene):
         editor = self._editor
         editor.window.term_width = width
         editor.window.term_height = height
+        if STATE["soft_wrap"]:
+            self._draw_wrapped()
+            return
+        if editor.window.wrap:
+            editor.window.wrap = 0
+            self._buffer.disable_wrap()
+            self.invalidate()
         res = self._reserved_lines
         bmaxh = self._buffer.size
         crow = self._cursor.row
+        minh = maxh = shift = 0
+        ccell = self._cursor.col
         if bmaxh != 0:
-            shift = self._cursor.col - width if self._cursor.col > width else 0
             minh, maxh = prepare_windowed(self._cursor.row, height - res)
             if self._cursor.col > self._buffer.sizeof_line(self._cursor.row):
                 self._cursor.col = max(
                     self._buffer.sizeof_line(self._cursor.row) - 1, 0
                 )
+            # Horizontal scrolling works in display cells, not characters
+            ccell = self._buffer.cell_of(self._cursor.row, self._cursor.col)
+            shift = ccell - width if ccell > width else 0
 
             if maxh > bmaxh:
                 minh = max(minh - (maxh - bmaxh), 0)
@@ -207,180 +372,204 @@ class Root(Scene):
             editor.window.start = minh
             editor.window.end = maxh
             crow = self._cursor.row - minh
-            for index, relindex in enumerate(range(minh, maxh)):
-                if index < (height - self._reserved_lines):
-                    try:
-                        buffer_line = self._buffer[relindex]
-                        # Delegate selection-aware line rendering to helper
-                        self._draw_line_with_selection(
-                            ren, index, relindex, buffer_line, editor, shift, width
-                        )
-                    except IndexError:
-                        self._debug.status.set(f"[{relindex} -> {bmaxh}]")
-
-        if (height - res) > bmaxh:
+        editor.window.shift = shift
+
+        # Scrolling or resizing repaints everything, otherwise only rows
+        # touched by buffer, cursor or selection changes are redrawn.
+        frame = (minh, maxh, shift, width, height)
+        damage, damage_from = self._buffer.take_damage()
+        full = frame != self._frame or editor.search.version != self._last_search
+        self._frame = frame
+        self._last_search = editor.search.version
+        rows = self._damaged_rows(damage, damage_from, minh, maxh)
+        recolor = self._highlight(minh, maxh)
+        if full or recolor <= minh:
+            rows = range(minh, maxh)
+        elif recolor < maxh:
+            rows = sorted(set(rows).union(range(recolor, maxh)))
+        # Selected columns of every visible row, computed once per frame
+        spans = editor.selection.spans(self._buffer, minh, maxh)
+        drawn = 0
+        for relindex in rows:
+            index = relindex - minh
+            if index < (height - self._reserved_lines):
+                try:
+                    self._draw_line(
+                        ren, index, relindex, spans.get(relindex), shift, width
+                    )
+                    drawn += 1
+                except IndexError:
+                    self._debug.status.set(f"[{relindex} -> {bmaxh}]")
+        self._rows_drawn = drawn
+
+        if full and (height - res) > bmaxh:
             if bmaxh == 0:
                 bmaxh = 1
             for i in range((bmaxh), (height - res)):
-                ren.addstr(max(i, 1), 0, "~", Basic.UNCOVERED.pair())
+                ren.addnstr(max(i, 1), 0, f"{'~':{width}}", width, Basic.UNCOVERED.pair())
         self._moverow = min(crow, height - res - 1)
-        self._movecol = max(min(self._cursor.col, width - 1), 0)
+        self._movecol = max(min(ccell - shift, width - 1), 0)
 
-    def _draw_line_with_selection(
-        self, ren, index: int, relindex: int, buffer_line: str, editor, shift: int, width: int
-    ):
-        """Draw a single line with selection highlighting when active.
-
-        Parameters mirror the local variables from draw_editor.
-        """
-        # If there's no active selection, render normally
-        if not editor.selection:
-            try:
-                rendered = self._render_cached(buffer_line, width - 1, shift)
-                ren.addnstr(index, 0, rendered, width, 0)
-            except curses.error:
-                pass
-            return
-
-        # Selection is active: compute selection bounds
-        s = editor.selection
-        # Clamp rows/cols similar to Selection.slice
-        buf_len = len(self._buffer)
-        sr = max(0, min(s.start_row, buf_len - 1))
-        er = max(0, min(s.end_row, buf_len - 1))
-        sc = max(0, s.start_col)
-        ec = max(0, s.end_col)
-
-        # Same-line selection
-        if sr == er:
-            # Only highlight when this line is the selected line
-            line_len = self._buffer.sizeof_line(sr)
-            left = min(sc, ec, line_len)
-            right = min(max(sc, ec), line_len)
-            if relindex != sr:
-                try:
-                    ren.addnstr(
-                        index,
-                        0,
-                        render_line(buffer_line, width - 1, shift),
-                        width,
-                        0,
-                    )
-                except curses.error:
-                    pass
-                return
-
-            # Render visible window and then split into prefix/selected/suffix
-            full = self._render_cached(buffer_line, width - 1, shift)
-            vis_left = max(left, shift) - shift
-            vis_right = min(right, shift + (width - 1)) - shift
-            vis_left = max(0, min(vis_left, width - 1))
-            vis_right = max(0, min(vis_right, width - 1))
-            if vis_left >= vis_right:
-                try:
-                    ren.addnstr(index, 0, full, width, 0)
-                except curses.error:
-                    pass
-                return
+    def _draw_wrapped(self):
+        """Draw the editor with long lines soft-wrapped.
 
-            try:
-                if vis_left > 0:
-                    ren.addnstr(
-                        index,
-                        0,
-                        full[:vis_left],
-                        vis_left,
-                        0,
-                    )
-                ren.addnstr(
-                    index,
-                    vis_left,
-                    full[vis_left:vis_right],
-                    vis_right - vis_left,
-                    Basic.FNBUFFER_SELECTION.pair(),
+        Screen rows map to lines through the buffer's wrap index, so placing
+        the viewport costs O(log n) whatever the position in the file."""
+        ren = self._screen
+        width, height = self.term_size
+        editor = self._editor
+        buffer = self._buffer
+        rows = height - self._reserved_lines
+        textw = max(width - 1, 1)
+        wrap = buffer.wrap_index(textw)
+        damage, _ = buffer.take_damage()
+        for line in damage:
+            if line < buffer.size:
+                buffer.measure(line)
+        # Rows shift whenever a line rewraps, wrapped frames always repaint
+        self.invalidate()
+
+        ccell = cvrow = 0
+        if buffer.size:
+            if self._cursor.col > buffer.sizeof_line(self._cursor.row):
+                self._cursor.col = max(buffer.sizeof_line(self._cursor.row) - 1, 0)
+            starts = buffer.measure(self._cursor.row)
+            ccell = buffer.cell_of(self._cursor.row, self._cursor.col)
+            sub = bisect_right(starts, ccell) - 1
+            cvrow = wrap.row_of(self._cursor.row) + sub
+            ccell -= starts[sub]
+        # Keep the cursor on screen, scrolling as little as possible
+        vtop = min(editor.window.vtop, cvrow)
+        if cvrow >= vtop + rows:
+            vtop = cvrow - rows + 1
+
+        line, sub = wrap.find(vtop) if buffer.size else (0, 0)
+        first = line
+        self._highlight(first, first + rows)
+        self._last_pair = self._bracket_pair()
+        spans = editor.selection.spans(buffer, first, first + rows)
+        index = 0
+        while index < rows and line < buffer.size:
+            starts = buffer.measure(line)
+            while sub < len(starts) and index < rows:
+                end = starts[sub + 1] if sub + 1 < len(starts) else starts[sub] + textw
+                self._draw_line(
+                    ren, index, line, spans.get(line), starts[sub], width, end - starts[sub]
                 )
-                if vis_right < (width - 1):
-                    ren.addnstr(
-                        index,
-                        vis_right,
-                        full[vis_right:],
-                        width - vis_right,
-                        0,
-                    )
-            except curses.error:
-                pass
-            return
-
-        # Multi-line selection: determine top/bottom columns
-        top_row = min(sr, er)
-        bot_row = max(sr, er)
-
-        if top_row == s.start_row:
-            top_col = sc
-            bot_col = ec
-        else:
-            top_col = ec
-            bot_col = sc
-
-        top_col = min(top_col, self._buffer.sizeof_line(top_row))
-        bot_col = min(bot_col, self._buffer.sizeof_line(bot_row))
-
-        # If this row is outside selected range, draw normally
-        if relindex < top_row or relindex > bot_row:
-            try:
-                rendered = self._render_cached(buffer_line, width - 1, shift)
-                ren.addnstr(index, 0, rendered, width, 0)
-            except curses.error:
-                pass
-            return
-
-        # Determine left/right selection bounds for this particular row
-        if relindex == top_row:
-            left = top_col
-            right = self._buffer.sizeof_line(relindex)
-        elif relindex == bot_row:
-            left = 0
-            right = bot_col
-        else:
-            left = 0
-            right = self._buffer.sizeof_line(relindex)
-
-        full = self._render_cached(buffer_line, width - 1, shift)
-        vis_left = max(left, shift) - shift
-        vis_right = min(right, shift + (width - 1)) - shift
-        vis_left = max(0, min(vis_left, width - 1))
-        vis_right = max(0, min(vis_right, width - 1))
-        if vis_left >= vis_right:
-            try:
-                ren.addnstr(index, 0, full, width, 0)
-            except curses.error:
-                pass
-            return
-
+                index += 1
+                sub += 1
+            line += 1
+            sub = 0
+        self._rows_drawn = index
+
+        for i in range(max(index, 1), rows):
+            ren.addnstr(i, 0, f"{'~':{width}}", width, Basic.UNCOVERED.pair())
+        editor.window.start = first
+        editor.window.end = line
+        editor.window.shift = 0
+        editor.window.vtop = vtop
+        editor.window.wrap = textw
+        self._moverow = min(cvrow - vtop, rows - 1)
+        self._movecol = min(ccell, textw)
+
+    def _damaged_rows(self, damage: set[int], damage_from: int, minh: int, maxh: int):
+        """Buffer rows within [minh, maxh) that need to be redrawn"""
+        rows = set(damage)
+        # Inserted or deleted lines shift every row below them
+        rows.update(range(max(damage_from, minh), maxh))
+        crow = self._cursor.row
+        rows.update((self._last_cursor_row, crow))
+        self._last_cursor_row = crow
+        selection = self._editor.selection.use()
+        if selection != self._last_selection:
+            marks = [row for row, _ in selection or ()]
+            marks.extend(row for row, _ in self._last_selection or ())
+            rows.update(range(max(min(marks), minh), min(max(marks) + 1, maxh)))
+            self._last_selection = selection
+        pair = self._bracket_pair()
+        if pair != self._last_pair:
+            rows.update(row for row, _ in pair + self._last_pair)
+            self._last_pair = pair
+        return sorted(row for row in rows if minh <= row < maxh)
+
+    def _highlight(self, start: int, end: int) -> int:
+        """Lex the window's lines within the frame's budget, return the
+        first row whose colours changed"""
+        syntax = self._buffer.syntax
+        if syntax is None:
+            return end
+        deadline = monotonic() + STATE["highlight_budget"] / 1000
+        changed = syntax.advance(self._buffer, end, deadline)
+        if self._uncolored:
+            # Rows drawn plain last frame can be coloured now
+            self._uncolored = False
+            return start
+        return changed
+
+    def _bracket_pair(self) -> list[tuple[int, int]]:
+        """The bracket under the cursor and its partner, if it has one"""
+        if not STATE["match_brackets"] or not self._buffer.size:
+            return []
+        row, col = self._cursor.row, self._cursor.col
+        other = self._buffer.match_bracket(row, col)
+        return [(row, col), other] if other else []
+
+    def invalidate(self):
+        """Repaint the whole editor on the next frame"""
+        self._frame = None
+
+    def _draw_line(
+        self,
+        ren,
+        index: int,
+        row: int,
+        span: tuple[int, int] | None,
+        shift: int,
+        width: int,
+        cells: int = 0,
+    ):
+        """Draw a single buffer row with its syntax colours, highlighting
+        search matches, the cursor's bracket pair and the selected `span` columns.
+
+        `cells` limits the row to a soft-wrapped segment of the line."""
+        limit = cells or width - 1
+        full = self._render_cached(row, limit, shift)
+        if cells:
+            full += " " * (width - 1 - cells)
+        marks = []
+        if self._buffer.syntax is not None:
+            colours = self._buffer.syntax.spans(self._buffer, row)
+            if colours is None:
+                self._uncolored = True
+            else:
+                marks.extend(colours)
+        marks.extend(
+            (left, right, Basic.SEARCH_MATCH.pair())
+            for left, right in self._editor.search.spans(self._buffer[row])
+        )
+        marks.extend(
+            (col, col + 1, Basic.BRACKET_MATCH.pair())
+            for other, col in self._last_pair if other == row
+        )
+        if span is not None:
+            marks.append((*span, Basic.FNBUFFER_SELECTION.pair()))
+        wide = self._buffer.cells(row) is not None
         try:
-            if vis_left > 0:
-                ren.addnstr(
-                    index,
-                    0,
-                    full[:vis_left],
-                    vis_left,
-                    0,
-                )
-            ren.addnstr(
-                index,
-                vis_left,
-                full[vis_left:vis_right],
-                vis_right - vis_left,
-                Basic.FNBUFFER_SELECTION.pair(),
-            )
-            if vis_right < (width - 1):
-                ren.addnstr(
-                    index,
-                    vis_right,
-                    full[vis_right:],
-                    width - vis_right,
-                    0,
-                )
+            ren.addnstr(index, 0, full, width, 0)
+            for left, right, attr in marks:
+                if wide:
+                    left = self._buffer.cell_of(row, left)
+                    right = self._buffer.cell_of(row, right)
+                # Visible cells of the span, then where they are in `full`
+                vis_left = max(0, min(max(left, shift) - shift, limit))
+                vis_right = max(0, min(min(right, shift + limit) - shift, limit))
+                if vis_left >= vis_right:
+                    continue
+                start, end = vis_left, vis_right
+                if not full.isascii():
+                    start = cell_index(full, vis_left)
+                    end = cell_index(full, vis_right)
+                ren.addnstr(index, vis_left, full[start:end], end - start, attr)
         except curses.error:
             pass
 
@@ -397,11 +586,14 @@ class Root(Scene):
             )
 
     def draw(self) -> None | ReturnType:
+        self._follow_buffers()
         width, height = self.term_size
         ren = self._screen
 
         fname = self._buffer.filename + ("*" if self._buffer.dirty else "")
         fst = f" | {self._status.get()}" if self._status.get() != "" else ""
+        if self._buffer.loading:
+            fst += f" | indexing {self._buffer.load_progress:.0%} (ESC to cancel)"
         filestatus = fname + fst
         ren.addnstr(
             height - 2, 0, f"{filestatus:{width}}", width, self._mode.theme.pair()
@@ -409,6 +601,14 @@ class Root(Scene):
         self.update_panels()
         self.show_status()
         self.draw_editor()
+        self._update_timeout()
+
+    def _clamp_cursor(self):
+        """Keep the cursor inside the buffer"""
+        self._cursor.row = max(min(self._cursor.row, self._buffer.size - 1), 0)
+        if self._buffer.size:
+            last = max(self._buffer.sizeof_line(self._cursor.row) - 1, 0)
+            self._cursor.col = min(self._cursor.col, last)
 
     def _check_bufferline(self, nextline: int):
         ccol = self._cursor.col
@@ -422,9 +622,13 @@ class Root(Scene):
         curses.set_escdelay(1)
         if self.use_mouse:
             use_mice()
+        if STATE["bracketed_paste"]:
+            use_bracketed_paste()
         command.use_screen(self._screen)
         command.use_editor(self._editor)
+        command.use_buffers(self._buffers)
         self._mode.on_enter(self._editor)
+        self._update_timeout()
         width = 64
         self._panels["debug"] = Panel(
             DEBUG_TEMPLATE.count("\n") + 2,
@@ -442,9 +646,37 @@ class Root(Scene):
             if panel:
                 panel.hide()
         set_cursor(0)
+        # Journals of unsaved changes are kept for the next session
+        self._buffers.close()
+        substitute.shutdown()
+        if STATE["bracketed_paste"]:
+            disable_bracketed_paste()
+
+    def _update_timeout(self):
+        """Wake up periodically while indexing or waiting on a key sequence"""
+        timeout = -1
+        if self._buffer.loading or self._buffer.indexing_brackets:
+            # Repaint indexing progress, or the bracket pair once it is found
+            timeout = LOADING_POLL
+        if self._mode.pending:
+            timeout = STATE["key_timeout"] if timeout == -1 else min(timeout, STATE["key_timeout"])
+        if self._uncolored:
+            # Lex the rows drawn plain as soon as no key is waiting
+            timeout = 0
+        elif self._editor.search.busy:
+            # Keep scanning for the match, without spinning between chunks
+            timeout = SCAN_POLL if timeout == -1 else min(timeout, SCAN_POLL)
+        elif self._editor.search.counting:
+            timeout = SEARCH_POLL if timeout == -1 else min(timeout, SEARCH_POLL)
+        if timeout != self._timeout:
+            self._timeout = timeout
+            self._screen.timeout(timeout)
 
     def keymap_override(self, key: int) -> ReturnType:
-        ret: ReturnType | ReturnInfo[Modes] = self._mode.handle_key(key, self._editor)
+        return self._switch_mode(self._mode.handle_key(key, self._editor))
+
+    def _switch_mode(self, ret: "ReturnType | ReturnInfo[Modes]") -> ReturnType:
+        """Switch to the mode carried by an OVERRIDE result"""
         if isinstance(ret, ReturnType):
             return ret
         if ret.type != ReturnType.OVERRIDE:
@@ -457,15 +689,91 @@ class Root(Scene):
             )
         if isinstance(self._mode, HelpMode):  # on exit
             self._panels["help"] = None
+        self.invalidate()
         self._mode.on_exit(self._editor)
+        # Changes made in different modes, like two insert sessions, stay apart
+        self._editor.history.seal()
+        # Modes are shared instances from the registry, switch by reference
         self._mode = ret.additional_info
+        self._mode.reset()
         self._editor.mode[0] = self._mode
 
         if isinstance(self._mode, HelpMode):  # on enter
             self.init_help()
         return self._mode.on_enter(self._editor)
 
+    def _read_paste(self) -> str | None:
+        """Read a bracketed paste after ESC, None when the ESC is a plain key"""
+        screen = self._screen
+        screen.timeout(0)
+        seen: list[int] = []
+        for char in PASTE_START:
+            seen.append(screen.getch())
+            if seen[-1] != ord(char):
+                for key in reversed(seen):
+                    if key != -1:
+                        curses.ungetch(key)
+                screen.timeout(self._timeout)
+                return None
+        data = bytearray()
+        screen.timeout(PASTE_POLL)
+        while not data.endswith(PASTE_END):
+            key = screen.getch()
+            if key == -1:  # the terminal stopped mid-paste
+                break
+            if key < 256:
+                data.append(key)
+        screen.timeout(self._timeout)
+        text = data.removesuffix(PASTE_END).decode("utf-8", "replace")
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
     def handle_key(self, key: int) -> ReturnType | SceneResult:
+        ret = self._handle_one(key)
+        if key != -1 and STATE["frame_budget"] > 0:
+            ret = self._drain_input(ret)
+        if self._mode is registry.get("normal"):
+            # Normal mode has no edit in flight, the buffer matches history
+            self._editor.history.checkpoint(self._buffer)
+        return ret
+
+    def _drain_input(self, ret: ReturnType | SceneResult) -> ReturnType | SceneResult:
+        """Apply keys that are already queued before painting again, until
+        the frame budget runs out"""
+        deadline = monotonic() + STATE["frame_budget"] / 1000
+        while ret in (ReturnType.OK, ReturnType.CONTINUE) and monotonic() < deadline:
+            self._screen.timeout(0)
+            key = self._screen.getch()
+            if key == -1:
+                break
+            if key == curses.KEY_RESIZE:  # leave it to the scene loop
+                curses.ungetch(key)
+                break
+            ret = self._handle_one(key)
+        self._screen.timeout(self._timeout)
+        return ret
+
+    def _handle_one(self, key: int) -> ReturnType | SceneResult:
+        """Apply a single key to the editor"""
+        # Keys queued behind a command that switched files go to the new one
+        self._follow_buffers()
+        if key == -1:  # input poll timed out
+            self._editor.search.step(self._editor)
+            return self._switch_mode(self._mode.expire(self._editor))
+        if self._mode is registry.get("normal") and not self._mode.pending:
+            # A new normal-mode command, it is undone apart from the last one
+            self._editor.history.seal()
+        if key == const.KEY_ESC and STATE["bracketed_paste"]:
+            text = self._read_paste()
+            if text is not None:
+                self._status.set("")
+                return self._switch_mode(self._mode.on_paste(text, self._editor))
+        if (
+            key == const.KEY_ESC
+            and self._buffer.loading
+            and self._mode is registry.get("normal")
+            and not self._mode.prompting  # type: ignore
+        ):
+            return self._cancel_load()
         self._debug.key = key
         self._status.set("")
         return super().handle_key(key)
@@ -474,14 +782,13 @@ class Root(Scene):
 def init():
     """init"""
     filename = "untitled.txt" if len(argv) == 1 else argv[1]
-    try:
-        st = stat(filename)
-        if st.st_size > MAX_SIZE:
-            print(f"File {filename} must not be bigger than 1MB")
-            sys.exit(1)
-    except FileNotFoundError:
-        pass
-    return Root(filename), theme
+    recover = False
+    if STATE["journal"] and has_journal(filename):
+        answer = input(
+            f"{filename} has unsaved changes from an earlier session, recover them? [y/N] "
+        )
+        recover = answer.strip().lower() in ("y", "yes")
+    return Root(filename, recover, argv[2:]), theme
 
 
 if __name__ == "__main__":